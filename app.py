@@ -1,25 +1,48 @@
-import requests
-
 import fhir_client as fhir
-from flask import Flask, render_template, request, redirect, url_for, abort, session, flash
+import fhir_cache
+import cache_backends
+from flask import Flask, render_template, request, redirect, url_for, abort, session, flash, g, jsonify, make_response, \
+    Response, stream_with_context
 from werkzeug.exceptions import HTTPException
+import click
 from datetime import datetime
+import logging
 import os
+import threading
+import time
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from fhir_client import delete_fhir_appointment
 
 # Services & DB-Modelle
 import database_service as ds
+import outbox
+import metrics
+import name_sync
+import user_import
+import reconcile
+import availability
+import page_cache
+import seeding
+import appointment_export
+import schedule_templates
 from database_layer.db_instance import db
 from database_layer.user_entity import User, UserRoles
 from database_layer.appointment_entity import Appointment
 
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+log = logging.getLogger(__name__)
+
 # -----------------------------------
 # App & DB-Setup
 # -----------------------------------
 BASE_DIR = os.path.dirname(__file__)
 DB_PATH = os.path.join(BASE_DIR, "local_storage_dev.db")
-DB_URI = f"sqlite:///{DB_PATH}"
+# DATABASE_URL (z. B. postgresql+psycopg://...) ersetzt die lokale SQLite-Datei
+DB_URI = os.environ.get("DATABASE_URL", f"sqlite:///{DB_PATH}")
 
 app = Flask(__name__)
 app.config["SQLITE_FILEPATH"] = DB_PATH
@@ -32,29 +55,180 @@ app.secret_key = "change-me-in-prod"
 # DB initialisieren / Seed-Daten anlegen
 ds.init(app)
 
-FHIR_BASE_URL = "https://hapi.fhir.org/baseR5"  # dein FHIR-Server
-
-def get_fhir_display_name(user):
+# Hintergrund-Worker laufen nur in einem Prozess: nicht in jedem gunicorn-Worker
+# und nicht bei CLI-Befehlen (flask seed --reset löscht Tabellen). Entweder
+# eigener Prozess "flask workers" oder RUN_BACKGROUND_WORKERS=1 bei nur einem
+# Webprozess; der Entwicklungsserver (python app.py) startet sie selbst.
+app.config["RUN_BACKGROUND_WORKERS"] = os.environ.get("RUN_BACKGROUND_WORKERS", "0") == "1"
+
+
+def start_background_workers():
+    # FHIR-Schreibzugriffe (Outbox) im Hintergrund abarbeiten
+    outbox.start_worker(app)
+    # Anzeigenamen aus FHIR regelmäßig in die lokale Tabelle übernehmen
+    name_sync.start_worker(app)
+    # Termine regelmäßig mit FHIR abgleichen (Stornierungen, fehlende FHIR-IDs)
+    reconcile.start_worker(app)
+
+
+if app.config["RUN_BACKGROUND_WORKERS"]:
+    start_background_workers()
+
+# Datenversionen für ETags und Fragment-Cache (Session-Events)
+page_cache.init_app(app)
+
+# Server-Timing-Header + /metrics (FHIR, SQL, Templates, Outbox, Caches)
+metrics.init_app(app)
+metrics.add_gauge_collector("outbox", outbox.stats)
+metrics.add_gauge_collector("availability", availability.stats)
+metrics.add_gauge_collector("page_cache", page_cache.stats)
+metrics.add_gauge_collector("display_name_cache", fhir_cache.display_names.stats)
+metrics.add_gauge_collector("slot_cache", fhir_cache.slots.stats)
+metrics.add_gauge_collector("fhir_breaker", fhir.breaker.stats)
+metrics.add_gauge_collector("name_sync", name_sync.stats)
+metrics.add_gauge_collector("reconcile", reconcile.stats)
+
+# gemeinsamer, begrenzter Pool für parallele FHIR-Abfragen (Namen + Slots)
+FHIR_LOOKUP_WORKERS = 8
+_fhir_pool = ThreadPoolExecutor(max_workers=FHIR_LOOKUP_WORKERS, thread_name_prefix="fhir-lookup")
+
+# Zeitraum, für den die Buchungsseite freie Slots lädt (ab heute)
+SLOT_WINDOW_DAYS = 14
+
+# so lange wartet eine Seite höchstens auf FHIR (Namen, Slots), danach gilt der Cache
+FHIR_PAGE_TIMEOUT = float(os.environ.get("FHIR_PAGE_TIMEOUT", "2.0"))
+
+
+def _mark_degraded():
+    # Seite zeigt veraltete Daten aus dem Cache (FHIR-Server langsam/nicht erreichbar)
+    g.fhir_degraded = True
+
+
+def _fhir_name_key(user):
+    if user.role == UserRoles.patient:
+        return fhir_cache.display_name_key("Patient", user.fhir_patient_id)
+    return fhir_cache.display_name_key("Practitioner", user.fhir_practitioner_id)
+
+
+def _wait_for_names(waiting: set, deadline: float) -> dict:
+    """Namen, die gerade ein anderer Request/Worker lädt: bis deadline auf den Cache warten."""
+    found = {}
+    while waiting and time.monotonic() < deadline:
+        time.sleep(cache_backends.SINGLE_FLIGHT_POLL)
+        for key in list(waiting):
+            display = fhir_cache.display_names.get(key)
+            if display is None:
+                token = fhir_cache.display_names.acquire_lease(key, cache_backends.SINGLE_FLIGHT_POLL)
+                if token is None:
+                    continue
+                # der andere ist fertig, ohne Namen (nicht gefunden, Fehler)
+                fhir_cache.display_names.release_lease(key, token)
+            else:
+                found[key] = display
+            waiting.discard(key)
+    return found
+
+
+def resolve_display_names(users):
+    """
+    Anzeigenamen für viele User auf einmal: Cache-Treffer sofort, dann eine
+    Abfrage auf die lokale Namenstabelle, nur der Rest mit einer
+    "_id=a,b,c"-Suche pro Ressourcentyp, parallel im Pool.
+    Jeden fehlenden Namen lädt nur ein Request gleichzeitig (Lease im
+    Namens-Cache, auch zwischen Workern); die anderen warten auf den Cache.
+    Ist FHIR nicht erreichbar (Breaker offen, Fehler, Timeout), kommt der
+    letzte bekannte Name aus dem Cache, auch wenn er abgelaufen ist.
+    Rückgabe: {user.id: display_name}
+    """
+    keys = {u.id: _fhir_name_key(u) for u in users}
+
+    names = {}
+    not_cached = set()
+    for uid, key in keys.items():
+        cached = fhir_cache.display_names.get(key)
+        if cached is not None:
+            names[key] = cached
+        elif key[1] not in ("", "None"):
+            not_cached.add(key)
+
+    stored = name_sync.lookup_names(not_cached)
+    for key, display in stored.items():
+        fhir_cache.display_names.set(key, display)
+        names[key] = display
+
+    missing = {}  # resource_type -> [fhir_id, ...], von diesem Request zu laden
+    leases = {}  # key -> Lease-Token
+    waiting = set()  # lädt gerade ein anderer Request/Worker
+    unresolved = sorted(not_cached - stored.keys())
+    if unresolved and fhir.is_degraded():
+        unresolved = []  # Breaker offen: gar nicht erst fragen
+        _mark_degraded()
+    for key in unresolved:
+        token = fhir_cache.display_names.acquire_lease(key, cache_backends.SINGLE_FLIGHT_LEASE)
+        if token is None:
+            waiting.add(key)
+        else:
+            leases[key] = token
+            missing.setdefault(key[0], []).append(key[1])
+
+    deadline = time.monotonic() + FHIR_PAGE_TIMEOUT
+    futures = {}  # future -> (resource_type, chunk)
+    for resource_type, ids in missing.items():
+        for i in range(0, len(ids), fhir.NAME_SEARCH_CHUNK):
+            chunk = ids[i:i + fhir.NAME_SEARCH_CHUNK]
+            future = _fhir_pool.submit(metrics.bind(fhir.search_display_names), resource_type, chunk)
+            futures[future] = (resource_type, chunk)
+
+    fetched = {}  # resource_type -> {fhir_id: display}
+    for future, (resource_type, _) in futures.items():
+        try:
+            found = future.result(timeout=FHIR_PAGE_TIMEOUT)
+        except Exception as e:
+            log.warning("Failed to fetch %s names from FHIR: %s", resource_type, e)
+            _mark_degraded()
+            continue
+        fetched.setdefault(resource_type, {}).update(found)
+        for fhir_id, display in found.items():
+            names[fhir_cache.display_name_key(resource_type, fhir_id)] = display
+            fhir_cache.remember_display_name(resource_type, fhir_id, display)
+
+    # neu geholte Namen lokal ablegen (aktualisiert auch den Cache)
     try:
-        fhir_id = (
-            user.fhir_patient_id if user.role == UserRoles.patient
-            else user.fhir_practitioner_id
-        )
+        name_sync.save_fetched_names(fetched)
+    except Exception as e:
+        log.warning("Failed to store display names: %s", e)
+
+    # Leases erst freigeben, wenn die Namen im Cache liegen; noch laufende Suchen
+    # geben beim Ende frei (add_done_callback ruft fertige Futures sofort auf)
+    for future, (resource_type, chunk) in futures.items():
+        chunk_leases = [(key, leases[key]) for key in (fhir_cache.display_name_key(resource_type, i) for i in chunk)]
+
+        def release(_future, chunk_leases=chunk_leases):
+            for key, token in chunk_leases:
+                fhir_cache.display_names.release_lease(key, token)
+
+        future.add_done_callback(release)
 
-        resource_type = "Patient" if user.role == UserRoles.patient else "Practitioner"
-        url = f"{FHIR_BASE_URL}/{resource_type}/{fhir_id}"
-        data = requests.get(url).json()
+    names.update(_wait_for_names(waiting, deadline))
 
-        name_obj = data.get("name", [{"text": "Unbekannt"}])[0]
+    out = {}
+    for uid, key in keys.items():
+        name = names.get(key)
+        if name is None:
+            # nicht geladen: letzten bekannten Namen zeigen
+            name = fhir_cache.display_names.get(key, allow_stale=True)
+            if name is not None:
+                _mark_degraded()
+        out[uid] = name or "Unbekannt"
+    return out
 
-        # bevorzugte Darstellung
-        display = (
-                name_obj.get("text")
-                or " ".join(name_obj.get("given", [])) + " " + name_obj.get("family", "")
-        )
-        return display.strip()
-    except:
-        return "Unbekannt"
+
+def _render_user_options(users):
+    """<option>-Liste (E-Mail, Anzeigename) für die GDA- bzw. Patientenauswahl."""
+    names = resolve_display_names(users)
+    return render_template("booking_options.html", options=[
+        {"email": u.email, "display_name": names[u.id]} for u in users
+    ])
 
 
 # Zugriff auf User-Seite nur mit Login
@@ -66,6 +240,14 @@ def protect_user_pages():
             return redirect(url_for("landing_page"))
 
 
+# im Debug-/Testbetrieb sichtbar machen, wie oft pro Request User geladen wurden
+@app.after_request
+def add_user_query_header(response):
+    if app.debug or app.testing:
+        response.headers["X-User-Queries"] = str(ds.user_query_count())
+    return response
+
+
 # -----------------------------------
 # Routes
 # -----------------------------------
@@ -94,56 +276,104 @@ def bookings(username):
         if not user:
             abort(401)
 
-        # ... (Code zum Ermitteln des Namens bleibt gleich)
-        display_name = get_fhir_display_name(user)
-        first_name = display_name.split(" ", 1)[0]
-        last_name = display_name.split(" ", 1)[-1]
-
         # --- GET ANFRAGE ---
-  # --- GET ANFRAGE ---
 
         if request.method == "GET":
-            appointments = ds.fetch_appointments_by_email(username)
-
-            gda_list = ds.fetch_all_gdas().all()
-            # 1. FHIR GDA Daten vorbereiten (muss schedule_id enthalten)
-            fhir_gdas = [
-                # Hole die fhir_schedule_id (muss in Ihrer User-Entität existieren)
-                {"email": g.email,
-                 "display_name": get_fhir_display_name(g),
-                 "fhir_schedule_id": getattr(g, 'fhir_schedule_id', None)
-                 }
-                for g in gda_list
-            ]
-            fhir_patients = [
-                {"email": p.email, "display_name": get_fhir_display_name(p)}
-                for p in ds.fetch_all_patients().all()
-            ]
+            # Termine seitenweise (Keyset): ?window=upcoming|past&after=<cursor>
+            window = "past" if request.args.get("window") == "past" else "upcoming"
+            versions = page_cache.versions()
 
-            # 2. Slots für den ersten GDA abrufen (Standardansicht)
+            # 1. Slots für den ersten GDA (Standardansicht) im Pool anfragen, sie gehören zum ETag
             available_slots = []
-            first_gda_schedule_id = fhir_gdas[0]["fhir_schedule_id"] if fhir_gdas else None
+            first_gda_schedule_id = page_cache.cached_value(
+                ("first_gda_schedule", versions["users"]),
+                ds.first_gda_schedule_id,
+            )
+            window_start = datetime.now().date()
+            window_end = window_start + timedelta(days=SLOT_WINDOW_DAYS)
+            slots_future = (
+                _fhir_pool.submit(metrics.bind(fhir.get_slots_by_schedule), first_gda_schedule_id, window_start, window_end)
+                if first_gda_schedule_id else None
+            )
 
-            if first_gda_schedule_id:
+            # 2. Währenddessen Termine laden und Namen (eigener + Gegenüber) gebündelt auflösen
+            after = ds.decode_cursor(request.args.get("after"))
+            appointments, next_cursor = ds.fetch_appointments_page(user, window, after)
+            counterparts = [
+                a.provider if user.role == UserRoles.patient else a.patient
+                for a in appointments
+            ]
+            names = resolve_display_names([user, *filter(None, counterparts)])
+            display_name = names[user.id]
+            first_name = display_name.split(" ", 1)[0]
+            last_name = display_name.split(" ", 1)[-1]
+
+            if slots_future is not None:
                 try:
                     # Aufruf der FHIR-Funktion, die die Slots zurückgibt
-                    available_slots = fhir.get_slots_by_schedule(first_gda_schedule_id)
+                    available_slots = slots_future.result(timeout=FHIR_PAGE_TIMEOUT)
                 except Exception as e:
-                    print(f"Failed to fetch slots from FHIR: {e}")
+                    log.warning("Failed to fetch slots from FHIR: %s", e)
+                    available_slots = fhir.stale_slots(first_gda_schedule_id, window_start, window_end) or []
+                    _mark_degraded()
+                if any(s.get("stale") for s in available_slots):
+                    _mark_degraded()
+            slots_version = page_cache.weak_etag(*(s["id"] for s in available_slots))
+            slot_window = (fhir_cache.slots.get(first_gda_schedule_id, window_start, window_end, allow_stale=True)
+                           if first_gda_schedule_id else None)
+
+            # 3. Wiederholter Besuch ohne Änderungen: 304 ohne Rendering. Die Versionen
+            #    erst jetzt lesen: resolve_display_names kann gerade Namen gespeichert haben.
+            #    Seiten aus dem Cache (FHIR gestört) bekommen keinen Validator.
+            def validators(versions):
+                etag = page_cache.weak_etag(user.id, user.role.name, request.full_path, window_start,
+                                            *versions.values(), slots_version)
+                modified = page_cache.last_modified(*versions.values(), slot_window and slot_window.last_updated)
+                return etag, modified
+
+            versions = page_cache.versions()
+            degraded = g.get("fhir_degraded", False) or fhir.is_degraded()
+            cacheable = not degraded and not session.get("_flashes")
+            etag, modified = validators(versions)
+            if cacheable and page_cache.is_not_modified(etag, modified):
+                return page_cache.make_conditional(app.response_class(status=304), etag, modified)
+
+            # 4. Auswahllisten und Slots sind für alle User gleich: gerendert zwischenspeichern
+            if user.role == UserRoles.patient:
+                select_options = page_cache.fragment(
+                    ("gda_options", versions["users"], versions["names"]),
+                    lambda: _render_user_options(ds.fetch_all_gdas().all()),
+                )
+            else:
+                select_options = page_cache.fragment(
+                    ("patient_options", versions["users"], versions["names"]),
+                    lambda: _render_user_options(ds.fetch_all_patients().all()),
+                )
+            slot_list = page_cache.fragment(
+                ("slot_list", first_gda_schedule_id, slots_version),
+                lambda: render_template("booking_slots.html", available_slots=available_slots),
+            )
 
-            # 3. Slots an das Template übergeben
-            return render_template(
+            # 5. Slots an das Template übergeben
+            response = make_response(render_template(
                 "booking.html",
                 user=user,
                 user_first_name=first_name,
                 user_last_name=last_name,
                 appointments=appointments,
-                gdas=fhir_gdas,
-                patients=fhir_patients,
-                get_fhir_display_name=get_fhir_display_name,
+                appointment_names=names,
+                appointments_window=window,
+                next_cursor=next_cursor,
+                select_options=select_options,
+                slot_list=slot_list,
                 UserRoles=UserRoles,
-                available_slots=available_slots  # ⬅️ Hinzugefügt
-            )
+                fhir_degraded=g.get("fhir_degraded", False) or fhir.is_degraded(),
+            ))
+            if cacheable and not g.get("fhir_degraded", False):
+                # die Auswahllisten können weitere Namen gespeichert haben: sonst wäre
+                # das ETag schon beim nächsten Besuch veraltet
+                page_cache.make_conditional(response, *validators(page_cache.versions()))
+            return response
   # --- POST ANFRAGE ---
 
 
@@ -160,8 +390,7 @@ def bookings(username):
             start_dt = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M")
             end_dt = datetime.strptime(f"{date} {end_time}", "%Y-%m-%d %H:%M")
 
-            # Patient / Provider IDs ermitteln
-            user = ds.fetch_user_by_email(username)
+            # Patient / Provider IDs ermitteln (user ist schon geladen)
             if user.role == UserRoles.patient:
                 patient_id = user.id
                 provider_email = request.form.get("gda")
@@ -179,7 +408,7 @@ def bookings(username):
                 flash("Termin erfolgreich gebucht!", "success")
             except Exception as e:
                 flash(f"Fehler beim Buchen des Termins: {e}", "error")
-                print("Appointment creation failed:", e)
+                log.warning("Appointment creation failed: %s", e)
 
             return redirect(url_for("bookings", username=username))
 
@@ -211,8 +440,9 @@ def add_user():
         # fhir patient wird erstellt
         fhir_id = fhir.create_patient(first_name=first_name, last_name=last_name, email=email)
 
-        # FHIR ID im lokalen User-Objekt speichern
+        # FHIR ID im lokalen User-Objekt speichern, Namen gleich mit (spart den FHIR-Read)
         new_user.fhir_patient_id = fhir_id
+        name_sync.store_names("Patient", {fhir_id: f"{first_name} {last_name}"})
         db.session.commit()
 
         #direkt einloggen
@@ -245,6 +475,191 @@ def logout():
     return redirect(url_for("landing_page"))
 
 
+@app.route("/api/availability")
+def api_availability():
+    """
+    Freie Zeiten mehrerer GDAs als JSON, aus den Frei/Belegt-Bitmaps:
+    ?provider=a@x.org&provider=b@x.org&from=2025-01-06&to=2025-01-10[&duration=30][&mode=any|all]
+    Ohne provider: alle GDAs. Ohne from/to: heute bis SLOT_WINDOW_DAYS.
+    """
+    if "user_email" not in session:
+        return jsonify(error="login required"), 401
+    try:
+        start_day = datetime.strptime(request.args["from"], "%Y-%m-%d").date() \
+            if request.args.get("from") else datetime.now().date()
+        end_day = datetime.strptime(request.args["to"], "%Y-%m-%d").date() \
+            if request.args.get("to") else start_day + timedelta(days=SLOT_WINDOW_DAYS - 1)
+        duration = int(request.args["duration"]) if request.args.get("duration") else None
+    except ValueError as e:
+        return jsonify(error=f"invalid parameter: {e}"), 400
+    mode = request.args.get("mode", "any")
+    if mode not in ("any", "all") or end_day < start_day or (duration is not None and duration <= 0):
+        return jsonify(error="invalid parameter"), 400
+    if (end_day - start_day).days >= availability.AVAILABILITY_MAX_DAYS:
+        return jsonify(error=f"range too large (max {availability.AVAILABILITY_MAX_DAYS} days)"), 400
+
+    emails = [e for v in request.args.getlist("provider") for e in v.split(",") if e]
+    providers = availability.providers_by_email(emails)
+    if emails and len(providers) != len(set(emails)):
+        unknown = sorted(set(emails) - {p.email for p in providers})
+        return jsonify(error=f"unknown provider: {', '.join(unknown)}"), 404
+    try:
+        result = availability.find_availability(providers, start_day, end_day, duration, mode)
+    except Exception as e:
+        log.warning("Availability lookup failed: %s", e)
+        return jsonify(error="FHIR unavailable"), 503
+    return jsonify(start=start_day.isoformat(), end=end_day.isoformat(), mode=mode, **result)
+
+
+def _parse_day(value: str | None) -> datetime | None:
+    return datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+@app.route("/export/appointments")
+def export_appointments():
+    """
+    Die eigenen Termine eines GDA als Download, gestreamt (konstanter Speicher).
+    Alle Termine exportiert nur die CLI (flask export-appointments).
+    ?format=ndjson|csv|fhir&from=YYYY-MM-DD&to=YYYY-MM-DD
+    """
+    if "user_email" not in session:
+        abort(401)
+    if session.get("user_role") != UserRoles.gda.name:
+        abort(403)
+    user = ds.fetch_user_by_email(session["user_email"])
+    if not user or user.role != UserRoles.gda:
+        abort(403)
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in appointment_export.EXPORT_FORMATS:
+        abort(400, description=f"format must be one of {', '.join(appointment_export.EXPORT_FORMATS)}")
+    try:
+        start, end = _parse_day(request.args.get("from")), _parse_day(request.args.get("to"))
+    except ValueError:
+        abort(400, description="from/to must be YYYY-MM-DD")
+
+    extension = "csv" if fmt == "csv" else "ndjson"
+    return Response(
+        stream_with_context(appointment_export.stream(fmt, start, end, provider_id=user.id)),
+        mimetype=appointment_export.MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=appointments.{extension}"},
+    )
+
+
+@app.cli.command("workers")
+def run_workers():
+    """Startet Outbox, Namens- und Terminabgleich und läuft bis Strg+C (ein Prozess pro Deployment)."""
+    start_background_workers()
+    print("background workers running (outbox, name_sync, reconcile)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+@app.cli.command("outbox-status")
+def outbox_status():
+    """Zeigt Queue-Tiefe und Verzögerung der FHIR-Outbox."""
+    for key, value in outbox.stats().items():
+        print(f"{key}: {value}")
+
+
+@app.cli.command("outbox-run")
+def outbox_run():
+    """Arbeitet alle fälligen Outbox-Einträge einmal ab (ohne Hintergrund-Thread)."""
+    total = 0
+    while (n := outbox.process_pending()) > 0:
+        total += n
+    print(f"processed: {total}")
+
+
+@app.cli.command("names-sync")
+@click.option("--full", is_flag=True, help="Alle bekannten IDs neu laden statt nur Änderungen.")
+def names_sync(full):
+    """Gleicht die lokalen Anzeigenamen einmal mit FHIR ab."""
+    for resource_type, result in name_sync.sync_names(full=full).items():
+        print(f"{resource_type}: {result}")
+
+
+@app.cli.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), help="Standard: nach Dateiendung.")
+@click.option("--chunk-size", default=user_import.IMPORT_CHUNK_SIZE, show_default=True)
+@click.option("--restart", is_flag=True, help="Checkpoint verwerfen und von vorn beginnen.")
+def import_users(path, fmt, chunk_size, restart):
+    """Importiert Patienten aus CSV/NDJSON (FHIR-Batch + Bulk-Insert, fortsetzbar)."""
+    for key, value in user_import.import_users(path, fmt, chunk_size, restart).items():
+        print(f"{key}: {value}")
+
+
+@app.cli.command("reconcile")
+@click.option("--full", is_flag=True, help="Cursor ignorieren und alle FHIR-Appointments prüfen.")
+@click.option("--verify", is_flag=True, help="Zusätzlich alle lokalen FHIR-IDs auf FHIR prüfen.")
+@click.option("--apply-deletes", is_flag=True, help="Mit --verify: auf FHIR gelöschte Termine lokal löschen.")
+def reconcile_appointments(full, verify, apply_deletes):
+    """Gleicht lokale Termine und FHIR-Appointments ab (nur Änderungen seit dem letzten Lauf)."""
+    result = reconcile.reconcile(full=full)
+    if not result:
+        print("skipped: another process is reconciling")
+        return
+    if verify:
+        for key, value in reconcile.verify_local(apply=apply_deletes).items():
+            result[key] += value
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+@app.cli.command("seed")
+@click.option("--reset", is_flag=True, help="Alle Tabellen löschen und neu anlegen, dann befüllen.")
+def seed(reset):
+    """Beispiel-User anlegen und fehlende FHIR-Schedules/Slots ergänzen (bedingt, parallel)."""
+    started = time.perf_counter()
+    if reset:
+        db.drop_all()
+        ds.ensure_schema(force=True)
+    report = seeding.seed()
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    print(f"total_seconds: {time.perf_counter() - started:.2f}")
+    if report["providers_failed"]:
+        raise SystemExit(1)
+
+
+@app.cli.command("export-appointments")
+@click.argument("path", type=click.Path(dir_okay=False, allow_dash=True), default="-")
+@click.option("--format", "fmt", type=click.Choice(appointment_export.EXPORT_FORMATS), default="ndjson",
+              show_default=True, help="fhir = FHIR-Bulk-NDJSON (Appointment-Ressourcen).")
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), help="Termine ab diesem Tag.")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), help="Termine vor diesem Tag.")
+@click.option("--chunk-size", default=appointment_export.EXPORT_CHUNK_SIZE, show_default=True)
+def export_appointments_cli(path, fmt, start, end, chunk_size):
+    """Exportiert alle Termine gestreamt in eine Datei (oder '-' für stdout)."""
+    started = time.perf_counter()
+    size = 0
+    with click.open_file(path, "w", encoding="utf-8", newline="") as out:
+        for block in appointment_export.stream(fmt, start, end, chunk_size):
+            out.write(block)
+            size += len(block)
+    if path != "-":
+        print(f"wrote {size} characters to {path} in {time.perf_counter() - started:.2f} s")
+
+
+@app.cli.command("generate-slots")
+@click.argument("template", type=click.Path(exists=True, dir_okay=False))
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), required=True, help="Erster Tag.")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), required=True, help="Tag nach dem letzten.")
+@click.option("--provider", "emails", multiple=True, help="Nur diese GDAs (E-Mail); Standard: alle.")
+@click.option("--dry-run", is_flag=True, help="Nur berechnen, nichts in FHIR anlegen.")
+def generate_slots(template, start, end, emails, dry_run):
+    """Erzeugt freie Slots aus einer Wochenvorlage (JSON) abzüglich gebuchter Termine."""
+    providers = ds.fetch_all_gdas()
+    if emails:
+        providers = providers.filter(User.email.in_(emails))
+    report = schedule_templates.generate_slots(
+        schedule_templates.ScheduleTemplate.load(template), providers.all(), start, end, dry_run=dry_run)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
 # Fehlerseiten
 @app.errorhandler(HTTPException)
 def handle_http_exception(e):
@@ -260,5 +675,8 @@ def handle_http_exception(e):
 
 
 if __name__ == "__main__":
-    print("USING DB:", DB_PATH)
+    log.info("Using DB: %s", DB_URI)
+    # mit Reloader nur im Kindprozess, der wirklich bedient
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true" and not app.config["RUN_BACKGROUND_WORKERS"]:
+        start_background_workers()
     app.run(host="0.0.0.0", debug=True)
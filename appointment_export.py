@@ -0,0 +1,142 @@
+# appointment_export.py
+"""
+Streaming-Export der Termine als NDJSON, CSV oder FHIR-Bulk-NDJSON.
+
+Eine Abfrage (appointments + users für beide Seiten) mit serverseitigem
+Cursor: yield_per liefert EXPORT_CHUNK_SIZE Zeilen pro Block, jeder Block wird
+sofort als Text ausgegeben. Es liegen nie mehr als ein Block Zeilen (keine
+ORM-Objekte) im Speicher - auch bei Millionen Terminen. Die Reihenfolge
+(start, id) liefert ein Index (EXPORT_INDEX) - ohne ihn müsste die Datenbank
+das ganze Ergebnis vor der ersten Zeile sortieren.
+
+Über HTTP exportiert ein GDA nur die eigenen Termine (provider_id), alle
+Termine gibt es nur über die CLI (Betrieb).
+
+    GET /export/appointments?format=ndjson|csv|fhir&from=2025-01-01&to=2025-02-01
+    flask export-appointments termine.ndjson --format fhir
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+import fhir_client as fhir
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.user_entity import User
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = ("ndjson", "csv", "fhir")
+EXPORT_COLUMNS = (
+    "id", "fhir_appointment_id", "start", "end",
+    "patient_email", "patient_fhir_id", "provider_email", "provider_fhir_id",
+)
+LOCAL_IDENTIFIER_SYSTEM = "urn:webb:local-appointment"
+
+EXPORT_INDEX = db.Index("ix_appointments_start_id", Appointment.start, Appointment.id)
+
+MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "fhir": "application/fhir+ndjson",
+}
+
+
+def _iso(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+# ----------------- Lesen -----------------
+
+def export_query(start: datetime | None = None, end: datetime | None = None,
+                 provider_id: int | None = None):
+    """Termine in (start, id)-Reihenfolge, mit E-Mail und FHIR-ID beider Seiten; optional nur eines GDA."""
+    patient, provider = aliased(User), aliased(User)
+    query = (
+        select(
+            Appointment.id, Appointment.fhir_appointment_id, Appointment.start, Appointment.end,
+            patient.email, patient.fhir_patient_id, provider.email, provider.fhir_practitioner_id,
+        )
+        .outerjoin(patient, Appointment.patient_id == patient.id)
+        .outerjoin(provider, Appointment.provider_id == provider.id)
+        .order_by(Appointment.start, Appointment.id)
+    )
+    if start:
+        query = query.where(Appointment.start >= start)
+    if end:
+        query = query.where(Appointment.start < end)
+    if provider_id is not None:
+        query = query.where(Appointment.provider_id == provider_id)
+    return query
+
+
+def iter_chunks(start: datetime | None = None, end: datetime | None = None,
+                chunk_size: int = EXPORT_CHUNK_SIZE, provider_id: int | None = None):
+    """Blöcke von Zeilen-Tupeln (Reihenfolge wie EXPORT_COLUMNS)."""
+    result = db.session.execute(
+        export_query(start, end, provider_id).execution_options(yield_per=chunk_size, stream_results=True))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+# ----------------- Formate -----------------
+
+def _record(row) -> dict:
+    record = dict(zip(EXPORT_COLUMNS, row))
+    record["start"], record["end"] = _iso(record["start"]), _iso(record["end"])
+    return record
+
+
+def fhir_resource(row) -> dict:
+    """Zeile -> FHIR-Appointment (Bulk-Data-Format, eine Ressource pro Zeile)."""
+    r = _record(row)
+    body = fhir.appointment_body(r["patient_fhir_id"], r["provider_fhir_id"],
+                                 row[2], row[3] or row[2], notes="")
+    body.pop("note")
+    body["participant"] = [
+        p for p, fhir_id in zip(body["participant"], (r["patient_fhir_id"], r["provider_fhir_id"])) if fhir_id
+    ]
+    if r["fhir_appointment_id"]:
+        body = {"id": r["fhir_appointment_id"], **body}
+    # noch nicht übertragene Termine (Outbox) über die lokale ID erkennbar
+    body["identifier"] = [{"system": LOCAL_IDENTIFIER_SYSTEM, "value": str(r["id"])}]
+    return body
+
+
+def _ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(_record(row), ensure_ascii=False) + "\n" for row in chunk)
+
+
+def _fhir_ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(fhir_resource(row), ensure_ascii=False) + "\n" for row in chunk)
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows((r[0], r[1], _iso(r[2]), _iso(r[3]), *r[4:]) for r in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream(fmt: str = "ndjson", start: datetime | None = None, end: datetime | None = None,
+           chunk_size: int = EXPORT_CHUNK_SIZE, provider_id: int | None = None):
+    """Generator über Textblöcke des Exports (braucht App-Context bis zum Ende)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    chunks = iter_chunks(start, end, chunk_size, provider_id)
+    return {"ndjson": _ndjson, "csv": _csv, "fhir": _fhir_ndjson}[fmt](chunks)
@@ -0,0 +1,295 @@
+# availability.py
+"""
+Frei/Belegt-Bitmaps pro Provider und Tag für die Verfügbarkeits-API.
+
+Ein Tag ist ein int mit 24*60/AVAILABILITY_STEP Bits (Bit i = Minute i*STEP):
+- free: aus den freien FHIR-Slots (eine Suche über alle Schedules)
+- busy: aus den lokalen Appointments (eine Abfrage)
+verfügbar = free & ~busy. Mehrere Provider werden per OR ("any") bzw.
+AND ("all") verknüpft, passende Startzeiten für eine Dauer von k Schritten per
+avail & (avail >> 1) & … & (avail >> k-1) - alles Bitoperationen, keine
+FHIR-Aufrufe pro Anfrage.
+
+Buchen/Stornieren (database_service) setzen bzw. löschen die busy-Bits direkt;
+die free-Bits verfallen nach AVAILABILITY_TTL und werden dann neu geladen.
+Jede Bitmap merkt sich die Terminversion (page_cache, in der DB), aus der ihre
+busy-Bits stammen. Hat ein anderer Worker seitdem gebucht oder storniert, lädt
+die nächste Anfrage die busy-Bits der betroffenen Tage neu (eine DB-Abfrage,
+kein FHIR-Aufruf) - Buchungen sind damit sofort in allen Workern sichtbar.
+"""
+
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func
+
+import fhir_cache
+import fhir_client as fhir
+import page_cache
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.user_entity import User, UserRoles
+
+log = logging.getLogger(__name__)
+
+AVAILABILITY_STEP = 15  # Minuten pro Bit
+AVAILABILITY_TTL = 5 * 60  # Sekunden, danach free-Bits neu aus FHIR
+AVAILABILITY_MAXSIZE = 50_000  # (provider, tag)-Einträge im Speicher
+AVAILABILITY_MAX_DAYS = 62  # größter abfragbarer Zeitraum
+
+BITS_PER_DAY = 24 * 60 // AVAILABILITY_STEP
+FULL_DAY = (1 << BITS_PER_DAY) - 1
+
+
+class DayBitmap:
+    __slots__ = ("free", "busy", "version")
+
+    def __init__(self, free: int = 0, busy: int = 0, version: str | None = None):
+        self.free = free
+        self.busy = busy
+        self.version = version  # Terminversion der busy-Bits
+
+    @property
+    def available(self) -> int:
+        return self.free & ~self.busy & FULL_DAY
+
+
+_days = fhir_cache.TTLCache(maxsize=AVAILABILITY_MAXSIZE, ttl=AVAILABILITY_TTL)
+_load_lock = threading.Lock()
+_state = {"loads": 0, "busy_reloads": 0, "changes": 0}  # changes: Buchungen/Stornos seit Start
+
+
+# ----------------- Bits <-> Zeiten -----------------
+
+def _minutes(dt: datetime) -> int:
+    return dt.hour * 60 + dt.minute
+
+
+def interval_mask(start_minute: int, end_minute: int, inner: bool) -> int:
+    """
+    Bits für [start, end) eines Tages. inner=True: nur vollständig enthaltene
+    Schritte (für freie Slots), sonst alle berührten (für Termine).
+    """
+    if inner:
+        first, last = -(-start_minute // AVAILABILITY_STEP), end_minute // AVAILABILITY_STEP
+    else:
+        first, last = start_minute // AVAILABILITY_STEP, -(-end_minute // AVAILABILITY_STEP)
+    first, last = max(first, 0), min(last, BITS_PER_DAY)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def _day_pieces(start: datetime, end: datetime):
+    """Teilt [start, end) an Mitternacht: (tag, start_minute, end_minute)."""
+    while start < end:
+        day_end = datetime.combine(start.date() + timedelta(days=1), time())
+        piece_end = min(end, day_end)
+        yield start.date(), _minutes(start), 24 * 60 if piece_end == day_end else _minutes(piece_end)
+        start = piece_end
+
+
+def runs(bits: int) -> list[tuple[int, int]]:
+    """Zusammenhängende 1-Bereiche als (erstes_bit, letztes_bit_exklusiv)."""
+    out = []
+    while bits:
+        first = (bits & -bits).bit_length() - 1
+        # Lauf endet am ersten 0-Bit oberhalb von 'first'
+        length = (~(bits >> first) & ((bits >> first) + 1)).bit_length() - 1
+        out.append((first, first + length))
+        bits &= ~(((1 << length) - 1) << first)
+    return out
+
+
+def fitting_starts(bits: int, steps: int) -> int:
+    """Bits, an denen ein Block von 'steps' freien Schritten beginnen kann."""
+    out = bits
+    for i in range(1, steps):
+        out &= bits >> i
+    return out
+
+
+def _bit_time(day: date, bit: int) -> datetime:
+    return datetime.combine(day, time()) + timedelta(minutes=bit * AVAILABILITY_STEP)
+
+
+# ----------------- Laden -----------------
+
+def _key(provider_id: int, day: date) -> tuple[int, str]:
+    return provider_id, day.isoformat()
+
+
+def _appointments_version() -> str:
+    return page_cache.versions()["appointments"]
+
+
+def _load_busy(bitmaps: dict, provider_ids: set[int], days: list[date], version: str) -> None:
+    """busy-Bits der Bitmaps aus den lokalen Terminen neu setzen - eine DB-Abfrage."""
+    start = datetime.combine(min(days), time())
+    end = datetime.combine(max(days) + timedelta(days=1), time())
+    busy = dict.fromkeys(bitmaps, 0)  # erst zuweisen, wenn komplett (Bitmaps sind geteilt)
+    rows = (
+        db.session.query(Appointment.provider_id, Appointment.start, Appointment.end)
+        .filter(Appointment.provider_id.in_(list(provider_ids)),
+                Appointment.start < end, func.coalesce(Appointment.end, Appointment.start) > start)
+        .all()
+    )
+    for provider_id, appt_start, appt_end in rows:
+        for day, a, b in _day_pieces(appt_start, appt_end or appt_start):
+            key = _key(provider_id, day)
+            if key in busy:
+                busy[key] |= interval_mask(a, b, inner=False)
+    for key, bm in bitmaps.items():
+        bm.busy, bm.version = busy[key], version
+
+
+def _load(providers: list[User], days: list[date], version: str) -> dict:
+    """Bitmaps für alle (provider, tag): eine FHIR-Suche + eine DB-Abfrage."""
+    start = datetime.combine(days[0], time())
+    end = datetime.combine(days[-1] + timedelta(days=1), time())
+    bitmaps = {_key(p.id, d): DayBitmap() for p in providers for d in days}
+
+    by_schedule = {p.fhir_schedule_id: p.id for p in providers if p.fhir_schedule_id}
+    for res in fhir.iter_slots_for_schedules(list(by_schedule), start, end):
+        schedule_id = res.get("schedule", {}).get("reference", "").split("/")[-1]
+        provider_id = by_schedule.get(schedule_id)
+        slot_start, slot_end = fhir.local_datetime(res.get("start")), fhir.local_datetime(res.get("end"))
+        if provider_id is None or slot_start is None:
+            continue
+        for day, a, b in _day_pieces(slot_start, slot_end or slot_start):
+            bm = bitmaps.get(_key(provider_id, day))
+            if bm is not None:
+                bm.free |= interval_mask(a, b, inner=True)
+
+    _load_busy(bitmaps, {p.id for p in providers}, days, version)
+    return bitmaps
+
+
+def day_bitmaps(providers: list[User], days: list[date]) -> dict:
+    """
+    {(provider_id, 'YYYY-MM-DD'): DayBitmap}; fehlende Tage werden gebündelt
+    nachgeladen, busy-Bits aus einer älteren Terminversion neu gelesen.
+    """
+    version = _appointments_version()
+    out, missing = {}, set()
+    for p in providers:
+        for d in days:
+            bm = _days.get(_key(p.id, d))
+            if bm is None:
+                missing.add(d)
+            else:
+                out[_key(p.id, d)] = bm
+    outdated = {k: bm for k, bm in out.items() if bm.version != version}
+    if outdated:
+        _state["busy_reloads"] += 1
+        _load_busy(outdated, {k[0] for k in outdated}, [date.fromisoformat(k[1]) for k in outdated], version)
+    if not missing:
+        return out
+
+    with _load_lock:
+        load_days = sorted(missing)
+        changes = _state["changes"]
+        try:
+            loaded = _load(providers, [load_days[0] + timedelta(days=i)
+                                       for i in range((load_days[-1] - load_days[0]).days + 1)], version)
+        except Exception as e:
+            # FHIR nicht erreichbar: letzter bekannter Stand, sonst weiterreichen
+            stale = {k: _days.get(k, allow_stale=True) for p in providers for d in days
+                     if (k := _key(p.id, d)) not in out}
+            if any(v is None for v in stale.values()):
+                raise
+            log.warning("Availability served from stale bitmaps: %s", e)
+            out.update(stale)
+            return out
+        _state["loads"] += 1
+        for key, bm in loaded.items():
+            if key not in out:
+                # während des Ladens gebucht/storniert: nur für diese Antwort verwenden
+                if _state["changes"] == changes:
+                    _days.set(key, bm)
+                out[key] = bm
+    return out
+
+
+# ----------------- Inkrementelle Updates -----------------
+
+def mark_busy(provider_id: int, start: datetime, end: datetime | None) -> None:
+    """Nach einer Buchung: Bits des Termins als belegt setzen (nur geladene Tage)."""
+    _state["changes"] += 1
+    for day, a, b in _day_pieces(start, end or start):
+        bm = _days.get(_key(provider_id, day), allow_stale=True)
+        if bm is not None:
+            bm.busy |= interval_mask(a, b, inner=False)
+
+
+def mark_free(provider_id: int, start: datetime, end: datetime | None) -> None:
+    """
+    Nach einer Stornierung: Bits wieder freigeben. Termine eines Providers
+    überschneiden sich nicht (conflicts), nur angrenzende Termine können sich
+    einen angeschnittenen Schritt teilen - der Tag wird dann neu geladen.
+    """
+    _state["changes"] += 1
+    for day, a, b in _day_pieces(start, end or start):
+        key = _key(provider_id, day)
+        if a % AVAILABILITY_STEP or b % AVAILABILITY_STEP:
+            _days.invalidate(key)
+            continue
+        bm = _days.get(key, allow_stale=True)
+        if bm is not None:
+            bm.busy &= ~interval_mask(a, b, inner=False)
+
+
+def invalidate_provider(provider_id: int) -> None:
+    """Nach Änderungen an Slots/Terminen außerhalb der App (z. B. Abgleich)."""
+    _state["changes"] += 1
+    for key in [k for k in _days.keys() if k[0] == provider_id]:
+        _days.invalidate(key)
+
+
+# ----------------- Abfrage -----------------
+
+def find_availability(providers: list[User], start_day: date, end_day: date,
+                      duration: int | None = None, mode: str = "any") -> dict:
+    """
+    Freie Zeiten für [start_day, end_day] (inklusive).
+    duration (Minuten): zusätzlich alle möglichen Startzeiten für so lange Termine.
+    mode "any": mindestens ein Provider frei, "all": alle gleichzeitig frei.
+    """
+    days = [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+    bitmaps = day_bitmaps(providers, days)
+    steps = -(-duration // AVAILABILITY_STEP) if duration else None
+
+    def describe(day: date, bits: int) -> dict:
+        entry = {
+            "date": day.isoformat(),
+            "intervals": [{"start": _bit_time(day, a).isoformat(timespec="minutes"),
+                           "end": _bit_time(day, b).isoformat(timespec="minutes")} for a, b in runs(bits)],
+        }
+        if steps:
+            starts = fitting_starts(bits, steps)
+            entry["starts"] = [_bit_time(day, a).strftime("%H:%M")
+                               for a, b in runs(starts) for a in range(a, b)]
+        return entry
+
+    result = {"step_minutes": AVAILABILITY_STEP, "providers": [], "combined": []}
+    combined = {d: (0 if mode == "any" else FULL_DAY) for d in days}
+    for p in providers:
+        provider_days = []
+        for d in days:
+            bits = bitmaps[_key(p.id, d)].available
+            combined[d] = combined[d] | bits if mode == "any" else combined[d] & bits
+            if bits:
+                provider_days.append(describe(d, bits))
+        result["providers"].append({"email": p.email, "days": provider_days})
+    result["combined"] = [describe(d, bits) for d, bits in combined.items() if bits and providers]
+    return result
+
+
+def providers_by_email(emails: list[str]) -> list[User]:
+    query = User.query.filter(User.role == UserRoles.gda)
+    if emails:
+        query = query.filter(User.email.in_(emails))
+    return query.order_by(User.email).all()
+
+
+def stats() -> dict:
+    return {**_days.stats(), **_state}
@@ -0,0 +1,256 @@
+# benchmarks/bench_app.py
+"""
+End-to-End-Lastbenchmark der Flask-App gegen den lokalen Fake-FHIR-Server.
+
+Startet fake_fhir_server.FakeFHIRServer im Prozess (mit einstellbarer Latenz
+und Fehlerquote), legt eine frische SQLite-Datenbank mit den Seed-Daten an und
+treibt dann mit mehreren Threads (je ein Flask-Testclient mit eigener Session):
+
+- login          POST /login
+- bookings_get   GET  /<username>
+- bookings_post  POST /<username>   (jede Buchung in einem eigenen Zeitfenster)
+- new_user       POST /new_user
+
+Pro Szenario: p50/p95/p99/Mittelwert, Durchsatz, Fehler und FHIR-Aufrufe pro
+Request (inkl. der Outbox-Aufrufe, die nach der Buchung im Hintergrund laufen).
+Das Ergebnis wird als JSON gespeichert; --compare vergleicht mit einem älteren Lauf.
+
+    python benchmarks/bench_app.py --requests 200 --threads 8 --latency-ms 20
+    python benchmarks/bench_app.py --compare benchmarks/results/bench_app-20261016-120000.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fake_fhir_server import FakeFHIRServer  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCENARIOS = ("login", "bookings_get", "bookings_post", "new_user")
+PATIENTS = [
+    ("maria.schneider@example.com", "maria123"),
+    ("felix.mueller@example.com", "felix123"),
+    ("thomas.becker@example.com", "thomas123"),
+    ("lisa.wagner@example.com", "lisa123"),
+    ("max.bauer@example.com", "max123"),
+    ("anna.richter@example.com", "anna123"),
+    ("daniel.weber@example.com", "daniel123"),
+    ("johannes.meier@example.com", "johannes123"),
+]
+GDA_EMAIL = "alexander.owens@biomedical.org"
+OUTBOX_DRAIN_TIMEOUT = 60.0
+
+
+def load_app(server: FakeFHIRServer, db_path: str):
+    """App erst nach dem Setzen der Umgebung importieren (Module lesen sie beim Import)."""
+    os.environ["FHIR_BASE_URL"] = server.base_url
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import app as webapp
+    import database_service as ds
+    import fhir_client as fhir
+    from database_layer.db_instance import db
+
+    fhir.configure(base_url=server.base_url)
+    webapp.app.config["TESTING"] = True
+    webapp.start_background_workers()  # Outbox im selben Prozess, siehe wait_for_outbox
+    with webapp.app.app_context():
+        db.drop_all()
+        ds.ensure_schema(force=True)
+        ds.sqlite_populate()
+    return webapp.app
+
+
+def wait_for_outbox(app) -> None:
+    """Wartet, bis die Outbox leer ist, damit ihre FHIR-Aufrufe mitgezählt werden."""
+    import outbox
+
+    deadline = time.monotonic() + OUTBOX_DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        with app.app_context():
+            if outbox.stats()["pending"] == 0:
+                return
+        outbox.notify()
+        time.sleep(0.05)
+    print("warning: outbox not drained, FHIR call counts are incomplete")
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Scenario:
+    """Ein Szenario: setup() pro Thread (Login etc.), call(client, i) pro Request."""
+
+    def __init__(self, app, name: str):
+        self.app = app
+        self.name = name
+        self._counter = itertools.count()
+        self._stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        # Buchungen weit in der Zukunft, je 10 Minuten, damit nichts kollidiert
+        self._booking_base = (datetime.now() + timedelta(days=400)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def setup(self, client, worker: int) -> None:
+        if self.name in ("bookings_get", "bookings_post"):
+            email, password = PATIENTS[worker % len(PATIENTS)]
+            client.post("/login", data={"email": email, "password": password})
+            client.bench_user = email
+
+    def call(self, client, worker: int):
+        i = next(self._counter)
+        if self.name == "login":
+            email, password = PATIENTS[i % len(PATIENTS)]
+            return client.post("/login", data={"email": email, "password": password})
+        if self.name == "bookings_get":
+            return client.get(f"/{client.bench_user}")
+        if self.name == "bookings_post":
+            start = self._booking_base + timedelta(minutes=15 * i)
+            return client.post(f"/{client.bench_user}", data={
+                "date": start.strftime("%Y-%m-%d"),
+                "start_time": start.strftime("%H:%M"),
+                "end_time": (start + timedelta(minutes=10)).strftime("%H:%M"),
+                "gda": GDA_EMAIL,
+            })
+        return client.post("/new_user", data={
+            "first_name": "Bench", "last_name": f"User{i}",
+            "email": f"bench-{self._stamp}-{i}@example.com", "password": "bench",
+        })
+
+
+def run_scenario(app, server: FakeFHIRServer, name: str, total: int, threads: int) -> dict:
+    scenario = Scenario(app, name)
+    clients = []
+    for worker in range(threads):
+        client = app.test_client()
+        scenario.setup(client, worker)
+        clients.append(client)
+
+    wait_for_outbox(app)
+    server.reset_counters()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = itertools.count()
+
+    def worker_loop(worker: int):
+        nonlocal errors
+        client = clients[worker]
+        while next(remaining) < total:
+            t0 = time.perf_counter()
+            resp = scenario.call(client, worker)
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code >= 400:
+                    errors += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker_loop, range(threads)))
+    wall = time.perf_counter() - t0
+
+    wait_for_outbox(app)
+    calls = dict(server.calls)
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ms) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "mean_ms": round(statistics.fmean(ms), 2) if ms else 0.0,
+        "fhir_calls_per_request": round(calls.pop("total", 0) / len(ms), 2) if ms else 0.0,
+        "fhir_calls": calls,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\nVergleich mit {baseline['meta'].get('timestamp')} ({baseline['meta'].get('git')})")
+    print(f"{'scenario':14} {'metric':24} {'before':>10} {'after':>10} {'change':>9}")
+    for name, result in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "fhir_calls_per_request"):
+            before, after = old.get(metric, 0.0), result[metric]
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{name:14} {metric:24} {before:>10} {after:>10} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests pro Szenario")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latenz des Fake-FHIR-Servers")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="JSON-Datei (Standard: benchmarks/results/bench_app-<zeit>.json)")
+    parser.add_argument("--compare", help="früheres Ergebnis zum Vergleich")
+    args = parser.parse_args()
+
+    server = FakeFHIRServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate).start()
+    tmp = tempfile.mkdtemp(prefix="bench_app-")
+    app = load_app(server, os.path.join(tmp, "bench.db"))
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "requests": args.requests,
+            "threads": args.threads,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+        },
+        "scenarios": {},
+    }
+    print(f"{'scenario':14} {'req':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'fhir/req':>9}")
+    for name in args.scenarios.split(","):
+        r = run_scenario(app, server, name.strip(), args.requests, args.threads)
+        result["scenarios"][name] = r
+        print(f"{name:14} {r['requests']:>5} {r['errors']:>4} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['throughput_rps']:>8} {r['fhir_calls_per_request']:>9}")
+    server.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_app-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
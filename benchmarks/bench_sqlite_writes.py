@@ -0,0 +1,132 @@
+# benchmarks/bench_sqlite_writes.py
+"""
+Schreiblast-Benchmark für das SQLite-Profil aus database_service.
+
+Mehrere Threads buchen gleichzeitig Termine (INSERT + COMMIT je Buchung),
+während andere Threads Terminlisten lesen - einmal mit den SQLite-Standard-
+einstellungen (Rollback-Journal, synchronous=FULL) und einmal mit
+database_service.SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy_timeout, ...).
+
+    python benchmarks/bench_sqlite_writes.py --writers 8 --readers 4 --bookings 300
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database_service import SQLITE_PRAGMAS, apply_sqlite_pragmas  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE appointments (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    provider_id INTEGER NOT NULL,
+    start DATETIME NOT NULL,
+    "end" DATETIME
+);
+CREATE INDEX ix_appointments_provider_start ON appointments (provider_id, start);
+"""
+
+
+def make_engine(path: str, pragmas: dict | None):
+    engine = create_engine(f"sqlite:///{path}", pool_size=32, max_overflow=0,
+                           connect_args={"check_same_thread": False})
+    if pragmas:
+        event.listen(engine, "connect", lambda conn, _record: apply_sqlite_pragmas(conn, pragmas))
+    with engine.begin() as conn:
+        for stmt in SCHEMA.strip().split(";"):
+            if stmt.strip():
+                conn.execute(text(stmt))
+    return engine
+
+
+def run(label: str, pragmas: dict | None, writers: int, readers: int, bookings: int) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench-sqlite-")
+    engine = make_engine(os.path.join(tmp, "bench.db"), pragmas)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    stop = threading.Event()
+    reads = [0]
+
+    def writer(n: int):
+        base = datetime(2030, 1, 1) + timedelta(days=n * 1000)
+        for i in range(bookings):
+            start = base + timedelta(minutes=30 * i)
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        text('INSERT INTO appointments (patient_id, provider_id, start, "end") '
+                             'VALUES (:p, :g, :s, :e)'),
+                        {"p": i, "g": n, "s": start, "e": start + timedelta(minutes=30)},
+                    )
+            except Exception as e:  # "database is locked"
+                with lock:
+                    errors.append(str(e).splitlines()[0])
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    def reader(n: int):
+        while not stop.is_set():
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT * FROM appointments WHERE provider_id = :g "
+                                      "ORDER BY start DESC LIMIT 20"), {"g": n % max(writers, 1)}).all()
+                with lock:
+                    reads[0] += 1
+            except Exception as e:
+                with lock:
+                    errors.append(str(e).splitlines()[0])
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    read_threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    t0 = time.perf_counter()
+    for t in threads + read_threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in read_threads:
+        t.join()
+    engine.dispose()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "profile": label,
+        "commits": len(latencies),
+        "commits_per_s": round(len(latencies) / elapsed, 1),
+        "reads_per_s": round(reads[0] / elapsed, 1),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--bookings", type=int, default=300, help="Buchungen pro Writer-Thread")
+    args = parser.parse_args()
+
+    for label, pragmas in (("default", None), ("profile", SQLITE_PRAGMAS)):
+        result = run(label, pragmas, args.writers, args.readers, args.bookings)
+        print("  ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+# cache_backends.py
+"""
+Cache-Backends, die sich alle Worker teilen können (fhir_cache wählt eines aus).
+
+- memory: fhir_cache.TTLCache, pro Prozess (Standard)
+- sqlite: eine SQLite-Datei (WAL) für alle Worker auf demselben Rechner,
+  übersteht Neustarts
+- redis: Netzwerk-Cache für mehrere Rechner (optionales Paket 'redis'); statt
+  eines Servers kann jedes Objekt mit get/set/delete/scan_iter/mget in der Art
+  von redis-py übergeben werden, z. B. LocalRedis (Tests, Entwicklung)
+
+Werte werden als JSON abgelegt (Strings, Listen, Dicts - keine Objekte), jeder
+Eintrag hat seine eigene TTL. Abgelaufene Einträge bleiben noch
+CACHE_STALE_KEEP Sekunden für allow_stale (FHIR-Ausfall) erhalten.
+
+get_or_load() bündelt gleichzeitige Misses auf denselben Schlüssel: im Prozess
+über ein gemeinsames Future, zwischen Workern über eine kurze Sperre (Lease)
+im Backend. Ein kalter Schlüssel löst so genau einen FHIR-Aufruf aus. Jede
+Lease trägt ein zufälliges Token ihres Besitzers; freigegeben wird nur mit
+diesem Token (Compare-and-Delete), eine fremde Lease bleibt also liegen.
+
+    FHIR_CACHE_BACKEND=sqlite FHIR_CACHE_PATH=/var/tmp/webb-cache.sqlite gunicorn app:app
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+try:
+    import redis  # optional
+except Exception:
+    redis = None
+
+log = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("FHIR_CACHE_BACKEND", "memory")
+CACHE_PATH = os.environ.get("FHIR_CACHE_PATH", os.path.join(tempfile.gettempdir(), "webb-fhir-cache.sqlite"))
+CACHE_URL = os.environ.get("FHIR_CACHE_URL", "redis://localhost:6379/0")
+CACHE_STALE_KEEP = 24 * 60 * 60  # Sekunden, die abgelaufene Einträge noch aufgehoben werden
+SINGLE_FLIGHT_LEASE = 10.0  # Sekunden, so lange wartet ein Worker höchstens auf einen anderen
+SINGLE_FLIGHT_POLL = 0.02
+SQLITE_SWEEP_EVERY = 256  # Schreibzugriffe zwischen zwei Aufräumläufen
+
+# Redis: Lease nur löschen, wenn sie noch dem Aufrufer gehört (atomar im Server)
+REDIS_RELEASE_LEASE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+_MISSING = object()
+
+
+def encode_key(key) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key, separators=(",", ":"))
+
+
+def decode_key(text: str):
+    key = json.loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+def lease_token() -> str:
+    return uuid.uuid4().hex
+
+
+class SingleFlight:
+    """
+    get_or_load() für Caches mit get/set. acquire_lease liefert ein Token (oder
+    None, wenn die Lease jemand anders hält), release_lease gibt nur mit diesem
+    Token frei. Hier im Prozess; Backends, die sich Worker teilen, überschreiben
+    beide.
+    """
+
+    def _init_single_flight(self) -> None:
+        self._inflight = {}  # key -> Future des ladenden Threads
+        self._inflight_lock = threading.Lock()
+        self._leases = {}  # key -> (token, expires_at)
+        self.loads = 0
+        self.coalesced = 0
+
+    def acquire_lease(self, key, seconds: float) -> str | None:
+        now = time.monotonic()
+        with self._inflight_lock:
+            held = self._leases.get(key)
+            if held is not None and held[1] > now:
+                return None
+            token = lease_token()
+            self._leases[key] = (token, now + seconds)
+            return token
+
+    def release_lease(self, key, token: str) -> None:
+        with self._inflight_lock:
+            if self._leases.get(key, (None,))[0] == token:
+                del self._leases[key]
+
+    def get_or_load(self, key, loader, ttl: float | None = None):
+        """Wert aus dem Cache, sonst loader() - pro Schlüssel nur ein Aufruf gleichzeitig."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self.coalesced += 1
+            return future.result(timeout=SINGLE_FLIGHT_LEASE)
+        try:
+            value = self._load_shared(key, loader, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _load_shared(self, key, loader, ttl):
+        token = self.acquire_lease(key, SINGLE_FLIGHT_LEASE)
+        if token is None:
+            # ein anderer Worker lädt gerade: auf sein Ergebnis warten, notfalls selbst laden
+            deadline = time.monotonic() + SINGLE_FLIGHT_LEASE
+            while token is None and time.monotonic() < deadline:
+                time.sleep(SINGLE_FLIGHT_POLL)
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    self.coalesced += 1
+                    return value
+                token = self.acquire_lease(key, SINGLE_FLIGHT_LEASE)  # er ist ohne Ergebnis fertig
+        try:
+            value = loader()
+            self.loads += 1
+            self.set(key, value, ttl)
+            return value
+        finally:
+            if token is not None:
+                self.release_lease(key, token)
+
+
+# ----------------- SQLite (ein Rechner, mehrere Worker) -----------------
+
+class SQLiteCache(SingleFlight):
+    """Cache in einer SQLite-Datei; eine Verbindung pro Thread, Namespace pro Cache."""
+
+    def __init__(self, path: str, namespace: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._init_single_flight()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                     "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                     "PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_leases ("
+                     "name TEXT PRIMARY KEY, owner TEXT NOT NULL DEFAULT '', expires_at REAL NOT NULL)")
+        if "owner" not in {row[1] for row in conn.execute("PRAGMA table_info(cache_leases)")}:
+            # Datei von vor den Lease-Tokens
+            conn.execute("ALTER TABLE cache_leases ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None, allow_stale: bool = False):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, encode_key(key))).fetchone()
+        now = time.time()
+        if row is None or (row[1] <= now and not allow_stale):
+            self.misses += 1
+            return default
+        if row[1] <= now:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, encode_key(key), json.dumps(value, separators=(",", ":")), expires_at))
+        self._writes += 1
+        if self._writes % SQLITE_SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Lange abgelaufene Einträge löschen und auf maxsize kürzen (früheste Ablaufzeit zuerst)."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at < ?",
+                     (self.namespace, time.time() - CACHE_STALE_KEEP))
+        conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize))
+
+    def invalidate(self, key) -> None:
+        self._conn().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                             (self.namespace, encode_key(key)))
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def keys(self) -> list:
+        """Alle Schlüssel, auch abgelaufene (die noch für allow_stale liegen)."""
+        rows = self._conn().execute("SELECT key FROM cache_entries WHERE namespace = ?", (self.namespace,))
+        return [decode_key(key) for (key,) in rows]
+
+    def values(self) -> list:
+        rows = self._conn().execute(
+            "SELECT value FROM cache_entries WHERE namespace = ? AND expires_at > ?",
+            (self.namespace, time.time()))
+        return [json.loads(value) for (value,) in rows]
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?",
+                                    (self.namespace,)).fetchone()[0]
+
+    def acquire_lease(self, key, seconds: float) -> str | None:
+        name = f"{self.namespace}:{encode_key(key)}"
+        conn = self._conn()
+        now = time.time()
+        token = lease_token()
+        conn.execute("DELETE FROM cache_leases WHERE name = ? AND expires_at < ?", (name, now))
+        inserted = conn.execute("INSERT OR IGNORE INTO cache_leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                                (name, token, now + seconds)).rowcount == 1
+        return token if inserted else None
+
+    def release_lease(self, key, token: str) -> None:
+        self._conn().execute("DELETE FROM cache_leases WHERE name = ? AND owner = ?",
+                             (f"{self.namespace}:{encode_key(key)}", token))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+        }
+
+
+# ----------------- Redis (mehrere Rechner) -----------------
+
+class RedisCache(SingleFlight):
+    """
+    Cache in Redis: Wert als JSON [expires_at, value], physisch gelöscht erst nach
+    ttl + CACHE_STALE_KEEP. Die Größe begrenzt Redis selbst (maxmemory-policy).
+    """
+
+    def __init__(self, namespace: str, maxsize: int = 1024, ttl: float = 300.0,
+                 url: str | None = None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("RedisCache needs the optional 'redis' package")
+            client = redis.Redis.from_url(url or CACHE_URL)
+        self.client = client
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._init_single_flight()
+
+    def _key(self, key) -> str:
+        return f"webb:{self.namespace}:{encode_key(key)}"
+
+    def get(self, key, default=None, allow_stale: bool = False):
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return default
+        expires_at, value = json.loads(raw)
+        if expires_at <= time.time():
+            if not allow_stale:
+                self.misses += 1
+                return default
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self._key(key), json.dumps([time.time() + ttl, value], separators=(",", ":")),
+                        ex=int(ttl + CACHE_STALE_KEEP))
+
+    def invalidate(self, key) -> None:
+        self.client.delete(self._key(key))
+
+    def _keys(self) -> list:
+        return list(self.client.scan_iter(match=f"webb:{self.namespace}:*"))
+
+    def clear(self) -> None:
+        keys = self._keys()
+        if keys:
+            self.client.delete(*keys)
+
+    def keys(self) -> list:
+        """Alle Schlüssel, auch abgelaufene (die noch für allow_stale liegen)."""
+        prefix = len(f"webb:{self.namespace}:")
+        return [decode_key((k.decode() if isinstance(k, bytes) else k)[prefix:]) for k in self._keys()]
+
+    def values(self) -> list:
+        keys = self._keys()
+        now = time.time()
+        out = []
+        for raw in (self.client.mget(keys) if keys else []):
+            if raw is not None:
+                expires_at, value = json.loads(raw)
+                if expires_at > now:
+                    out.append(value)
+        return out
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def _lease_key(self, key) -> str:
+        return f"webb-lease:{self.namespace}:{encode_key(key)}"
+
+    def acquire_lease(self, key, seconds: float) -> str | None:
+        token = lease_token()
+        if self.client.set(self._lease_key(key), token, nx=True, px=int(seconds * 1000)):
+            return token
+        return None
+
+    def release_lease(self, key, token: str) -> None:
+        self.client.eval(REDIS_RELEASE_LEASE, 1, self._lease_key(key), token)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+        }
+
+
+class LocalRedis:
+    """
+    Redis-Ersatz im Prozess für RedisCache(client=...): get, set (ex/px/nx),
+    delete, scan_iter, mget wie redis-py, Werte als bytes; eval kennt nur
+    REDIS_RELEASE_LEASE. Zwei RedisCache mit demselben LocalRedis verhalten
+    sich wie zwei Worker an einem Server.
+    """
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at oder None)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item else None
+
+    def set(self, key, value, ex=None, px=None, nx: bool = False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            if ex is not None:
+                expires_at = time.monotonic() + ex
+            elif px is not None:
+                expires_at = time.monotonic() + px / 1000
+            else:
+                expires_at = None
+            self._data[key] = (value.encode() if isinstance(value, str) else value, expires_at)
+            return True
+
+    def delete(self, *keys) -> int:
+        with self._lock:
+            return sum(self._data.pop(k, None) is not None for k in keys)
+
+    def scan_iter(self, match: str | None = None):
+        with self._lock:
+            keys = [k for k in list(self._data) if self._live(k) is not None]
+        return iter([k for k in keys if match is None or fnmatch.fnmatchcase(k, match)])
+
+    def mget(self, keys) -> list:
+        return [self.get(k) for k in keys]
+
+    def eval(self, script: str, numkeys: int, *args):
+        if script != REDIS_RELEASE_LEASE or numkeys != 1:
+            raise NotImplementedError("LocalRedis only runs REDIS_RELEASE_LEASE")
+        key, token = args
+        with self._lock:
+            item = self._live(key)
+            if item is None or item[0] != (token.encode() if isinstance(token, str) else token):
+                return 0
+            del self._data[key]
+            return 1
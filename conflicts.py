@@ -0,0 +1,179 @@
+# conflicts.py
+"""
+Erkennung von Doppelbuchungen (überlappende Termine) für Provider und Patienten.
+
+- Datenbank: start < neues Ende AND end > neuer Beginn über die Indizes
+  (provider_id, start, end) bzw. (patient_id, start, end) - der Index deckt die
+  Abfrage ab. Bestehende Kalender müssen nicht überschneidungsfrei sein
+  (Altdaten, Abgleich mit FHIR).
+- Speicher: sortierte Intervalle pro Provider (bisect) mit laufendem Maximum
+  der Enden, damit offensichtliche Konflikte ohne Schreibsperre abgewiesen werden.
+
+Verbindlich ist immer die Prüfung in der Datenbank: create_appointment prüft
+nach dem INSERT innerhalb derselben Transaktion. Unter SQLite serialisiert die
+Schreibsperre gleichzeitige Buchungen. Auf einem Datenbankserver (DATABASE_URL)
+sperrt die Prüfung vorher die Zeilen von Provider und Patient (SELECT … FOR
+UPDATE), sonst könnten zwei Buchungen einander nicht sehen und beide durchgehen.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import fhir_cache
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.user_entity import User
+
+CALENDAR_CACHE_SIZE = 256  # Anzahl Provider-Kalender im Speicher
+CALENDAR_CACHE_TTL = 5 * 60
+CALENDAR_LOOKBACK = timedelta(days=1)  # ältere Termine bleiben nur in der DB
+
+APPOINTMENT_INDEXES = [
+    db.Index("ix_appointments_provider_start_end", Appointment.provider_id, Appointment.start, Appointment.end),
+    db.Index("ix_appointments_patient_start_end", Appointment.patient_id, Appointment.start, Appointment.end),
+]
+
+
+class AppointmentConflict(ValueError):
+    """Der neue Termin überschneidet sich mit einem bestehenden."""
+
+
+class IntervalIndex:
+    """
+    Nach Beginn sortierte Intervalle eines Kalenders ab 'since' (dürfen sich
+    überschneiden); _max_ends[i] = spätestes Ende unter den ersten i+1 Intervallen.
+    """
+
+    def __init__(self, since: datetime, rows=()):
+        self.since = since
+        self._lock = threading.Lock()
+        self._items = sorted((start, end or start, appt_id) for appt_id, start, end in rows)
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._max_ends = []
+        latest = None
+        for _, end, _ in self._items:
+            latest = end if latest is None or end > latest else latest
+            self._max_ends.append(latest)
+
+    def covers(self, start: datetime) -> bool:
+        return start >= self.since
+
+    def conflict(self, start: datetime, end: datetime) -> int | None:
+        """ID eines überlappenden Termins oder None - O(log n) ohne Treffer."""
+        with self._lock:
+            i = bisect_left(self._items, (end,)) - 1
+            if i < 0 or self._max_ends[i] <= start:
+                return None
+            # es gibt einen Treffer: vom letzten Kandidaten rückwärts suchen
+            while self._items[i][1] <= start:
+                i -= 1
+            return self._items[i][2]
+
+    def add(self, appt_id: int, start: datetime, end: datetime | None) -> None:
+        with self._lock:
+            insort(self._items, (start, end or start, appt_id))
+            self._rebuild()
+
+    def remove(self, appt_id: int) -> None:
+        with self._lock:
+            self._items = [item for item in self._items if item[2] != appt_id]
+            self._rebuild()
+
+
+_calendars = fhir_cache.TTLCache(maxsize=CALENDAR_CACHE_SIZE, ttl=CALENDAR_CACHE_TTL)
+
+
+def provider_calendar(provider_id: int) -> IntervalIndex:
+    """Kalender eines Providers aus dem Speicher, bei Bedarf aus der DB geladen."""
+    calendar = _calendars.get(provider_id)
+    if calendar is None:
+        since = datetime.now() - CALENDAR_LOOKBACK
+        rows = (
+            db.session.query(Appointment.id, Appointment.start, Appointment.end)
+            .filter(Appointment.provider_id == provider_id, Appointment.start >= since)
+            .all()
+        )
+        calendar = IntervalIndex(since, rows)
+        _calendars.set(provider_id, calendar)
+    return calendar
+
+
+def find_overlap(column, user_id: int, start: datetime, end: datetime, exclude_id: int | None = None):
+    """Überlappender Termin in der DB: start < end AND end > start (Index (user, start, end))."""
+    q = Appointment.query.filter(column == user_id, Appointment.start < end,
+                                 func.coalesce(Appointment.end, Appointment.start) > start)
+    if exclude_id is not None:
+        q = q.filter(Appointment.id != exclude_id)
+    return q.order_by(Appointment.start.desc()).first()
+
+
+def lock_participants(*user_ids: int) -> None:
+    """
+    Datenbankserver: User-Zeilen sperren (feste Reihenfolge, kein Deadlock), damit
+    gleichzeitige Buchungen derselben Personen nacheinander prüfen. SQLite sperrt
+    beim Schreiben ohnehin die ganze Datenbank.
+    """
+    if db.session.get_bind().dialect.name == "sqlite":
+        return
+    ids = sorted({uid for uid in user_ids if uid is not None})
+    db.session.query(User.id).filter(User.id.in_(ids)).order_by(User.id).with_for_update().all()
+
+
+def precheck(provider_id: int, start: datetime, end: datetime) -> None:
+    """
+    Schnelle Vorprüfung ohne Schreibsperre über den Kalender im Speicher.
+    Ein Treffer wird per Primärschlüssel gegengeprüft (der Speicher kann veraltet sein).
+    """
+    if end <= start:
+        raise ValueError("Das Ende des Termins muss nach dem Beginn liegen.")
+    calendar = provider_calendar(provider_id)
+    if not calendar.covers(start):
+        return
+    other_id = calendar.conflict(start, end)
+    if other_id is None:
+        return
+    other = db.session.get(Appointment, other_id)
+    if other and other.start < end and (other.end or other.start) > start:
+        raise AppointmentConflict(_message("Provider", other))
+    calendar.remove(other_id)  # veralteter Eintrag
+
+
+def assert_no_conflict(appt: Appointment) -> None:
+    """Verbindliche Prüfung nach dem INSERT (flush), innerhalb der Transaktion."""
+    lock_participants(appt.provider_id, appt.patient_id)
+    other = find_overlap(Appointment.provider_id, appt.provider_id, appt.start, appt.end, exclude_id=appt.id)
+    if other:
+        raise AppointmentConflict(_message("Provider", other))
+    other = find_overlap(Appointment.patient_id, appt.patient_id, appt.start, appt.end, exclude_id=appt.id)
+    if other:
+        raise AppointmentConflict(_message("Patient", other))
+
+
+def remember(appt: Appointment) -> None:
+    """Nach dem Commit: Termin in den Kalender im Speicher übernehmen."""
+    calendar = _calendars.get(appt.provider_id)
+    if calendar is not None and calendar.covers(appt.start):
+        calendar.add(appt.id, appt.start, appt.end)
+
+
+def forget(appt_id: int, provider_id: int) -> None:
+    """Nach dem Löschen: Termin aus dem Kalender im Speicher entfernen."""
+    calendar = _calendars.get(provider_id)
+    if calendar is not None:
+        calendar.remove(appt_id)
+
+
+def invalidate(provider_id: int) -> None:
+    """Nach Änderungen außerhalb von create/delete (z. B. Abgleich mit FHIR): Kalender neu laden."""
+    _calendars.invalidate(provider_id)
+
+
+def _message(who: str, other: Appointment) -> str:
+    end = other.end or other.start
+    return (f"{who} hat bereits einen Termin am {other.start.strftime('%Y-%m-%d')} "
+            f"von {other.start.strftime('%H:%M')} bis {end.strftime('%H:%M')}.")
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from database_layer.db_instance import db
+
+
+class FHIRDisplayName(db.Model):
+    """
+    Lokale Kopie der Anzeigenamen von Patient/Practitioner.
+    Wird beim Anlegen (add_user) und vom name_sync-Job gefüllt, damit die
+    Buchungsseite Namen ohne FHIR-Aufruf aus der Datenbank lesen kann.
+    """
+    __tablename__ = "fhir_display_names"
+
+    resource_type = db.Column(db.String(32), primary_key=True)
+    fhir_id = db.Column(db.String(64), primary_key=True)
+    display_name = db.Column(db.String(255), nullable=False)
+
+    # Stand auf dem FHIR-Server (meta.versionId / meta.lastUpdated)
+    version_id = db.Column(db.String(64))
+    last_updated = db.Column(db.String(40))
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,43 @@
+import enum
+from datetime import datetime
+
+from database_layer.db_instance import db
+
+
+class OutboxOperation(enum.Enum):
+    create_appointment = "create_appointment"
+    delete_appointment = "delete_appointment"
+
+
+class OutboxStatus(enum.Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+class OutboxEntry(db.Model):
+    """
+    Ausstehender FHIR-Schreibzugriff (Transactional Outbox).
+    Wird in derselben SQLite-Transaktion wie das Appointment geschrieben und
+    später vom Outbox-Worker an den FHIR-Server geschickt.
+    """
+    __tablename__ = "fhir_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    operation = db.Column(db.Enum(OutboxOperation), nullable=False)
+    # kein ForeignKey: das Appointment kann vor dem Versand schon gelöscht sein
+    appointment_id = db.Column(db.Integer, index=True)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+
+    status = db.Column(db.Enum(OutboxStatus), nullable=False, default=OutboxStatus.pending)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_fhir_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from database_layer.db_instance import db
+
+
+class SyncState(db.Model):
+    """Fortschritt von Hintergrundjobs (Cursor, Checkpoints) als Schlüssel/Wert."""
+    __tablename__ = "sync_state"
+
+    key = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
@@ -2,38 +2,235 @@
 from database_layer.db_instance import db
 from database_layer.user_entity import User, UserRoles
 from database_layer.appointment_entity import Appointment
+from database_layer.sync_state_entity import SyncState
 from datetime import datetime, timedelta
 from random import randint
+from sqlalchemy import and_, or_, event, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import joinedload
+from flask import g, has_request_context
+import logging
 import os
-import fhir_client as fhir
+import time
+import fhir_cache
+import outbox
+import conflicts
+import availability
+import appointment_export
+import seeding
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Engine-Profil -----------------
+
+# SQLite-Pragmas pro Verbindung (überschreibbar über app.config["SQLITE_PRAGMAS"]):
+# WAL erlaubt Lesen während geschrieben wird, NORMAL spart das fsync pro Commit
+# (in WAL trotzdem crash-sicher), busy_timeout wartet auf Sperren statt
+# sofort "database is locked" zu melden.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms
+    "mmap_size": 256 * 1024 * 1024,  # Bytes
+    "cache_size": -64000,  # negativ = KiB, also ~64 MB
+    "temp_store": "MEMORY",
+}
+
+# Connection-Pool (überschreibbar über app.config["SQLALCHEMY_ENGINE_OPTIONS"]);
+# QUEUE_POOL_OPTIONS nur, wenn die Engine wirklich einen QueuePool bekommt -
+# StaticPool/SingletonThreadPool (sqlite://, :memory:) lehnen sie ab
+ENGINE_OPTIONS = {
+    "pool_pre_ping": True,
+}
+QUEUE_POOL_OPTIONS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _is_sqlite(app) -> bool:
+    return app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+
+
+def uses_queue_pool(uri: str, options: dict) -> bool:
+    """QueuePool für Server-DBs und SQLite-Dateien; In-Memory-SQLite bekommt einen anderen Pool."""
+    poolclass = options.get("poolclass")
+    if poolclass is not None:
+        return issubclass(poolclass, QueuePool)
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite":
+        return True
+    return url.database not in (None, "", ":memory:") and url.query.get("mode") != "memory"
+
+
+def configure_engine(app) -> None:
+    """Pool-Optionen setzen; muss vor db.init_app laufen."""
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    defaults = dict(ENGINE_OPTIONS)
+    if uses_queue_pool(app.config["SQLALCHEMY_DATABASE_URI"], options):
+        defaults.update(QUEUE_POOL_OPTIONS)
+    for key, value in defaults.items():
+        options.setdefault(key, value)
+    if _is_sqlite(app):
+        # Verbindungen wandern zwischen Threads (Pool, Outbox-Worker)
+        connect_args = options.setdefault("connect_args", {})
+        connect_args.setdefault("check_same_thread", False)
+
+
+def install_sqlite_pragmas(app) -> None:
+    """Pragmas bei jeder neuen Verbindung setzen (braucht App-Context)."""
+    if not _is_sqlite(app):
+        return
+    pragmas = {**SQLITE_PRAGMAS, **app.config.get("SQLITE_PRAGMAS", {})}
+    event.listen(db.engine, "connect", lambda conn, _record: apply_sqlite_pragmas(conn, pragmas))
+
+
+# Schema-Stand der DB: bei Änderungen an Tabellen oder Indizes hochzählen,
+# dann läuft beim nächsten Start einmal create_all + ensure_columns + ensure_indexes
+SCHEMA_VERSION = 4
+
+# Spalten, die nach dem ersten Deployment dazukamen: (Tabelle, Spalte)
+ADDED_COLUMNS = [(User.__table__, "fhir_schedule_id")]
+
+
+def get_schema_version() -> int:
+    """SQLite: PRAGMA user_version, sonst Eintrag in sync_state (0 = unbekannt)."""
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == "sqlite":
+            return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+        try:
+            value = conn.execute(
+                select(SyncState.value).where(SyncState.key == "schema_version")).scalar()
+        except Exception:
+            return 0  # Tabelle gibt es noch nicht
+        return int(value or 0)
+
+
+def set_schema_version(version: int) -> None:
+    if db.engine.dialect.name == "sqlite":
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        return
+    set_sync_state("schema_version", str(version))
+    db.session.commit()
+
+
+def ensure_schema(force: bool = False) -> bool:
+    """DDL nur, wenn die DB älter als SCHEMA_VERSION ist; True wenn ausgeführt."""
+    if not force and get_schema_version() >= SCHEMA_VERSION:
+        return False
+    db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    set_schema_version(SCHEMA_VERSION)
+    return True
 
 
 # damit man die datenbank reseten kann (mithilfe von AI generiert)
 def init(app, reset=False, populate=True):
-        print("Initializing SQLAlchemy instance")
+        started = time.perf_counter()
+        log.info("Initializing SQLAlchemy instance")
+        configure_engine(app)
         db.init_app(app)
 
         with app.app_context():
+            install_sqlite_pragmas(app)
             if reset:
-                print("!!! DROPPING ALL TABLES !!!")
+                log.warning("Dropping all tables")
                 db.drop_all()
 
-                print("!!! RECREATING ALL TABLES !!!")
-                db.create_all()
+                log.warning("Recreating all tables")
+                ensure_schema(force=True)
 
                 if populate:
                     sqlite_populate()
+                log.info("Database reset finished in %.2f s", time.perf_counter() - started)
                 return
-            db.create_all()
+            ran_ddl = ensure_schema()
+            log.info("Database ready in %.0f ms (schema %s)", (time.perf_counter() - started) * 1000,
+                     f"migrated to v{SCHEMA_VERSION}" if ran_ddl else f"v{SCHEMA_VERSION}, DDL skipped")
+
+
+# Terminlisten pro User (sortiert nach start) nutzen die Indizes
+# (…_id, start, end) aus conflicts; eigene (…_id, start)-Indizes wären doppelt
+OBSOLETE_INDEXES = ["ix_appointments_patient_start", "ix_appointments_provider_start"]
+
+
+def ensure_columns():
+    # create_all ergänzt keine Spalten in bestehenden Tabellen - per ALTER TABLE nachrüsten
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        quote = conn.dialect.identifier_preparer.quote
+        for table, name in ADDED_COLUMNS:
+            if name in {c["name"] for c in inspector.get_columns(table.name)}:
+                continue
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            log.warning("Adding column %s.%s", table.name, name)
+            conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(name)} {column_type}")
+
+
+def ensure_indexes():
+    # create_all legt Indizes nur für neue Tabellen an - bestehende DBs nachrüsten
+    for index in [*conflicts.APPOINTMENT_INDEXES, appointment_export.EXPORT_INDEX]:
+        index.create(bind=db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
 
 
 # ----------------- Convenience-Queries -----------------
 
+# Pro Request wird jeder User höchstens einmal geladen: Identity-Map auf flask.g,
+# Schlüssel E-Mail und ID. Außerhalb eines Requests (init, Worker, CLI) ohne Memo.
+
+def _identity_map() -> dict | None:
+    if not has_request_context():
+        return None
+    ident = g.get("_ds_users")
+    if ident is None:
+        ident = g._ds_users = {"email": {}, "id": {}}
+        g._ds_user_queries = 0
+    return ident
+
+
+def _remember_user(ident: dict | None, user: User | None) -> User | None:
+    if ident is not None:
+        g._ds_user_queries += 1
+        if user is not None:
+            ident["email"][user.email] = user
+            ident["id"][user.id] = user
+    return user
+
+
+def user_query_count() -> int:
+    """Anzahl User-Abfragen, die im aktuellen Request wirklich die DB erreicht haben."""
+    return g.get("_ds_user_queries", 0) if has_request_context() else 0
+
+
 def fetch_user_by_email(email):
-    return User.query.filter_by(email=email).first()
+    ident = _identity_map()
+    if ident is not None and email in ident["email"]:
+        return ident["email"][email]
+    return _remember_user(ident, User.query.filter_by(email=email).first())
 
 def fetch_user_by_id(uid: int) -> User | None:
-    return User.query.get(uid)
+    ident = _identity_map()
+    if ident is not None and uid in ident["id"]:
+        return ident["id"][uid]
+    return _remember_user(ident, db.session.get(User, uid))
 
 # database_service.py
 
@@ -50,13 +247,71 @@ def fetch_appointments_by_email(email):
 
 def fetch_patients_appointments_by_id(pid):
     # ✅ KORRIGIERT: Verwende Appointment.start
-    return Appointment.query.filter_by(patient_id=pid).order_by(Appointment.start).all()
+    # Provider gleich mitladen (JOIN), sonst eine Abfrage pro Zeile im Template
+    return (Appointment.query.filter_by(patient_id=pid)
+            .options(joinedload(Appointment.provider))
+            .order_by(Appointment.start).all())
 
 def fetch_gda_appointments_by_id(gid):
     # ✅ KORRIGIERT: Verwende Appointment.start
-    return Appointment.query.filter_by(provider_id=gid).order_by(Appointment.start).all()
+    return (Appointment.query.filter_by(provider_id=gid)
+            .options(joinedload(Appointment.patient))
+            .order_by(Appointment.start).all())
+
+# ----------------- Terminlisten mit Keyset-Pagination -----------------
+
+APPOINTMENT_PAGE_SIZE = 20
+
+
+def encode_cursor(appt: Appointment) -> str:
+    return f"{appt.start.isoformat()}_{appt.id}"
 
-# ... (Rest des Codes bleibt gleich) ...
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int] | None:
+    """'2025-11-28T09:00:00_42' -> (datetime, 42); ungültige Cursor werden ignoriert."""
+    if not cursor:
+        return None
+    try:
+        start, appt_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(start), int(appt_id)
+    except ValueError:
+        return None
+
+
+def fetch_appointments_page(user: User, window: str = "upcoming", after=None,
+                            limit: int = APPOINTMENT_PAGE_SIZE, now: datetime | None = None):
+    """
+    Eine Seite Termine des Users, ohne OFFSET: weiter geht es nach dem
+    (start, id) des letzten Eintrags ('after', siehe decode_cursor).
+    window: "upcoming" (start >= jetzt, aufsteigend) oder "past" (absteigend).
+    Rückgabe: (appointments, next_cursor oder None)
+    """
+    if user.role == UserRoles.patient:
+        column, counterpart = Appointment.patient_id, Appointment.provider
+    else:
+        column, counterpart = Appointment.provider_id, Appointment.patient
+    now = now or datetime.now()
+    # Gegenüber per JOIN mitladen: konstante Anzahl Abfragen pro Seite
+    q = Appointment.query.filter(column == user.id).options(joinedload(counterpart))
+
+    if window == "past":
+        q = q.filter(Appointment.start < now)
+        if after:
+            start, appt_id = after
+            q = q.filter(Appointment.start <= start,
+                         or_(Appointment.start < start, and_(Appointment.start == start, Appointment.id < appt_id)))
+        q = q.order_by(Appointment.start.desc(), Appointment.id.desc())
+    else:
+        q = q.filter(Appointment.start >= now)
+        if after:
+            start, appt_id = after
+            q = q.filter(Appointment.start >= start,
+                         or_(Appointment.start > start, and_(Appointment.start == start, Appointment.id > appt_id)))
+        q = q.order_by(Appointment.start, Appointment.id)
+
+    rows = q.limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
 
 
@@ -71,45 +326,106 @@ def create_appointment(patient_id: int, provider_id: int, start_time: datetime,
     patient_fhir_id = patient.fhir_patient_id
     provider_fhir_id = provider.fhir_practitioner_id
 
-    # 2) Erstelle Appointment auf FHIR und erhalte FHIR-ID
-    try:
-        fhir_appt_id = fhir.create_fhir_appointment(
-            patient_fhir_id,
-            provider_fhir_id,
-            start_time,
-            end_time,
-            user_notes
-        )
-    except Exception as e:
-        # FHIR failed -> fallback: entweder raise oder continue with None
-        print("FHIR appointment creation failed:", e)
-        fhir_appt_id = None
+    # 2) Schnelle Vorprüfung auf Doppelbuchung (Kalender im Speicher)
+    conflicts.precheck(provider_id, start_time, end_time)
 
+    # 3) Lokal speichern; das FHIR-Appointment legt der Outbox-Worker an
+    #    (Appointment + Outbox-Eintrag in derselben Transaktion)
     appt = Appointment(
         patient_id=patient_id,
         provider_id=provider_id,
-        fhir_appointment_id=fhir_appt_id,
+        fhir_appointment_id=None,
         start=start_time,
         end=end_time
     )
 
     db.session.add(appt)
+    db.session.flush()  # appt.id für den Outbox-Eintrag; ab hier hält SQLite die Schreibsperre
+    try:
+        conflicts.assert_no_conflict(appt)
+    except conflicts.AppointmentConflict:
+        db.session.rollback()
+        raise
+    outbox.enqueue_create(appt, patient_fhir_id, provider_fhir_id, user_notes)
     db.session.commit()
+    outbox.notify()
+    conflicts.remember(appt)
+
+    # Slot-Cache direkt nachziehen statt neu zu laden
+    fhir_cache.slots.mark_booked(provider.fhir_schedule_id, start_time)
+    availability.mark_busy(provider_id, start_time, end_time)
     return appt
 
 def delete_appointment_local_and_fhir(appt: Appointment):
-    if appt.fhir_appointment_id:
-        try:
-            fhir.delete_fhir_appointment(appt.fhir_appointment_id)
-        except Exception as e:
-            print("Warning: failed deleting FHIR appointment:", e)
-            # optional: weiter löschen oder aborten
+    # FHIR-Löschung über die Outbox (gleiche Transaktion wie das lokale Löschen)
+    schedule_id = appt.provider.fhir_schedule_id
+    start_time, end_time = appt.start, appt.end
+    appt_id, provider_id = appt.id, appt.provider_id
+    outbox.enqueue_delete(appt)
     db.session.delete(appt)
     db.session.commit()
+    outbox.notify()
+    conflicts.forget(appt_id, provider_id)
+
+    # freigewordenen Slot wieder anbieten
+    fhir_cache.slots.mark_free(schedule_id, start_time)
+    availability.mark_free(provider_id, start_time, end_time)
+
+# ----------------- Fortschritt von Hintergrundjobs -----------------
+
+def get_sync_state(key: str, default: str | None = None) -> str | None:
+    row = db.session.get(SyncState, key)
+    return row.value if row else default
+
+
+def set_sync_state(key: str, value: str | None) -> None:
+    """Setzt den Wert (ohne Commit - gehört in die Transaktion des Aufrufers)."""
+    row = db.session.get(SyncState, key)
+    if row is None:
+        db.session.add(SyncState(key=key, value=value))
+    else:
+        row.value = value
+
+
+def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """
+    Prozessübergreifende Sperre als Zeile in sync_state (mit Commit): frei, abgelaufen
+    oder schon unsere -> übernehmen bzw. verlängern. Bedingtes UPDATE, bei fehlender
+    Zeile INSERT; gewinnt ein anderer Prozess das INSERT, bleibt es bei False.
+    """
+    key = f"lease:{name}"
+    now = datetime.now()
+    taken = db.session.execute(
+        update(SyncState)
+        .where(SyncState.key == key,
+               or_(SyncState.value == owner, SyncState.value.is_(None),
+                   SyncState.updated_at < now - timedelta(seconds=ttl)))
+        .values(value=owner, updated_at=now)
+    ).rowcount
+    if not taken and db.session.get(SyncState, key) is None:
+        db.session.add(SyncState(key=key, value=owner, updated_at=now))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    db.session.commit()
+    return bool(taken)
+
+
+def release_lease(name: str, owner: str) -> None:
+    db.session.execute(
+        update(SyncState).where(SyncState.key == f"lease:{name}", SyncState.value == owner).values(value=None))
+    db.session.commit()
+
 
 def fetch_all_gdas():
     return User.query.filter_by(role=UserRoles.gda)
 
+def first_gda_schedule_id() -> str | None:
+    return fetch_all_gdas().with_entities(User.fhir_schedule_id).limit(1).scalar()
+
 def fetch_all_patients():
     return User.query.filter_by(role=UserRoles.patient)
 
@@ -124,78 +440,6 @@ def generate_random_appointment_datetime():
 
 # ----------------- Initialbefüllung (lokal + FHIR) -----------------
 
-def sqlite_populate():
-    print("Populating database with staff and patients...")
-
-    gdas_to_process = [
-        User(email="alexander.owens@biomedical.org", role=UserRoles.gda,
-             user_password="heartpass", fhir_practitioner_id="822316"),
-        User(email="sophia.ingram@biomedical.org", role=UserRoles.gda,
-             user_password="eyepass", fhir_practitioner_id="822317"),
-        User(email="taylor.mckenzie@biomedical.org", role=UserRoles.gda,
-             user_password="physiopass", fhir_practitioner_id="822318"),
-        User(email="elisa.bennett@biomedical.org", role=UserRoles.gda,
-             user_password="brainpass", fhir_practitioner_id="822319"), ]
-
-    gdas = []  # Hier speichern wir die finalen User-Objekte
-
-    # NEU: Iteriere direkt über die User-Objekte
-    for user in gdas_to_process:
-
-        # 🚀 1. FHIR Schedule und Slots erstellen
-        try:
-            # Verwende die Attribute des User-Objekts, NICHT die Schlüssel (['email'])
-            schedule_id = fhir.create_schedule(user.fhir_practitioner_id)
-
-            # Schedule ID lokal speichern
-            user.fhir_schedule_id = schedule_id
-
-            # Slots erstellen
-            fhir.create_slots(
-                schedule_id=schedule_id,
-                days=7,
-                times=[(9, 0), (10, 0), (14, 0)]
-            )
-            print(f"Created Schedule {schedule_id} and Slots for {user.email}")
-
-        except Exception as e:
-            print(f"Warning: Failed to create FHIR Schedule/Slots for {user.email}. ({e})")
-            user.fhir_schedule_id = None
-
-        gdas.append(user)  # Füge das aktualisierte Objekt zur Liste hinzu
-
-    db.session.add_all(gdas)
-    db.session.commit()
-
-    patients = [
-        # wurden mit postman auf den FHIR servrer gesendet und dann die id die ich zurück bekomme
-        User(email="maria.schneider@example.com", role=UserRoles.patient,
-             user_password="maria123", fhir_patient_id="822300"),
-
-        User(email="felix.mueller@example.com", role=UserRoles.patient,
-             user_password="felix123", fhir_patient_id="822301"),
-
-        User(email="thomas.becker@example.com", role=UserRoles.patient,
-             user_password="thomas123", fhir_patient_id="822302"),
-
-        User(email="lisa.wagner@example.com", role=UserRoles.patient,
-             user_password="lisa123", fhir_patient_id="822303"),
-
-        User(email="max.bauer@example.com", role=UserRoles.patient,
-             user_password="max123", fhir_patient_id="822304"),
-
-        User(email="anna.richter@example.com", role=UserRoles.patient,
-             user_password="anna123", fhir_patient_id="822306"),
-
-        User(email="daniel.weber@example.com", role=UserRoles.patient,
-             user_password="daniel123", fhir_patient_id="822307"),
-
-        User(email="johannes.meier@example.com", role=UserRoles.patient,
-             user_password="johannes123", fhir_patient_id="822308"),
-
-
-    ]
-    db.session.add_all(patients)
-    db.session.commit()
-
-    print("Local storage created & populated with sample data (incl. FHIR IDs if available).")
+def sqlite_populate() -> dict:
+    """Beispiel-User + FHIR-Schedules/Slots (idempotent, parallel) - siehe seeding."""
+    return seeding.seed()
@@ -0,0 +1,548 @@
+# fake_fhir_server.py
+"""
+Lokaler Ersatz für den FHIR-R5-Server (nur für Entwicklung, Tests und Benchmarks).
+
+Hält Patient, Practitioner, Schedule, Slot und Appointment im Speicher und
+spricht genug FHIR-REST, um fhir_client ohne Netz zu betreiben:
+
+- read / create (inkl. If-None-Exist) / update / delete (auch bedingt)
+- Suche mit _id, identifier, email, schedule, actor, patient, practitioner,
+  status, start (ge/gt/le/lt), _lastUpdated, _sort, _count + Bundle.link[next]
+- ETag auf Suchen (If-None-Match -> 304) und <Type>/_history?_since=
+- Batch/Transaction-Bundles
+- einstellbare Latenz und Fehlerquote (503), Zähler pro Methode und Typ
+
+Eigenständig:
+    python fake_fhir_server.py --port 8090 --latency-ms 20 --seed
+    FHIR_BASE_URL=http://127.0.0.1:8090/fhir/ flask run
+
+Im Prozess:
+    server = FakeFHIRServer(latency_ms=5).start()
+    fhir_client.configure(base_url=server.base_url)
+"""
+
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+RESOURCE_TYPES = ("Patient", "Practitioner", "Schedule", "Slot", "Appointment")
+DEFAULT_COUNT = 50
+BASE_PATH = "/fhir"
+
+# Namen der Seed-Daten aus seeding.SEED_GDAS / SEED_PATIENTS
+SEED_PRACTITIONERS = {
+    "822316": ("Alexander", "Owens"),
+    "822317": ("Sophia", "Ingram"),
+    "822318": ("Taylor", "McKenzie"),
+    "822319": ("Elisa", "Bennett"),
+}
+SEED_PATIENTS = {
+    "822300": ("Maria", "Schneider"),
+    "822301": ("Felix", "Müller"),
+    "822302": ("Thomas", "Becker"),
+    "822303": ("Lisa", "Wagner"),
+    "822304": ("Max", "Bauer"),
+    "822306": ("Anna", "Richter"),
+    "822307": ("Daniel", "Weber"),
+    "822308": ("Johannes", "Meier"),
+}
+
+
+class FHIRError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_dt(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt.replace(tzinfo=None) if dt.tzinfo is None else dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _compare(prefix: str, left: datetime, right: datetime) -> bool:
+    return {
+        "eq": left == right, "ne": left != right,
+        "gt": left > right, "ge": left >= right,
+        "lt": left < right, "le": left <= right,
+    }[prefix]
+
+
+def _split_prefix(value: str) -> tuple[str, str]:
+    if value[:2] in ("eq", "ne", "gt", "ge", "lt", "le"):
+        return value[:2], value[2:]
+    return "eq", value
+
+
+def _references(res: dict, param: str) -> list[str]:
+    rt = res["resourceType"]
+    if param == "schedule" and rt == "Slot":
+        return [res.get("schedule", {}).get("reference", "")]
+    if param == "actor" and rt == "Schedule":
+        return [a.get("reference", "") for a in res.get("actor", [])]
+    if param in ("actor", "patient", "practitioner") and rt == "Appointment":
+        refs = [p.get("actor", {}).get("reference", "") for p in res.get("participant", [])]
+        if param == "patient":
+            return [r for r in refs if r.startswith("Patient/")]
+        if param == "practitioner":
+            return [r for r in refs if r.startswith("Practitioner/")]
+        return refs
+    return []
+
+
+class FHIRStore:
+    """In-Memory-Datenhaltung mit Versionen und Historie."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.resources = {rt: {} for rt in RESOURCE_TYPES}
+        self.history = {rt: [] for rt in RESOURCE_TYPES}  # (lastUpdated, method, resource)
+        self.versions = Counter()  # Schreibzähler pro Typ (für ETags auf Suchen)
+        self.tokens = defaultdict(set)  # (type, param, wert) -> ids, für identifier/email
+        self._next_id = 1000
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return str(self._next_id)
+
+    def _check_type(self, rt: str) -> None:
+        if rt not in self.resources:
+            raise FHIRError(404, f"Unknown resource type {rt}")
+
+    def read(self, rt: str, rid: str) -> dict:
+        self._check_type(rt)
+        res = self.resources[rt].get(rid)
+        if res is None:
+            raise FHIRError(404, f"{rt}/{rid} not found")
+        return res
+
+    def _token_keys(self, res: dict) -> list[tuple[str, str, str]]:
+        rt = res["resourceType"]
+        keys = []
+        for i in res.get("identifier", []):
+            keys.append((rt, "identifier", f"{i.get('system', '')}|{i.get('value', '')}"))
+            keys.append((rt, "identifier", i.get("value", "")))
+        for t in res.get("telecom", []):
+            if t.get("system") == "email":
+                keys.append((rt, "email", t.get("value")))
+        return keys
+
+    def _index(self, res: dict | None, add: bool) -> None:
+        if res is None:
+            return
+        for key in self._token_keys(res):
+            if add:
+                self.tokens[key].add(res["id"])
+            else:
+                self.tokens[key].discard(res["id"])
+
+    def _stamp(self, res: dict, version: int) -> None:
+        res["meta"] = {"versionId": str(version), "lastUpdated": _now()}
+
+    def create(self, res: dict, if_none_exist: str | None = None) -> tuple[int, dict]:
+        rt = res.get("resourceType")
+        self._check_type(rt)
+        with self.lock:
+            if if_none_exist:
+                matches = self.search(rt, parse_qsl(if_none_exist))
+                if len(matches) > 1:
+                    raise FHIRError(412, "If-None-Exist matched more than one resource")
+                if matches:
+                    return 200, matches[0]
+            res = copy.deepcopy(res)
+            res["id"] = res.get("id") or self._new_id()
+            self._stamp(res, 1)
+            self.resources[rt][res["id"]] = res
+            self._index(res, True)
+            self.history[rt].append((res["meta"]["lastUpdated"], "POST", res))
+            self.versions[rt] += 1
+            return 201, res
+
+    def update(self, rt: str, rid: str, res: dict) -> tuple[int, dict]:
+        self._check_type(rt)
+        with self.lock:
+            old = self.resources[rt].get(rid)
+            res = copy.deepcopy(res)
+            res["id"] = rid
+            self._stamp(res, int(old["meta"]["versionId"]) + 1 if old else 1)
+            self._index(old, False)
+            self.resources[rt][rid] = res
+            self._index(res, True)
+            self.history[rt].append((res["meta"]["lastUpdated"], "PUT", res))
+            self.versions[rt] += 1
+            return (200 if old else 201), res
+
+    def delete(self, rt: str, rid: str) -> bool:
+        self._check_type(rt)
+        with self.lock:
+            res = self.resources[rt].pop(rid, None)
+            if res is None:
+                return False
+            self._index(res, False)
+            self.history[rt].append((_now(), "DELETE", {"resourceType": rt, "id": rid}))
+            self.versions[rt] += 1
+            return True
+
+    def search(self, rt: str, params: list[tuple[str, str]]) -> list[dict]:
+        self._check_type(rt)
+        with self.lock:
+            items = self._candidates(rt, params)
+        for name, value in params:
+            if name in ("_count", "_offset", "_sort", "_elements", "_summary", "_format"):
+                continue
+            items = [r for r in items if self._matches(r, name, value)]
+
+        sort = dict(params).get("_sort")
+        if sort:
+            key = sort.lstrip("-")
+            getter = (lambda r: r["meta"]["lastUpdated"]) if key == "_lastUpdated" else (lambda r: str(r.get(key, "")))
+            items.sort(key=getter, reverse=sort.startswith("-"))
+        return items
+
+    def _candidates(self, rt: str, params: list[tuple[str, str]]) -> list[dict]:
+        """Über _id/identifier/email direkt per Index vorfiltern, sonst alle Ressourcen."""
+        store = self.resources[rt]
+        for name, value in params:
+            if name == "_id":
+                return [store[i] for i in value.split(",") if i in store]
+            if name in ("identifier", "email"):
+                ids = set().union(*(self.tokens.get((rt, name, v), ()) for v in value.split(",")))
+                return [store[i] for i in ids if i in store]
+        return list(store.values())
+
+    def _matches(self, res: dict, name: str, value: str) -> bool:
+        options = value.split(",")
+        if name == "_id":
+            return res["id"] in options
+        if name == "status":
+            return res.get("status") in options
+        if name in ("schedule", "actor", "patient", "practitioner"):
+            refs = _references(res, name)
+            return any(ref == opt or ref.split("/")[-1] == opt for ref in refs for opt in options)
+        if name == "identifier":
+            idents = {f"{i.get('system', '')}|{i.get('value', '')}" for i in res.get("identifier", [])}
+            idents |= {i.get("value", "") for i in res.get("identifier", [])}
+            return any(opt in idents for opt in options)
+        if name == "email":
+            emails = {t.get("value") for t in res.get("telecom", []) if t.get("system") == "email"}
+            return any(opt in emails for opt in options)
+        if name in ("start", "_lastUpdated"):
+            raw = res.get("start") if name == "start" else res["meta"]["lastUpdated"]
+            if not raw:
+                return False
+            prefix, when = _split_prefix(value)
+            return _compare(prefix, _parse_dt(raw), _parse_dt(when))
+        return True  # unbekannte Parameter ignorieren (wie viele Server)
+
+    def history_since(self, rt: str, since: str | None) -> list[tuple[str, str, dict]]:
+        self._check_type(rt)
+        with self.lock:
+            entries = list(self.history[rt])
+        if since:
+            cutoff = _parse_dt(since)
+            entries = [e for e in entries if _parse_dt(e[0]) > cutoff]
+        return entries
+
+    def seed(self) -> None:
+        """Legt die Practitioner/Patienten aus seeding mit festen IDs an."""
+        for rid, (given, family) in SEED_PRACTITIONERS.items():
+            self.update("Practitioner", rid, {"resourceType": "Practitioner",
+                                              "name": [{"given": [given], "family": family}]})
+        for rid, (given, family) in SEED_PATIENTS.items():
+            self.update("Patient", rid, {"resourceType": "Patient",
+                                         "name": [{"given": [given], "family": family}]})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeFHIRServer._HTTPServer"
+
+    def log_message(self, *args):
+        pass
+
+    # ----------------- Hilfsfunktionen -----------------
+
+    def _send(self, status: int, body: dict | None = None, headers: dict | None = None) -> None:
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/fhir+json")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _outcome(self, status: int, message: str) -> None:
+        self._send(status, {"resourceType": "OperationOutcome",
+                            "issue": [{"severity": "error", "code": "processing", "diagnostics": message}]})
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        path = parts.path
+        if not path.startswith(BASE_PATH):
+            raise FHIRError(404, "not a FHIR path")
+        segments = [s for s in path[len(BASE_PATH):].split("/") if s]
+        return segments, parse_qsl(parts.query, keep_blank_values=True)
+
+    def _handle(self, method: str) -> None:
+        fake = self.server.fake
+        # Body immer lesen, sonst hängt die Keep-Alive-Verbindung
+        body = self._body() if method in ("POST", "PUT") else None
+        try:
+            segments, params = self._route()
+            fake.count(method, segments[0] if segments else "Bundle")
+            fake.delay()
+            if fake.should_fail():
+                return self._outcome(503, "injected error")
+            status, payload, headers = fake.dispatch(method, segments, params, body, self.headers)
+            self._send(status, payload, headers)
+        except FHIRError as e:
+            self._outcome(e.status, str(e))
+        except Exception as e:  # pragma: no cover - Fehler im Fake sichtbar machen
+            self._outcome(500, f"{type(e).__name__}: {e}")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class FakeFHIRServer:
+    """Fake-FHIR-Server auf localhost, im Hintergrund-Thread."""
+
+    class _HTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+        fake: "FakeFHIRServer"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, reject_bundles: bool = False,
+                 seed: bool = True):
+        self.store = FHIRStore()
+        if seed:
+            self.store.seed()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.reject_bundles = reject_bundles
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._httpd = self._HTTPServer((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread = None
+
+    # ----------------- Lebenszyklus -----------------
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{BASE_PATH}/"
+
+    def start(self) -> "FakeFHIRServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-fhir", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ----------------- Fehler/Latenz/Zähler -----------------
+
+    def delay(self) -> None:
+        ms = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def count(self, method: str, resource_type: str) -> None:
+        with self._calls_lock:
+            self.calls[f"{method} {resource_type}"] += 1
+            self.calls["total"] += 1
+
+    def total_calls(self) -> int:
+        with self._calls_lock:
+            return self.calls["total"]
+
+    def reset_counters(self) -> None:
+        with self._calls_lock:
+            self.calls.clear()
+
+    # ----------------- REST -----------------
+
+    def dispatch(self, method, segments, params, body, headers):
+        store = self.store
+        if not segments:
+            if method != "POST":
+                raise FHIRError(405, "only POST on base URL")
+            if self.reject_bundles:
+                raise FHIRError(405, "bundles disabled")
+            return 200, self._bundle(body), {}
+
+        rt = segments[0]
+        if len(segments) == 1:
+            if method == "GET":
+                return self._search(rt, params, headers.get("If-None-Match"))
+            if method == "POST":
+                if body.get("resourceType") != rt:
+                    raise FHIRError(400, "resourceType does not match URL")
+                status, res = store.create(body, headers.get("If-None-Exist"))
+                return status, res, {"Location": self._location(res), "ETag": f'W/"{res["meta"]["versionId"]}"'}
+            if method == "DELETE":  # bedingtes Löschen
+                for res in store.search(rt, params):
+                    store.delete(rt, res["id"])
+                return 204, None, {}
+        elif len(segments) == 2 and segments[1] == "_history" and method == "GET":
+            return 200, self._history(rt, dict(params).get("_since")), {}
+        elif len(segments) == 2:
+            rid = segments[1]
+            if method == "GET":
+                res = store.read(rt, rid)
+                return 200, res, {"ETag": f'W/"{res["meta"]["versionId"]}"'}
+            if method == "PUT":
+                status, res = store.update(rt, rid, body)
+                return status, res, {"Location": self._location(res)}
+            if method == "DELETE":
+                return (204 if store.delete(rt, rid) else 404), None, {}
+        raise FHIRError(400, f"unsupported request {method} {'/'.join(segments)}")
+
+    def _location(self, res: dict) -> str:
+        return f"{res['resourceType']}/{res['id']}/_history/{res['meta']['versionId']}"
+
+    def _search(self, rt, params, if_none_match):
+        etag = f'W/"{rt}-{self.store.versions[rt]}"'
+        if if_none_match and if_none_match == etag:
+            return 304, None, {"ETag": etag}
+        matches = self.store.search(rt, params)
+        args = dict(params)
+        count = int(args.get("_count") or DEFAULT_COUNT)
+        offset = int(args.get("_offset") or 0)
+        page = matches[offset:offset + count]
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "meta": {"lastUpdated": _now()},
+            "total": len(matches),
+            "link": [],
+            "entry": [{"fullUrl": f"{self.base_url}{rt}/{r['id']}", "resource": r,
+                       "search": {"mode": "match"}} for r in page],
+        }
+        if offset + count < len(matches):
+            next_params = [(k, v) for k, v in params if k != "_offset"] + [("_offset", str(offset + count))]
+            bundle["link"].append({"relation": "next", "url": f"{self.base_url}{rt}?{urlencode(next_params)}"})
+        return 200, bundle, {"ETag": etag}
+
+    def _history(self, rt, since):
+        entries = []
+        for stamp, method, res in self.store.history_since(rt, since):
+            entry = {"request": {"method": method, "url": f"{rt}/{res['id']}"},
+                     "response": {"status": "204" if method == "DELETE" else "200", "lastModified": stamp}}
+            if method != "DELETE":
+                entry["resource"] = res
+            entries.append(entry)
+        return {"resourceType": "Bundle", "type": "history", "meta": {"lastUpdated": _now()},
+                "total": len(entries), "entry": entries}
+
+    def _bundle(self, bundle: dict) -> dict:
+        kind = bundle.get("type")
+        if kind not in ("batch", "transaction"):
+            raise FHIRError(400, f"unsupported Bundle.type {kind}")
+        snapshot = None
+        if kind == "transaction":
+            with self.store.lock:
+                snapshot = copy.deepcopy((self.store.resources, self.store.history, self.store.versions))
+
+        out = []
+        for entry in bundle.get("entry", []):
+            req = entry.get("request", {})
+            try:
+                out.append(self._bundle_entry(req, entry.get("resource")))
+            except FHIRError as e:
+                if kind == "transaction":
+                    with self.store.lock:
+                        self.store.resources, self.store.history, self.store.versions = snapshot
+                    raise
+                out.append({"response": {"status": f"{e.status}", "outcome": {
+                    "resourceType": "OperationOutcome", "issue": [{"diagnostics": str(e)}]}}})
+        return {"resourceType": "Bundle", "type": f"{kind}-response", "entry": out}
+
+    def _bundle_entry(self, req: dict, resource: dict | None) -> dict:
+        method = req.get("method", "GET").upper()
+        url = urlsplit(req.get("url", ""))
+        segments = [s for s in url.path.split("/") if s]
+        params = parse_qsl(url.query)
+        store = self.store
+        if method == "POST":
+            status, res = store.create(resource, req.get("ifNoneExist"))
+            return {"response": {"status": "201 Created" if status == 201 else "200 OK",
+                                 "location": self._location(res)}}
+        if method == "PUT":
+            status, res = store.update(segments[0], segments[1], resource)
+            return {"response": {"status": f"{status}", "location": self._location(res)}}
+        if method == "DELETE":
+            if len(segments) == 2:
+                found = store.delete(segments[0], segments[1])
+            else:
+                found = False
+                for res in store.search(segments[0], params):
+                    found = store.delete(segments[0], res["id"]) or found
+            return {"response": {"status": "204 No Content" if found else "404 Not Found"}}
+        if method == "GET":
+            if len(segments) == 2:
+                return {"resource": store.read(segments[0], segments[1]), "response": {"status": "200 OK"}}
+            _, bundle, _ = self._search(segments[0], params, None)
+            return {"resource": bundle, "response": {"status": "200 OK"}}
+        raise FHIRError(400, f"unsupported bundle method {method}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokaler Fake-FHIR-Server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-bundles", action="store_true")
+    parser.add_argument("--no-seed", action="store_true", help="ohne Seed-Practitioner/-Patienten starten")
+    args = parser.parse_args()
+
+    server = FakeFHIRServer(args.host, args.port, args.latency_ms, args.jitter_ms,
+                            args.error_rate, args.reject_bundles, seed=not args.no_seed)
+    print(f"Fake FHIR server listening on {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
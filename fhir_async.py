@@ -0,0 +1,325 @@
+# fhir_async.py
+"""
+Asynchroner Zugang zum FHIR-Server (httpx) für Jobs, die viele Anfragen
+gleichzeitig offen haben wollen - genutzt von schedule_templates.publish, um
+die Slots hunderter GDAs über einen Pool statt nacheinander anzulegen.
+Dieselben Operationen wie fhir_client (Patient, Termin anlegen/löschen,
+Schedule, Slots, Namen, Slot-Suche) als Coroutinen.
+
+- ein gemeinsamer Connection-Pool (httpx.AsyncClient) pro AsyncFHIRClient
+- Semaphore begrenzt die Zahl gleichzeitiger Anfragen
+- Retries wie fhir_client.FHIRClient: Verbindungsaufbau scheitert -> immer
+  (die Anfrage kam nie an), 429/5xx nur bei idempotenten Methoden; Lese-
+  Timeouts und abgebrochene Antworten werden bei POST nie wiederholt;
+  Retry-After wird höchstens FHIR_ASYNC_BACKOFF_MAX Sekunden abgewartet
+- derselbe Circuit Breaker (fhir_client.breaker) wie der synchrone Client
+
+Payloads und Parser kommen aus fhir_client, damit sync und async exakt
+dieselben Ressourcen erzeugen. Beispiel:
+
+    async with AsyncFHIRClient() as client:
+        ids = await client.create_resources_many("Slot", {"sched-1": slots_1, "sched-2": slots_2})
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+import fhir_client as fhir
+
+try:
+    import httpx  # optional
+except Exception:
+    httpx = None
+
+FHIR_ASYNC_MAX_CONNECTIONS = int(os.environ.get("FHIR_ASYNC_MAX_CONNECTIONS", "100"))
+FHIR_ASYNC_CONCURRENCY = int(os.environ.get("FHIR_ASYNC_CONCURRENCY", "200"))
+FHIR_ASYNC_BACKOFF_MAX = float(os.environ.get("FHIR_ASYNC_BACKOFF_MAX", "30"))
+
+_IDEMPOTENT = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+def available() -> bool:
+    """True, wenn httpx installiert ist und ein echter Server konfiguriert ist."""
+    return httpx is not None and fhir.USE_REAL
+
+
+def _not_sent(error: Exception) -> bool:
+    # nur diese Fehler garantieren, dass der Server die Anfrage nie gesehen hat
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class AsyncFHIRClient:
+    """Asynchroner Zugang zum FHIR-Server; Einstellungen wie fhir_client.FHIRClient."""
+
+    def __init__(self, base_url: str | None = None,
+                 connect_timeout: float = fhir.FHIR_CONNECT_TIMEOUT,
+                 read_timeout: float = fhir.FHIR_READ_TIMEOUT,
+                 max_connections: int = FHIR_ASYNC_MAX_CONNECTIONS,
+                 max_concurrency: int = FHIR_ASYNC_CONCURRENCY,
+                 max_retries: int = fhir.FHIR_MAX_RETRIES,
+                 backoff_factor: float = fhir.FHIR_BACKOFF_FACTOR,
+                 backoff_max: float = FHIR_ASYNC_BACKOFF_MAX,
+                 circuit_breaker: fhir.CircuitBreaker | None = None):
+        if httpx is None:
+            raise RuntimeError("AsyncFHIRClient needs the optional 'httpx' package")
+        self.base_url = (base_url or fhir.FHIR_BASE_URL).rstrip("/") + "/"
+        self.breaker = circuit_breaker or fhir.breaker
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            headers={"Accept": "application/fhir+json"},
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    # ----------------- HTTP -----------------
+
+    async def request(self, method: str, path: str, **kwargs):
+        """Wie FHIRClient.request: Breaker, Retries nur, wo keine Doppelanlage droht."""
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            status = None
+            try:
+                async with self._semaphore:
+                    t0 = time.perf_counter()
+                    try:
+                        r = await self._client.request(method, path, **kwargs)
+                        status = r.status_code
+                    finally:
+                        elapsed = time.perf_counter() - t0
+                        self.breaker.record_call(method, path, status, elapsed, self.base_url)
+                        fhir.notify_request_listeners(method, path, status, elapsed, self.base_url)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or (method not in _IDEMPOTENT and not _not_sent(e)):
+                    raise
+            else:
+                if (r.status_code not in fhir.RETRY_STATUS or method not in _IDEMPOTENT
+                        or attempt >= self.max_retries):
+                    return r
+                retry_after = r.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    await asyncio.sleep(min(int(retry_after), self.backoff_max))
+                    attempt += 1
+                    continue
+            await asyncio.sleep(min(self.backoff_factor * 2 ** attempt, self.backoff_max))
+            attempt += 1
+
+    async def get(self, path: str, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    # ----------------- Operationen (wie fhir_client) -----------------
+
+    async def create_patient(self, first_name, last_name, email) -> str:
+        if not fhir.USE_REAL:
+            return fhir._mock_id("patient")
+        r = await self.post("Patient", headers=fhir.HEADERS, json=fhir.patient_body(first_name, last_name, email))
+        r.raise_for_status()
+        fhir_id = r.json().get("id")
+        fhir.remember_created_patient(fhir_id, first_name, last_name)
+        return fhir_id
+
+    async def create_appointment(self, patient_fhir_id: str, provider_fhir_id: str,
+                                 start_time: datetime, end_time: datetime, notes: str,
+                                 idempotency_key: str | None = None) -> str:
+        if not fhir.USE_REAL:
+            return fhir._mock_id("appt")
+        body = fhir.appointment_body(patient_fhir_id, provider_fhir_id, start_time, end_time, notes, idempotency_key)
+        headers = {}
+        if idempotency_key:
+            headers["If-None-Exist"] = fhir.appointment_identifier_query(idempotency_key)
+        r = await self.post("Appointment", json=body, headers=headers)
+        r.raise_for_status()
+        return fhir._id_from_response(r)
+
+    async def delete_appointment(self, fhir_appointment_id: str | None = None,
+                                 idempotency_key: str | None = None, missing_ok: bool = True) -> None:
+        if not fhir.USE_REAL:
+            return
+        if fhir_appointment_id:
+            r = await self.delete(f"Appointment/{fhir_appointment_id}")
+        else:
+            r = await self.delete(f"Appointment?{fhir.appointment_identifier_query(idempotency_key)}")
+        # 404 ist OK, falls schon gelöscht
+        if r.status_code != 404 or not missing_ok:
+            r.raise_for_status()
+
+    async def create_schedule(self, practitioner_id: str) -> str:
+        if not fhir.USE_REAL:
+            return fhir._mock_id("schedule")
+        r = await self.post("Schedule", json=fhir.schedule_body(practitioner_id))
+        r.raise_for_status()
+        return fhir.schedule_id_from_response(r.json())
+
+    async def create_slots(self, schedule_id: str, start_date: datetime | None = None,
+                           days: int = 5, times: list[tuple[int, int]] | None = None) -> list[str]:
+        return await self.create_resources("Slot", fhir.slot_bodies(schedule_id, start_date, days, times))
+
+    async def read_display_name(self, resource_type: str, fhir_id: str) -> str:
+        r = await self.get(f"{resource_type}/{fhir_id}", params={"_elements": "name"})
+        r.raise_for_status()
+        return fhir.display_name_from_resource(r.json())
+
+    async def search_display_names(self, resource_type: str, fhir_ids: list[str]) -> dict[str, str]:
+        """Wie fhir_client.search_display_names; die _id-Blöcke laufen parallel."""
+        ids = [str(i) for i in dict.fromkeys(fhir_ids) if i]
+        if not ids or not fhir.USE_REAL:
+            return {}
+
+        async def chunk_names(chunk):
+            params = {"_id": ",".join(chunk), "_elements": "name", "_count": str(len(chunk))}
+            r = await self.get(resource_type, params=params)
+            r.raise_for_status()
+            return {
+                res["id"]: fhir.display_name_from_resource(res)
+                for res in (e.get("resource", {}) for e in r.json().get("entry", []))
+                if res.get("resourceType") == resource_type and res.get("id")
+            }
+
+        size = fhir.NAME_SEARCH_CHUNK
+        out = {}
+        for found in await asyncio.gather(*(chunk_names(ids[i:i + size]) for i in range(0, len(ids), size))):
+            out.update(found)
+        return out
+
+    async def iter_bundle_resources(self, path: str, params=None):
+        """Async-Generator über alle Ressourcen einer Suche, folgt Bundle.link[next]."""
+        url, query = path, params
+        while url:
+            r = await self.get(url, params=query)
+            r.raise_for_status()
+            bundle = r.json()
+            for e in bundle.get("entry", []):
+                if e.get("resource"):
+                    yield e["resource"]
+            url = next((l.get("url") for l in bundle.get("link", []) if l.get("relation") == "next"), None)
+            query = None
+
+    async def iter_slots_for_schedules(self, schedule_ids: list[str], start=None, end=None,
+                                       status: str | None = "free", page_size: int = fhir.SLOT_PAGE_SIZE):
+        schedule_ids = [s for s in dict.fromkeys(schedule_ids) if s]
+        if not schedule_ids:
+            return
+        if not fhir.USE_REAL:
+            for res in fhir.iter_slots_for_schedules(schedule_ids, start, end, status, page_size):
+                yield res
+            return
+        params = fhir._slot_search_params(schedule_ids, start, end, status, page_size)
+        async for res in self.iter_bundle_resources("Slot", params):
+            if res.get("resourceType") == "Slot":
+                yield res
+
+    async def get_slots_by_schedule(self, schedule_id: str, start=None, end=None) -> list[dict]:
+        """Freie Slots ohne Cache (der Slot-Cache gehört zum synchronen Web-Pfad)."""
+        out = []
+        async for res in self.iter_slots_for_schedules([schedule_id], start, end):
+            option = fhir.slot_option(res)
+            if option:
+                out.append(option)
+        return out
+
+    # ----------------- Bulk -----------------
+
+    async def send_bundle(self, entries: list[dict], bundle_type: str = "batch") -> list[dict]:
+        r = await self.post("", headers=fhir.HEADERS, json=fhir.bundle_body(entries, bundle_type))
+        if r.status_code in fhir.BUNDLE_REJECTED_STATUS:
+            fhir.set_bundles_supported(False)
+            raise fhir.BundleNotSupported(f"{r.status_code} {r.reason_phrase}")
+        r.raise_for_status()
+        fhir.set_bundles_supported(True)
+        return fhir.bundle_responses(r.json(), len(entries))
+
+    async def create_resources(self, resource_type: str, resources: list[dict],
+                               if_none_exist: list[str | None] | None = None,
+                               chunk_size: int | None = None) -> list[str]:
+        """
+        Wie fhir_client.create_resources: Transaction-Bundles je Block, alle Blöcke
+        gleichzeitig; lehnt der Server Bundles ab, parallele Einzel-POSTs.
+        """
+        if not resources:
+            return []
+        if not fhir.USE_REAL:
+            return [fhir._mock_id(resource_type.lower()) for _ in resources]
+
+        if_none_exist = if_none_exist or [None] * len(resources)
+        size = chunk_size or fhir.BUNDLE_CHUNK_SIZE
+        chunks = [(resources[i:i + size], if_none_exist[i:i + size]) for i in range(0, len(resources), size)]
+
+        async def post_chunk(chunk, conditions):
+            responses = await self.send_bundle(fhir.post_entries(chunk, conditions), "transaction")
+            return fhir.ids_from_bundle_responses(responses, "transaction")
+
+        if fhir.bundles_supported():
+            try:
+                # erster Block allein: klärt, ob der Server Bundles annimmt
+                ids = await post_chunk(*chunks[0])
+                for chunk_ids in await asyncio.gather(*(post_chunk(*c) for c in chunks[1:])):
+                    ids.extend(chunk_ids)
+                return ids
+            except fhir.BundleNotSupported:
+                pass
+
+        async def post_single(res, condition):
+            headers = dict(fhir.HEADERS)
+            if condition:
+                headers["If-None-Exist"] = condition
+            r = await self.post(res["resourceType"], headers=headers, json=res)
+            r.raise_for_status()
+            return fhir._id_from_response(r)
+
+        return list(await asyncio.gather(*(post_single(r, c) for r, c in zip(resources, if_none_exist))))
+
+    async def create_resources_many(self, resource_type: str, jobs: dict,
+                                    conditions: dict | None = None) -> dict:
+        """
+        Viele unabhängige Anlagen gleichzeitig: {key: [ressourcen]} -> {key: [ids] oder Exception}.
+        Ein fehlgeschlagener Schlüssel bricht die anderen nicht ab.
+        """
+        keys = list(jobs)
+        results = await asyncio.gather(*(
+            self.create_resources(resource_type, jobs[k], (conditions or {}).get(k)) for k in keys
+        ), return_exceptions=True)
+        return dict(zip(keys, results))
+
+    async def read_display_names(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+        """Namen für viele (resource_type, fhir_id) auf einmal, eine Suche pro Typ und Block."""
+        by_type = {}
+        for resource_type, fhir_id in keys:
+            by_type.setdefault(resource_type, []).append(fhir_id)
+        types = list(by_type)
+        found = await asyncio.gather(*(self.search_display_names(t, by_type[t]) for t in types))
+        return {(t, fid): name for t, names in zip(types, found) for fid, name in names.items()}
+
+
+def run(coro):
+    """Für Skripte/CLI: führt eine Coroutine in einer frischen Event-Loop aus."""
+    return asyncio.run(coro)
+
+
+def create_resources_many(resource_type: str, jobs: dict, conditions: dict | None = None) -> dict:
+    """Synchroner Einstieg für Jobs: ein Client, eine Event-Loop für alle Schlüssel."""
+    async def main():
+        async with AsyncFHIRClient() as client:
+            return await client.create_resources_many(resource_type, jobs, conditions)
+    return run(main())
@@ -0,0 +1,313 @@
+# fhir_cache.py
+"""
+Caches für FHIR-Daten.
+
+- TTLCache: begrenzter LRU-Cache mit Ablaufzeit pro Eintrag und Hit/Miss-Zählern.
+- make_cache: TTLCache oder ein geteiltes Backend (SQLite-Datei, Redis) nach
+  FHIR_CACHE_BACKEND, siehe cache_backends.
+- display_names: Anzeigenamen von Patient/Practitioner, Schlüssel (resource_type, fhir_id).
+- slots: freie Slots pro Schedule und Zeitfenster, mit ETag/_lastUpdated zur
+  Revalidierung und Write-Through bei Buchung/Stornierung.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+import cache_backends
+
+log = logging.getLogger(__name__)
+
+DISPLAY_NAME_TTL = 15 * 60  # Sekunden
+DISPLAY_NAME_MAXSIZE = 2048
+
+SLOT_CACHE_FRESH = 30  # Sekunden, in denen ohne jede Anfrage ausgeliefert wird
+SLOT_CACHE_TTL = 60 * 60  # danach wird komplett neu geladen
+SLOT_CACHE_MAXSIZE = 512
+SLOT_BOOKED_TTL = 7 * 24 * 60 * 60  # lokal gebuchte Startzeiten, unabhängig von den Fenstern
+SLOT_BOOKED_LEASE = 5.0  # Sekunden Sperre im Backend für das Ändern der gebuchten Zeiten (wird nie abgewartet)
+
+_MISSING = object()
+
+
+class TTLCache(cache_backends.SingleFlight):
+    """Thread-sicherer LRU-Cache; Einträge verfallen nach 'ttl' Sekunden."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self._init_single_flight()
+
+    def get(self, key, default=None, allow_stale: bool = False):
+        """
+        Abgelaufene Einträge bleiben liegen (bis LRU sie verdrängt): mit
+        allow_stale=True kommt der letzte bekannte Wert, z. B. bei FHIR-Ausfall.
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or (item[0] <= now and not allow_stale):
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if item[0] <= now:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> list:
+        """Momentaufnahme aller Schlüssel (auch abgelaufene, ohne LRU/Zähler zu ändern)."""
+        with self._lock:
+            return list(self._data)
+
+    def values(self) -> list:
+        """Momentaufnahme aller nicht abgelaufenen Werte (ohne LRU/Zähler zu ändern)."""
+        now = time.monotonic()
+        with self._lock:
+            return [value for expires_at, value in self._data.values() if expires_at > now]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_hits": self.stale_hits,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+            }
+
+
+def make_cache(namespace: str, maxsize: int, ttl: float, backend: str | None = None):
+    """Cache für 'namespace': memory (TTLCache), sqlite oder redis - Standard FHIR_CACHE_BACKEND."""
+    backend = backend or cache_backends.CACHE_BACKEND
+    if backend == "sqlite":
+        return cache_backends.SQLiteCache(cache_backends.CACHE_PATH, namespace, maxsize, ttl)
+    if backend == "redis":
+        return cache_backends.RedisCache(namespace, maxsize, ttl)
+    if backend != "memory":
+        raise ValueError(f"unknown cache backend: {backend}")
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+# Anzeigenamen: ("Patient" | "Practitioner", fhir_id) -> "Vorname Nachname"
+display_names = make_cache("display_names", DISPLAY_NAME_MAXSIZE, DISPLAY_NAME_TTL)
+
+
+def display_name_key(resource_type: str, fhir_id) -> tuple[str, str]:
+    return resource_type, str(fhir_id)
+
+
+def remember_display_name(resource_type: str, fhir_id, display: str) -> None:
+    if fhir_id and display:
+        display_names.set(display_name_key(resource_type, fhir_id), display)
+
+
+def invalidate_display_name(resource_type: str, fhir_id) -> None:
+    """Nach Namensänderungen aufrufen, damit der nächste Zugriff neu lädt."""
+    if fhir_id:
+        display_names.invalidate(display_name_key(resource_type, fhir_id))
+
+
+# ----------------- Slot-Cache -----------------
+
+def _slot_time_key(dt) -> tuple[str, str]:
+    return dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M")
+
+
+class SlotWindow:
+    """Freie Slots eines Schedules im Fenster [start, end) plus Validierungsdaten."""
+
+    def __init__(self, schedule_id: str, start, end, slots: dict,
+                 etag: str | None = None, last_updated: str | None = None):
+        self.schedule_id = schedule_id
+        self.start = start
+        self.end = end
+        self.slots = slots  # slot_id -> Option-Dict (label/date/time/...)
+        self.etag = etag
+        self.last_updated = last_updated  # FHIR-Instant für _lastUpdated=ge…
+        self.booked = set()  # (date, time), lokal gebucht - liegt getrennt im SlotCache
+        self.checked_at = time.time()  # Wanduhr: Fenster können zwischen Workern wandern
+
+    @property
+    def key(self):
+        return slot_window_key(self.schedule_id, self.start, self.end)
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.checked_at < max_age
+
+    def touch(self) -> None:
+        self.checked_at = time.time()
+
+    def options(self) -> list[dict]:
+        booked = self.booked
+        return sorted(
+            (o for o in self.slots.values() if (o["date"], o["time"]) not in booked),
+            key=lambda o: (o["date"], o["time"]),
+        )
+
+
+    def to_dict(self) -> dict:
+        """JSON-taugliche Form für die Cache-Backends."""
+        return {
+            "schedule_id": self.schedule_id,
+            "start": self.start.isoformat() if self.start else None,
+            "end": self.end.isoformat() if self.end else None,
+            "slots": dict(self.slots),
+            "etag": self.etag,
+            "last_updated": self.last_updated,
+            "checked_at": self.checked_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SlotWindow":
+        window = cls(data["schedule_id"], _parse_bound(data["start"]), _parse_bound(data["end"]),
+                     dict(data["slots"]), etag=data["etag"], last_updated=data["last_updated"])
+        window.checked_at = data["checked_at"]
+        return window
+
+
+def _parse_bound(value: str | None):
+    if not value:
+        return None
+    return datetime.fromisoformat(value) if "T" in value else date.fromisoformat(value)
+
+
+def slot_window_key(schedule_id: str, start, end) -> tuple:
+    return (
+        str(schedule_id),
+        start.isoformat() if start else None,
+        end.isoformat() if end else None,
+    )
+
+
+class SlotCache:
+    """
+    Hält SlotWindows pro (schedule_id, start, end), im Backend als Dict (to_dict).
+    Lesen/Revalidieren macht fhir_client.get_slots_by_schedule; hier nur Ablage,
+    Zähler und das direkte Nachziehen bei lokalen Buchungen.
+
+    Lokal gebuchte Startzeiten liegen getrennt pro Schedule (Namespace
+    "slots_booked"): ein Worker, der gerade ein Fenster revalidiert und ablegt,
+    kann eine Buchung eines anderen Workers so nicht überschreiben. Geändert
+    werden sie unter einer Sperre im Backend (Lease), nicht nur im Prozess;
+    ist sie belegt, wird nicht gewartet, sondern die Fenster des Schedules
+    verworfen (die Buchung läuft im Request, siehe create_appointment).
+    """
+
+    def __init__(self, maxsize: int = SLOT_CACHE_MAXSIZE, ttl: float = SLOT_CACHE_TTL,
+                 fresh_for: float = SLOT_CACHE_FRESH, backend: str | None = None):
+        self._windows = make_cache("slots", maxsize, ttl, backend)
+        self._booked = make_cache("slots_booked", maxsize, SLOT_BOOKED_TTL, backend)
+        self._lock = threading.Lock()
+        self.fresh_for = fresh_for
+        self.not_modified = 0
+        self.deltas = 0
+        self.full_loads = 0
+        self.stale_served = 0
+
+    def get(self, schedule_id: str, start, end, allow_stale: bool = False) -> SlotWindow | None:
+        data = self._windows.get(slot_window_key(schedule_id, start, end), allow_stale=allow_stale)
+        return self._with_booked(data) if data is not None else None
+
+    def get_or_load(self, schedule_id: str, start, end, loader) -> SlotWindow:
+        """Kaltes Fenster: loader() läuft einmal, gleichzeitige Anfragen (auch anderer Worker) warten."""
+        data = self._windows.get_or_load(slot_window_key(schedule_id, start, end), lambda: loader().to_dict())
+        return self._with_booked(data)
+
+    def put(self, window: SlotWindow) -> None:
+        self._windows.set(window.key, window.to_dict())
+
+    def _with_booked(self, data: dict) -> SlotWindow:
+        window = SlotWindow.from_dict(data)
+        window.booked = self.booked_times(window.schedule_id)
+        return window
+
+    def booked_times(self, schedule_id: str) -> set[tuple[str, str]]:
+        return {tuple(t) for t in self._booked.get(str(schedule_id), [])}
+
+    def _update_booked(self, schedule_id: str, key: tuple[str, str], booked: bool) -> bool:
+        """
+        Read-modify-write der gebuchten Zeiten, best effort: genau ein Versuch auf
+        die Lease im Backend. Ist sie belegt (anderer Worker), werden die Fenster
+        verworfen und beim nächsten Zugriff neu geladen. False in diesem Fall.
+        """
+        schedule_id = str(schedule_id)
+        with self._lock:
+            token = self._booked.acquire_lease(schedule_id, SLOT_BOOKED_LEASE)
+            if token is None:
+                log.info("Booked slots of Schedule/%s are locked, invalidating its windows", schedule_id)
+                self.invalidate(schedule_id)
+                return False
+            try:
+                times = self.booked_times(schedule_id)
+                (times.add if booked else times.discard)(key)
+                today = date.today().isoformat()
+                self._booked.set(schedule_id, sorted([d, t] for d, t in times if d >= today))
+                return True
+            finally:
+                self._booked.release_lease(schedule_id, token)
+
+    def mark_booked(self, schedule_id: str | None, start_dt) -> None:
+        """Lokale Buchung: Slot zu dieser Startzeit nicht mehr anbieten."""
+        if schedule_id:
+            self._update_booked(schedule_id, _slot_time_key(start_dt), True)
+
+    def mark_free(self, schedule_id: str | None, start_dt) -> None:
+        """Lokale Stornierung: zuvor gebuchten Slot wieder anbieten."""
+        if schedule_id:
+            self._update_booked(schedule_id, _slot_time_key(start_dt), False)
+
+    def invalidate(self, schedule_id: str) -> None:
+        """Alle Fenster des Schedules verwerfen, auch abgelaufene (sonst kämen sie über allow_stale zurück)."""
+        for key in self._windows.keys():
+            if key[0] == str(schedule_id):
+                self._windows.invalidate(key)
+
+    def stats(self) -> dict:
+        out = self._windows.stats()
+        out.update(not_modified=self.not_modified, deltas=self.deltas, full_loads=self.full_loads,
+                   stale_served=self.stale_served)
+        return out
+
+
+slots = SlotCache()
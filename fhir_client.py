@@ -4,29 +4,298 @@ Leichter FHIR-Client mit Auto-MOCK:
 - Wenn FHIR_BASE_URL (z. B. http://localhost:8080/fhir) gesetzt und 'requests' verfügbar,
   werden echte POST/GETs gemacht.
 - Sonst arbeitet der Client im MOCK-Modus und liefert Fake-IDs zurück.
+- Alle echten Aufrufe laufen über einen gemeinsamen FHIRClient (Session mit
+  Connection-Pool, Keep-Alive, Timeouts und Retries bei 429/5xx).
 """
 
+import logging
 import os
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 
-FHIR_BASE_URL = "https://hapi.fhir.org/baseR5/"
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import fhir_cache
+
+FHIR_BASE_URL = os.environ.get("FHIR_BASE_URL", "https://hapi.fhir.org/baseR5/")
 HEADERS = {"Content-Type": "application/fhir+json"}
 
+# Verbindungs-Einstellungen (per Umgebungsvariable überschreibbar)
+FHIR_CONNECT_TIMEOUT = float(os.environ.get("FHIR_CONNECT_TIMEOUT", "3.05"))
+FHIR_READ_TIMEOUT = float(os.environ.get("FHIR_READ_TIMEOUT", "10"))
+FHIR_POOL_SIZE = int(os.environ.get("FHIR_POOL_SIZE", "20"))
+FHIR_MAX_RETRIES = int(os.environ.get("FHIR_MAX_RETRIES", "3"))
+FHIR_BACKOFF_FACTOR = float(os.environ.get("FHIR_BACKOFF_FACTOR", "0.3"))
+RETRY_STATUS = (429, 500, 502, 503, 504)
 
-def create_patient(first_name, last_name, email):
-    # 1. FHIR-Ressource erstellen (Payload)
-    patient_resource = {
+# Circuit Breaker: nach so vielen Fehlschlägen in Folge (5xx/429, Timeout oder
+# langsamer als FHIR_BREAKER_SLOW_CALL) wird FHIR_BREAKER_RESET Sekunden lang
+# sofort abgelehnt, danach darf ein einzelner Probe-Aufruf durch. Bundles
+# (POST auf die Basis-URL: Seeding, Import, Outbox) dürfen lange dauern - für
+# sie gilt die Langsam-Regel nicht, sonst sperren fünf große Batches die Seiten.
+FHIR_BREAKER_FAILURES = int(os.environ.get("FHIR_BREAKER_FAILURES", "5"))
+FHIR_BREAKER_RESET = float(os.environ.get("FHIR_BREAKER_RESET", "30"))
+FHIR_BREAKER_SLOW_CALL = float(os.environ.get("FHIR_BREAKER_SLOW_CALL", "2.0"))
+
+USE_REAL = bool(FHIR_BASE_URL)
+
+log = logging.getLogger(__name__)
+
+try:
+    import requests  # optional
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except Exception:
+    requests = None
+    USE_REAL = False
+
+
+# Beobachter für jeden HTTP-Aufruf: fn(method, resource_type, status, seconds)
+# (status None = keine Antwort, z. B. Timeout). Genutzt von metrics.
+_request_listeners = []
+
+
+def add_request_listener(fn) -> None:
+    if fn not in _request_listeners:
+        _request_listeners.append(fn)
+
+
+def remove_request_listener(fn) -> None:
+    if fn in _request_listeners:
+        _request_listeners.remove(fn)
+
+
+def resource_type_of(path: str, base_url: str = "") -> str:
+    """'Slot?schedule=…' / 'https://…/Patient/1' -> 'Slot' / 'Patient'; Basis-URL -> 'Bundle'."""
+    if base_url and path.startswith(base_url):
+        path = path[len(base_url):]
+    path = path.split("?", 1)[0].strip("/")
+    return path.split("/", 1)[0] if path else "Bundle"
+
+
+def notify_request_listeners(method: str, path: str, status: int | None, seconds: float,
+                             base_url: str = "") -> None:
+    if not _request_listeners:
+        return
+    resource_type = resource_type_of(path, base_url)
+    for fn in list(_request_listeners):
+        try:
+            fn(method, resource_type, status, seconds)
+        except Exception:
+            log.exception("FHIR request listener failed")
+
+
+class FHIRUnavailable(Exception):
+    """Circuit Breaker offen: der FHIR-Server wird gerade nicht gefragt."""
+
+
+class CircuitBreaker:
+    """
+    closed -> (N Fehlschläge in Folge) -> open -> (nach reset_timeout) -> half_open
+    half_open: genau ein Probe-Aufruf; Erfolg schließt, Fehlschlag öffnet wieder.
+    """
+
+    def __init__(self, failure_threshold: int = FHIR_BREAKER_FAILURES,
+                 reset_timeout: float = FHIR_BREAKER_RESET,
+                 slow_call: float = FHIR_BREAKER_SLOW_CALL):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Wirft FHIRUnavailable, wenn der Aufruf gar nicht erst versucht werden soll."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise FHIRUnavailable("FHIR server unavailable (circuit open)")
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    log.warning("FHIR circuit breaker opened after %s failures", self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_call(self, method: str, path: str, status: int | None, seconds: float,
+                    base_url: str = "") -> None:
+        """Wertet einen HTTP-Aufruf aus; 4xx sind Fehler des Aufrufers, nicht des Servers."""
+        bulk = method == "POST" and resource_type_of(path, base_url) == "Bundle"
+        self.record(status is not None and status not in RETRY_STATUS
+                    and (bulk or seconds < self.slow_call))
+
+    @property
+    def is_open(self) -> bool:
+        """True, solange Aufrufe abgelehnt würden (ohne einen Probe-Aufruf zu verbrauchen)."""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"open": self.state != "closed", "state": self.state, "failures": self.failures,
+                    "trips": self.trips, "rejected": self.rejected}
+
+
+# ein Breaker pro Prozess; bleibt bei configure() erhalten
+breaker = CircuitBreaker()
+
+
+def is_degraded() -> bool:
+    return breaker.is_open
+
+
+class FHIRClient:
+    """
+    Gemeinsamer HTTP-Zugang zum FHIR-Server.
+    Eine Session pro Prozess: Verbindungen bleiben offen (Keep-Alive) und werden
+    aus dem Pool wiederverwendet; jeder Aufruf hat Connect- und Read-Timeout.
+    """
+
+    def __init__(self, base_url: str = FHIR_BASE_URL,
+                 connect_timeout: float = FHIR_CONNECT_TIMEOUT,
+                 read_timeout: float = FHIR_READ_TIMEOUT,
+                 pool_size: int = FHIR_POOL_SIZE,
+                 max_retries: int = FHIR_MAX_RETRIES,
+                 backoff_factor: float = FHIR_BACKOFF_FACTOR,
+                 circuit_breaker: CircuitBreaker | None = None):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.breaker = circuit_breaker or breaker
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+
+        # Retries: Verbindungsfehler immer (Request kam nie an), 429/5xx nur bei
+        # idempotenten Methoden - ein wiederholtes POST würde doppelt anlegen.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept": "application/fhir+json"})
+
+    def url(self, path: str) -> str:
+        # absolute URLs (z. B. Bundle.link[next]) unverändert durchreichen
+        if path.startswith(("http://", "https://")):
+            return path
+        return self.base_url + path.lstrip("/")
+
+    def request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        self.breaker.before_call()
+        status = None
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(method, self.url(path), **kwargs)
+            status = r.status_code
+            return r
+        finally:
+            elapsed = time.perf_counter() - t0
+            self.breaker.record_call(method, path, status, elapsed, self.base_url)
+            notify_request_listeners(method, path, status, elapsed, self.base_url)
+
+    def get(self, path: str, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path: str, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> FHIRClient:
+    """Liefert den gemeinsamen Client (wird beim ersten Aufruf erzeugt)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = FHIRClient()
+    return _client
+
+
+def configure(**kwargs) -> FHIRClient:
+    """
+    Ersetzt den gemeinsamen Client, z. B. configure(base_url=..., pool_size=50).
+    Akzeptiert dieselben Argumente wie FHIRClient.
+    """
+    global _client, FHIR_BASE_URL, USE_REAL
+    with _client_lock:
+        old, _client = _client, FHIRClient(**kwargs)
+        FHIR_BASE_URL = _client.base_url
+        USE_REAL = bool(FHIR_BASE_URL) and requests is not None
+    if old is not None:
+        old.close()
+    return _client
+
+
+def patient_body(first_name, last_name, email) -> dict:
+    return {
         "resourceType": "Patient",
         "name": [{"family": last_name, "given": [first_name]}],
         "telecom": [{"system": "email", "value": email, "use": "home"}]
         # ... weitere Felder
     }
 
+
+def remember_created_patient(fhir_id, first_name, last_name) -> None:
+    """Namens-Cache nach dem Anlegen aktualisieren (alter Eintrag raus, neuer Name rein)."""
+    fhir_cache.invalidate_display_name("Patient", fhir_id)
+    fhir_cache.remember_display_name("Patient", fhir_id, f"{first_name} {last_name}".strip())
+
+
+def create_patient(first_name, last_name, email):
+    # 1. FHIR-Ressource erstellen (Payload)
+    patient_resource = patient_body(first_name, last_name, email)
+
     # 2. POST-Anfrage an den FHIR-Server senden
-    response = requests.post(
-        f"{FHIR_BASE_URL}Patient",
+    response = get_client().post(
+        "Patient",
         headers=HEADERS,
         data=json.dumps(patient_resource)
     )
@@ -35,28 +304,30 @@ def create_patient(first_name, last_name, email):
     # 3. Die vom Server zugewiesene ID extrahieren
     # Die ID befindet sich im 'id'-Feld des zurückgegebenen FHIR-Objekts,
     # oder im Location-Header.
-    return response.json().get('id')
+    fhir_id = response.json().get('id')
 
-USE_REAL = bool(FHIR_BASE_URL)
+    # 4. Namens-Cache aktualisieren
+    remember_created_patient(fhir_id, first_name, last_name)
+    return fhir_id
 
-try:
-    import requests  # optional
-except Exception:
-    requests = None
-    USE_REAL = False
 
+# System für lokale Idempotenz-Schlüssel (Appointment.identifier)
+IDENTIFIER_SYSTEM = "urn:webb:appointment"
 
-# In fhir_client.py
 
-def create_fhir_appointment(
+def appointment_identifier_query(idempotency_key: str) -> str:
+    """Suchbedingung für bedingtes Anlegen/Löschen über den Idempotenz-Schlüssel."""
+    return f"identifier={IDENTIFIER_SYSTEM}|{idempotency_key}"
+
+
+def appointment_body(
         patient_fhir_id: str,
         provider_fhir_id: str,
         start_time: datetime,
         end_time: datetime,
-        notes: str
-) -> str:
-    """Erzeugt eine FHIR Appointment Ressource; liefert die FHIR ID zurück."""
-
+        notes: str,
+        idempotency_key: str | None = None
+) -> dict:
     # ACHTUNG: Die Zeitzone muss korrekt formatiert sein, z.B. mit 'Z' für UTC oder '+01:00'
     # Abhängig davon, wie Sie datetime-Objekte handhaben (naive oder aware)
     start_iso = start_time.isoformat()
@@ -82,24 +353,53 @@ def create_fhir_appointment(
             }
         ]
     }
+    if idempotency_key:
+        body["identifier"] = [{"system": IDENTIFIER_SYSTEM, "value": idempotency_key}]
+    return body
+
+
+def create_fhir_appointment(
+        patient_fhir_id: str,
+        provider_fhir_id: str,
+        start_time: datetime,
+        end_time: datetime,
+        notes: str,
+        idempotency_key: str | None = None
+) -> str:
+    """
+    Erzeugt eine FHIR Appointment Ressource; liefert die FHIR ID zurück.
+    Mit idempotency_key wird bedingt angelegt (If-None-Exist), ein wiederholter
+    Aufruf liefert dann die bereits existierende Ressource statt einer Kopie.
+    """
+    body = appointment_body(patient_fhir_id, provider_fhir_id, start_time, end_time, notes, idempotency_key)
 
     if USE_REAL and requests:
-        r = requests.post(f"{FHIR_BASE_URL}Appointment", json=body, timeout=10)
+        headers = {}
+        if idempotency_key:
+            headers["If-None-Exist"] = appointment_identifier_query(idempotency_key)
+        r = get_client().post("Appointment", json=body, headers=headers)
         r.raise_for_status()
-        appt = r.json()
         # Hole die ID entweder aus dem ID-Feld oder dem Location-Header
-        return appt.get("id") or r.headers.get("Location", "").split('/')[-1]
+        return _id_from_response(r)
 
     # MOCK-Modus
     return _mock_id("appt")
 
 
-def delete_fhir_appointment(fhir_appointment_id: str) -> None:
-    """Löscht eine FHIR Appointment Ressource."""
+def delete_fhir_appointment(fhir_appointment_id: str | None = None, idempotency_key: str | None = None,
+                            missing_ok: bool = True) -> None:
+    """
+    Löscht eine FHIR Appointment Ressource, per ID oder - falls die ID lokal
+    (noch) nicht bekannt ist - bedingt über den Idempotenz-Schlüssel.
+    missing_ok=False: 404 ist ein Fehler (z. B. solange das Anlegen noch aussteht).
+    """
     if USE_REAL and requests:
-        r = requests.delete(f"{FHIR_BASE_URL}Appointment/{fhir_appointment_id}", timeout=10)
+        if fhir_appointment_id:
+            r = get_client().delete(f"Appointment/{fhir_appointment_id}")
+        else:
+            r = get_client().delete(f"Appointment?{appointment_identifier_query(idempotency_key)}")
         # 404 ist OK, falls schon gelöscht
-        if r.status_code != 404:
+        if r.status_code != 404 or not missing_ok:
             r.raise_for_status()
     # Im MOCK-Modus keine Aktion nötig
     return
@@ -107,22 +407,55 @@ def _mock_id(prefix: str) -> str:
     return f"mock-{prefix}-{uuid.uuid4().hex[:10]}"
 
 
+def schedule_body(practitioner_id: str) -> dict:
+    return {
+        "resourceType": "Schedule",
+        "actor": [{"reference": f"Practitioner/{practitioner_id}"}],
+        "planningHorizon": None,  # optional
+        "active": True,
+    }
+
+
+def schedule_id_from_response(sch: dict) -> str | None:
+    return sch.get("id") or sch.get("entry", [{}])[0].get("resource", {}).get("id")
+
+
 def create_schedule(practitioner_id: str) -> str:
     """Erzeugt Schedule, referenziert den Practitioner; liefert Schedule-ID zurück."""
     if USE_REAL and requests:
-        body = {
-            "resourceType": "Schedule",
-            "actor": [{"reference": f"Practitioner/{practitioner_id}"}],
-            "planningHorizon": None,  # optional
-            "active": True,
-        }
-        r = requests.post(f"{FHIR_BASE_URL}Schedule", json=body, timeout=10)
+        r = get_client().post("Schedule", json=schedule_body(practitioner_id))
         r.raise_for_status()
-        sch = r.json()
-        return sch.get("id") or sch.get("entry", [{}])[0].get("resource", {}).get("id")
+        return schedule_id_from_response(r.json())
     return _mock_id("schedule")
 
 
+def slot_body(schedule_id: str, begin: datetime, end: datetime, status: str = "free") -> dict:
+    return {
+        "resourceType": "Slot",
+        "schedule": {"reference": f"Schedule/{schedule_id}"},
+        "status": status,
+        "start": begin.strftime("%Y-%m-%dT%H:%M:%S%z") or begin.isoformat(),
+        "end": end.strftime("%Y-%m-%dT%H:%M:%S%z") or end.isoformat(),
+    }
+
+
+def slot_bodies(schedule_id: str, start_date: datetime | None = None,
+                days: int = 5, times: list[tuple[int, int]] | None = None) -> list[dict]:
+    """Slot-Ressourcen für 'days' Tage zu den Uhrzeiten 'times' (je 30 Minuten)."""
+    if times is None:
+        times = [(9, 0), (14, 0)]
+    if start_date is None:
+        start_date = datetime.now()
+
+    bodies = []
+    for d in range(days):
+        base = start_date + timedelta(days=d)
+        for (h, m) in times:
+            begin = base.replace(hour=h, minute=m, second=0, microsecond=0)
+            bodies.append(slot_body(schedule_id, begin, begin + timedelta(minutes=30)))
+    return bodies
+
+
 def create_slots(schedule_id: str, start_date: datetime | None = None,
                  days: int = 5, times: list[tuple[int, int]] | None = None) -> list[str]:
     """
@@ -130,71 +463,476 @@ def create_slots(schedule_id: str, start_date: datetime | None = None,
     times: Liste von (hour, minute), z.B. [(9,0),(14,0)]
     Rückgabe: Liste von Slot-IDs (real oder mock).
     """
-    if times is None:
-        times = [(9, 0), (14, 0)]
-    if start_date is None:
-        start_date = datetime.now()
+    # alle Slots gebündelt anlegen (Transaction-Bundles statt einzelner POSTs)
+    return create_resources("Slot", slot_bodies(schedule_id, start_date, days, times))
+
 
+# ----------------- Bulk-Anlage über Batch/Transaction-Bundles -----------------
+
+BUNDLE_CHUNK_SIZE = int(os.environ.get("FHIR_BUNDLE_CHUNK_SIZE", "100"))
+BULK_WORKERS = int(os.environ.get("FHIR_BULK_WORKERS", "8"))
+
+# Statuscodes, mit denen ein Server "Bundles kann ich nicht" signalisiert
+BUNDLE_REJECTED_STATUS = (404, 405, 415, 501)
+
+_bulk_pool = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix="fhir-bulk")
+_bundles_supported = None  # None = noch nicht getestet
+
+
+class BundleNotSupported(Exception):
+    """Der Server nimmt keine Batch/Transaction-Bundles an."""
+
+
+def id_from_location(location: str | None) -> str | None:
+    """'Slot/123/_history/1' oder 'https://.../Slot/123' -> '123'"""
+    if not location:
+        return None
+    parts = [p for p in location.split("/") if p]
+    if "_history" in parts:
+        parts = parts[:parts.index("_history")]
+    return parts[-1] if parts else None
+
+
+def _id_from_response(r) -> str | None:
+    try:
+        res = r.json()
+    except ValueError:
+        res = {}
+    return res.get("id") or id_from_location(r.headers.get("Location"))
+
+
+def bundles_supported() -> bool:
+    """False, sobald der Server ein Bundle abgelehnt hat - dann nur noch Einzelaufrufe."""
+    return _bundles_supported is not False
+
+
+def set_bundles_supported(supported: bool) -> None:
+    """Für Aufrufer mit eigenem HTTP-Zugang (fhir_async); send_bundle setzt es selbst."""
+    global _bundles_supported
+    _bundles_supported = supported
+
+
+def send_bundle(entries: list[dict], bundle_type: str = "batch") -> list[dict]:
+    """
+    Schickt ein Bundle mit fertigen Einträgen ({"request": ..., "resource": ...})
+    und liefert Bundle.entry[].response in derselben Reihenfolge.
+    Merkt sich, ob der Server Bundles annimmt (bundles_supported).
+    """
+    global _bundles_supported
+    r = get_client().post("", headers=HEADERS, data=json.dumps(bundle_body(entries, bundle_type)))
+    if r.status_code in BUNDLE_REJECTED_STATUS:
+        _bundles_supported = False
+        raise BundleNotSupported(f"{r.status_code} {r.reason}")
+    r.raise_for_status()
+    _bundles_supported = True
+    return bundle_responses(r.json(), len(entries))
+
+
+def bundle_body(entries: list[dict], bundle_type: str) -> dict:
+    for e in entries:
+        e.setdefault("fullUrl", f"urn:uuid:{uuid.uuid4()}")
+    return {"resourceType": "Bundle", "type": bundle_type, "entry": entries}
+
+
+def bundle_responses(bundle: dict, expected: int) -> list[dict]:
+    responses = [e.get("response", {}) for e in bundle.get("entry", [])]
+    if len(responses) != expected:
+        raise RuntimeError(f"Bundle response has {len(responses)} entries, expected {expected}")
+    return responses
+
+
+def post_bundle(resources: list[dict], bundle_type: str = "transaction",
+                if_none_exist: list[str | None] | None = None) -> list[str | None]:
+    """
+    Schickt ein Batch/Transaction-Bundle mit POST-Einträgen und liefert die neuen
+    IDs (aus Bundle.entry[].response.location) in derselben Reihenfolge.
+    if_none_exist: optional pro Eintrag eine Suchbedingung für bedingtes Anlegen.
+    """
+    return ids_from_bundle_responses(send_bundle(post_entries(resources, if_none_exist), bundle_type), bundle_type)
+
+
+def post_entries(resources: list[dict], if_none_exist: list[str | None] | None = None) -> list[dict]:
+    """Bundle-Einträge 'POST <resourceType>' (optional mit ifNoneExist)."""
+    entries = []
+    for i, res in enumerate(resources):
+        req = {"method": "POST", "url": res["resourceType"]}
+        if if_none_exist and if_none_exist[i]:
+            req["ifNoneExist"] = if_none_exist[i]
+        entries.append({"resource": res, "request": req})
+    return entries
+
+
+def ids_from_bundle_responses(responses: list[dict], bundle_type: str = "transaction") -> list[str | None]:
     ids = []
-    if USE_REAL and requests:
-        for d in range(days):
-            base = start_date + timedelta(days=d)
-            for (h, m) in times:
-                begin = base.replace(hour=h, minute=m, second=0, microsecond=0)
-                end = begin + timedelta(minutes=30)
-                body = {
-                    "resourceType": "Slot",
-                    "schedule": {"reference": f"Schedule/{schedule_id}"},
-                    "status": "free",
-                    "start": begin.strftime("%Y-%m-%dT%H:%M:%S%z") or begin.isoformat(),
-                    "end": end.strftime("%Y-%m-%dT%H:%M:%S%z") or end.isoformat(),
-                }
-                r = requests.post(f"{FHIR_BASE_URL}Slot", json=body, timeout=10)
-                r.raise_for_status()
-                slot = r.json()
-                sid = slot.get("id") or slot.get("entry", [{}])[0].get("resource", {}).get("id")
-                ids.append(sid)
-        return ids
-
-    # MOCK
-    for d in range(days):
-        for _ in times:
-            ids.append(_mock_id("slot"))
+    for resp in responses:
+        status = resp.get("status", "")
+        if bundle_type == "batch" and not status.startswith("2"):
+            raise RuntimeError(f"Bundle entry failed: {status} {resp.get('outcome', '')}")
+        ids.append(id_from_location(resp.get("location")))
     return ids
 
 
-def get_slots_by_schedule(schedule_id: str) -> list[dict]:
+def _post_single(resource: dict, if_none_exist: str | None = None) -> str | None:
+    headers = dict(HEADERS)
+    if if_none_exist:
+        headers["If-None-Exist"] = if_none_exist
+    r = get_client().post(resource["resourceType"], headers=headers, data=json.dumps(resource))
+    r.raise_for_status()
+    return _id_from_response(r)
+
+
+def create_resources(resource_type: str, resources: list[dict],
+                     if_none_exist: list[str | None] | None = None,
+                     chunk_size: int | None = None) -> list[str]:
     """
-    Holt Slots (einfaches Format). Im MOCK-Modus generieren wir 5 Tage x 2 Zeiten.
-    Rückgabe: [{'label': '28.11 — 09:00', 'date': 'YYYY-MM-DD', 'time': 'HH:MM'}]
+    Legt viele Ressourcen eines Typs an: Transaction-Bundles zu je 'chunk_size'
+    Einträgen, parallel im Bulk-Pool. Lehnt der Server Bundles ab, wird auf
+    parallele Einzel-POSTs umgeschaltet. Rückgabe: IDs in Eingabe-Reihenfolge.
     """
-    out = []
-    if USE_REAL and requests:
-        # Minimaler GET – Details je nach Server variieren
-        params = {"schedule": f"Schedule/{schedule_id}", "_count": "50"}
-        r = requests.get(f"{FHIR_BASE_URL}/Slot", params=params, timeout=10)
+    if not resources:
+        return []
+    if not (USE_REAL and requests):
+        return [_mock_id(resource_type.lower()) for _ in resources]
+
+    if_none_exist = if_none_exist or [None] * len(resources)
+    size = chunk_size or BUNDLE_CHUNK_SIZE
+    chunks = [(resources[i:i + size], if_none_exist[i:i + size]) for i in range(0, len(resources), size)]
+
+    ids = []
+    if bundles_supported():
+        try:
+            # erster Block synchron: klärt, ob der Server Bundles annimmt
+            ids.extend(post_bundle(chunks[0][0], if_none_exist=chunks[0][1]))
+            futures = [_bulk_pool.submit(post_bundle, res, if_none_exist=cond) for res, cond in chunks[1:]]
+            for f in futures:
+                ids.extend(f.result())
+            return ids
+        except BundleNotSupported as e:
+            log.warning("FHIR server rejected bundles (%s), falling back to single POSTs", e)
+            ids = []
+
+    futures = [_bulk_pool.submit(_post_single, res, cond)
+               for res, cond in zip(resources, if_none_exist)]
+    return [f.result() for f in futures]
+
+
+# ----------------- Slots lesen (seitenweise, mit Zeitfenster) -----------------
+
+SLOT_PAGE_SIZE = int(os.environ.get("FHIR_SLOT_PAGE_SIZE", "100"))
+
+
+def _fhir_date(value) -> str:
+    """date -> 'YYYY-MM-DD', datetime -> ISO-Zeitstempel (für start=ge…/lt…)."""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S%z") or value.isoformat()
+    return value.isoformat()
+
+
+def iter_bundle_pages(path: str, params=None, headers=None):
+    """
+    Generator über die Seiten einer Suche als (response, bundle). Folgt
+    Bundle.link[next] erst, wenn die aktuelle Seite verarbeitet ist.
+    Antwortet der Server auf die erste Seite mit 304, kommt (response, None).
+    """
+    client = get_client()
+    url, query = path, params
+    while url:
+        r = client.get(url, params=query, headers=headers)
+        if r.status_code == 304:
+            yield r, None
+            return
         r.raise_for_status()
         bundle = r.json()
-        entries = bundle.get("entry", [])
-        for e in entries:
-            res = e.get("resource", {})
-            if res.get("status") != "free":
-                continue
-            start = res.get("start")
-            try:
-                dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
-            except Exception:
-                continue
-            label = f"{dt.strftime('%d.%m')} — {dt.strftime('%H:%M')}"
-            out.append({"label": label, "date": dt.strftime("%Y-%m-%d"), "time": dt.strftime("%H:%M")})
-        return out
+        yield r, bundle
+        url = next((l.get("url") for l in bundle.get("link", []) if l.get("relation") == "next"), None)
+        query = headers = None  # die next-URL enthält die Parameter bereits
+
 
+def iter_bundle_resources(path: str, params=None):
+    """Generator über alle Ressourcen einer Suche (seitenweise, lazy)."""
+    for _, bundle in iter_bundle_pages(path, params):
+        for e in bundle.get("entry", []):
+            res = e.get("resource")
+            if res:
+                yield res
+
+
+def _mock_slot_resources(schedule_id: str):
     # MOCK: 5 Tage, 09:00 & 14:00
     base = datetime.now()
     for i in range(5):
         day = base + timedelta(days=i)
         for (h, m) in [(9, 0), (14, 0)]:
             dt = day.replace(hour=h, minute=m, second=0, microsecond=0)
-            out.append({"label": f"{dt.strftime('%d.%m')} — {dt.strftime('%H:%M')}",
-                        "date": dt.strftime("%Y-%m-%d"), "time": dt.strftime("%H:%M")})
+            body = slot_body(schedule_id, dt, dt + timedelta(minutes=30))
+            body["id"] = f"mock-slot-{schedule_id}-{dt.strftime('%Y%m%d%H%M')}"
+            yield body
+
+
+def iter_slots_for_schedules(schedule_ids: list[str], start=None, end=None,
+                             status: str | None = "free", page_size: int = SLOT_PAGE_SIZE):
+    """
+    Generator über Slot-Ressourcen mehrerer Schedules (eine Suche, 'schedule=a,b').
+    Status- und Zeitfilter laufen auf dem Server: status=free&start=ge{start}&start=lt{end}
+    """
+    schedule_ids = [s for s in dict.fromkeys(schedule_ids) if s]
+    if not schedule_ids:
+        return
+
+    if not (USE_REAL and requests):
+        for sid in schedule_ids:
+            for res in _mock_slot_resources(sid):
+                dt = datetime.fromisoformat(res["start"])
+                if start and dt < _as_datetime(start):
+                    continue
+                if end and dt >= _as_datetime(end):
+                    continue
+                yield res
+        return
+
+    params = _slot_search_params(schedule_ids, start, end, status, page_size)
+    for res in iter_bundle_resources("Slot", params):
+        if res.get("resourceType") == "Slot":
+            yield res
+
+
+def _slot_search_params(schedule_ids, start=None, end=None, status="free", page_size=SLOT_PAGE_SIZE):
+    params = [
+        ("schedule", ",".join(f"Schedule/{sid}" for sid in schedule_ids)),
+        ("_sort", "start"),
+        ("_count", str(page_size)),
+    ]
+    if status:
+        params.append(("status", status))
+    if start:
+        params.append(("start", f"ge{_fhir_date(start)}"))
+    if end:
+        params.append(("start", f"lt{_fhir_date(end)}"))
+    return params
+
+
+def iter_slots(schedule_id: str, start=None, end=None,
+               status: str | None = "free", page_size: int = SLOT_PAGE_SIZE):
+    """Wie iter_slots_for_schedules, für einen einzelnen Schedule."""
+    return iter_slots_for_schedules([schedule_id], start, end, status, page_size)
+
+
+def _as_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime(value.year, value.month, value.day)
+
+
+def local_datetime(value: str | None) -> datetime | None:
+    """FHIR-Zeitstempel -> naive lokale Zeit (so speichert die App Termine)."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt.astimezone().replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def slot_option(res: dict) -> dict | None:
+    """Slot-Ressource -> {'label', 'date', 'time', 'id', 'schedule_id'} fürs Template."""
+    try:
+        dt = datetime.fromisoformat(res.get("start").replace("Z", "+00:00"))
+    except Exception:
+        return None
+    ref = res.get("schedule", {}).get("reference", "")
+    return {
+        "label": f"{dt.strftime('%d.%m')} — {dt.strftime('%H:%M')}",
+        "date": dt.strftime("%Y-%m-%d"),
+        "time": dt.strftime("%H:%M"),
+        "id": res.get("id"),
+        "schedule_id": ref.split("/")[-1] if ref else None,
+    }
+
+
+def get_slots_by_schedule(schedule_id: str, start=None, end=None, use_cache: bool = True) -> list[dict]:
+    """
+    Holt freie Slots (einfaches Format), optional nur im Fenster [start, end).
+    Im MOCK-Modus generieren wir 5 Tage x 2 Zeiten.
+    Mit use_cache kommen die Slots aus fhir_cache.slots: innerhalb von
+    SLOT_CACHE_FRESH Sekunden ohne Anfrage, danach mit einer Revalidierung.
+    Ein kaltes Fenster lädt nur ein Aufruf, gleichzeitige warten auf ihn.
+    Rückgabe: [{'label': '28.11 — 09:00', 'date': 'YYYY-MM-DD', 'time': 'HH:MM', ...}]
+    """
+    if not use_cache:
+        options = (slot_option(res) for res in iter_slots(schedule_id, start, end))
+        return [o for o in options if o]
+
+    cache = fhir_cache.slots
+    window = cache.get(schedule_id, start, end)
+    try:
+        if window is None:
+            def load():
+                cache.full_loads += 1
+                return _load_slot_window(schedule_id, start, end)
+            return cache.get_or_load(schedule_id, start, end, load).options()
+        if not window.is_fresh(cache.fresh_for):
+            window = _revalidate_slot_window(window)
+    except Exception:
+        # Server weg oder Breaker offen: letzter bekannter Stand, als veraltet markiert
+        stale = stale_slots(schedule_id, start, end)
+        if stale is None:
+            raise
+        return stale
+    cache.put(window)
+    window.booked = cache.booked_times(schedule_id)  # gebuchte Zeiten liegen getrennt vom Fenster
+    return window.options()
+
+
+def stale_slots(schedule_id: str, start=None, end=None) -> list[dict] | None:
+    """Slots aus dem Cache auch nach Ablauf, jede Option mit stale=True; None ohne Eintrag."""
+    window = fhir_cache.slots.get(schedule_id, start, end, allow_stale=True)
+    if window is None:
+        return None
+    fhir_cache.slots.stale_served += 1
+    return [dict(o, stale=True) for o in window.options()]
+
+
+def _instant(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _max_instant(a: str | None, b: str | None) -> str | None:
+    # Server liefern Instants mit "Z" oder "+02:00": als Zeitpunkte vergleichen,
+    # den String aber unverändert zurückgeben (er geht so in _lastUpdated=gt…)
+    values = [x for x in (a, b) if x]
+    return max(values, key=_instant) if values else None
+
+
+def _window_from_pages(schedule_id, start, end, pages) -> "fhir_cache.SlotWindow":
+    slots, etag, last_updated = {}, None, None
+    for i, (r, bundle) in enumerate(pages):
+        if i == 0:
+            etag = r.headers.get("ETag")
+            last_updated = bundle.get("meta", {}).get("lastUpdated")
+        for e in bundle.get("entry", []):
+            res = e.get("resource", {})
+            option = slot_option(res)
+            if option and res.get("status") == "free":
+                slots[option["id"]] = option
+                last_updated = _max_instant(last_updated, res.get("meta", {}).get("lastUpdated"))
+    return fhir_cache.SlotWindow(schedule_id, start, end, slots, etag=etag, last_updated=last_updated)
+
+
+def _load_slot_window(schedule_id, start, end) -> "fhir_cache.SlotWindow":
+    if not (USE_REAL and requests):
+        slots = {}
+        for res in iter_slots(schedule_id, start, end):
+            option = slot_option(res)
+            if option:
+                slots[option["id"]] = option
+        return fhir_cache.SlotWindow(schedule_id, start, end, slots)
+    params = _slot_search_params([schedule_id], start, end, "free")
+    return _window_from_pages(schedule_id, start, end, iter_bundle_pages("Slot", params))
+
+
+def _revalidate_slot_window(window) -> "fhir_cache.SlotWindow":
+    """
+    Prüft ein abgelaufenes Fenster möglichst billig:
+    1. mit ETag: If-None-Match -> 304 heißt unverändert
+    2. mit _lastUpdated: nur seitdem geänderte Slots holen und einarbeiten
+    3. sonst komplett neu laden
+    """
+    cache = fhir_cache.slots
+    if not (USE_REAL and requests):
+        # Mock-Daten ändern sich nie
+        window.touch()
+        return window
+
+    schedule_id, start, end = window.schedule_id, window.start, window.end
+    if window.etag:
+        params = _slot_search_params([schedule_id], start, end, "free")
+        pages = iter_bundle_pages("Slot", params, headers={"If-None-Match": window.etag})
+        first = next(pages)
+        if first[1] is None:
+            cache.not_modified += 1
+            window.touch()
+            return window
+        fresh = _window_from_pages(schedule_id, start, end, _chain_first(first, pages))
+        cache.full_loads += 1
+        return fresh
+
+    if window.last_updated:
+        # ohne status-Filter, damit auch belegte/gelöschte Slots auftauchen
+        params = _slot_search_params([schedule_id], start, end, None)
+        params.append(("_lastUpdated", f"ge{window.last_updated}"))
+        for _, bundle in iter_bundle_pages("Slot", params):
+            for e in bundle.get("entry", []):
+                res = e.get("resource", {})
+                option = slot_option(res)
+                if not option:
+                    continue
+                if res.get("status") == "free":
+                    window.slots[option["id"]] = option
+                else:
+                    window.slots.pop(option["id"], None)
+                window.last_updated = _max_instant(window.last_updated, res.get("meta", {}).get("lastUpdated"))
+        cache.deltas += 1
+        window.touch()
+        return window
+
+    fresh = _load_slot_window(schedule_id, start, end)
+    cache.full_loads += 1
+    return fresh
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def get_slots_for_schedules(schedule_ids: list[str], start=None, end=None) -> dict[str, list[dict]]:
+    """Freie Slots mehrerer Schedules mit einer (seitenweisen) Suche, gruppiert nach Schedule-ID."""
+    out = {sid: [] for sid in schedule_ids if sid}
+    for res in iter_slots_for_schedules(schedule_ids, start, end):
+        option = slot_option(res)
+        if option and option["schedule_id"] in out:
+            out[option["schedule_id"]].append(option)
+    return out
+
+
+# ----------------- Anzeigenamen (Patient / Practitioner) -----------------
+
+NAME_SEARCH_CHUNK = 50  # max. IDs pro "_id=a,b,c"-Suche (URL-Länge)
+
+
+def display_name_from_resource(res: dict) -> str:
+    """Bevorzugt name[0].text, sonst 'given family'."""
+    name_obj = (res.get("name") or [{"text": "Unbekannt"}])[0]
+    display = (
+            name_obj.get("text")
+            or " ".join(name_obj.get("given", [])) + " " + name_obj.get("family", "")
+    )
+    return display.strip()
+
+
+def search_display_names(resource_type: str, fhir_ids: list[str]) -> dict[str, str]:
+    """
+    Holt die Namen mehrerer Ressourcen mit einer Suche pro Block:
+    GET Patient?_id=a,b,c&_elements=name
+    Rückgabe: {fhir_id: display_name}; nicht gefundene IDs fehlen im Dict.
+    """
+    out = {}
+    ids = [str(i) for i in dict.fromkeys(fhir_ids) if i]
+    if not ids or not (USE_REAL and requests):
+        return out
+
+    client = get_client()
+    for i in range(0, len(ids), NAME_SEARCH_CHUNK):
+        chunk = ids[i:i + NAME_SEARCH_CHUNK]
+        params = {"_id": ",".join(chunk), "_elements": "name", "_count": str(len(chunk))}
+        r = client.get(resource_type, params=params)
+        r.raise_for_status()
+        for e in r.json().get("entry", []):
+            res = e.get("resource", {})
+            if res.get("resourceType") == resource_type and res.get("id"):
+                out[res["id"]] = display_name_from_resource(res)
     return out
+
+
+def read_display_name(resource_type: str, fhir_id: str) -> str:
+    """Liest eine einzelne Patient/Practitioner-Ressource und liefert deren Anzeigenamen."""
+    r = get_client().get(f"{resource_type}/{fhir_id}", params={"_elements": "name"})
+    r.raise_for_status()
+    return display_name_from_resource(r.json())
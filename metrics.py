@@ -0,0 +1,269 @@
+# metrics.py
+"""
+Messpunkte pro Request: FHIR-Aufrufe, SQL-Abfragen und Template-Rendering.
+
+- FHIR: Listener in fhir_client (jeder HTTP-Aufruf, auch aus fhir_async)
+- SQL: SQLAlchemy-Engine-Events before/after_cursor_execute
+- Templates: Flask-Signale before_render_template / template_rendered
+
+Pro Request landen Anzahl und Dauer im Header "Server-Timing" (sichtbar in den
+Browser-DevTools); prozessweit sammeln Histogramme die Latenzen, abrufbar im
+Prometheus-Textformat unter /metrics.
+
+Arbeit in Pool-Threads zählt nur zum Request, wenn sie mit bind() übergeben
+wird: _fhir_pool.submit(metrics.bind(fn), ...).
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, before_render_template, g, request, template_rendered
+from sqlalchemy import event
+
+import fhir_client as fhir
+from database_layer.db_instance import db
+
+log = logging.getLogger(__name__)
+
+# Sekunden; grob genug für wenige Zeitreihen, fein genug für p50/p95
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND = "background"  # Endpoint-Label für Arbeit außerhalb eines Requests
+
+
+class Histogram:
+    """Prometheus-Histogramm (kumulative Buckets, _sum, _count) mit Labels."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label-Werte -> [bucket-Zähler..., sum, count]
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for labels, series in items:
+            base = _labels(self.labelnames, labels)
+            for bound, n in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Prometheus-Zähler mit Labels."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{{{_labels(self.labelnames, labels)}}} {value:g}")
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{n}="{str(v).replace(chr(34), chr(39))}"' for n, v in zip(names, values))
+
+
+http_duration = Histogram("http_request_duration_seconds", "Dauer der HTTP-Requests.",
+                          ("endpoint", "method", "status"))
+fhir_duration = Histogram("fhir_request_duration_seconds", "Dauer der FHIR-Aufrufe.",
+                          ("endpoint", "resource_type", "method"))
+fhir_errors = Counter("fhir_request_errors_total", "FHIR-Aufrufe ohne 2xx/3xx-Antwort.",
+                      ("resource_type", "status"))
+sql_duration = Histogram("db_query_duration_seconds", "Dauer der SQL-Abfragen.",
+                         ("endpoint", "operation"))
+render_duration = Histogram("template_render_duration_seconds", "Dauer des Template-Renderings.",
+                            ("template",))
+METRICS = [http_duration, fhir_duration, fhir_errors, sql_duration, render_duration]
+
+# zusätzliche Gauges: prefix -> fn() -> {name: Zahl}, z. B. Outbox- und Cache-Stände
+_gauge_collectors = {}
+
+
+def add_gauge_collector(prefix: str, fn) -> None:
+    _gauge_collectors[prefix] = fn
+
+
+# ----------------- Messwerte pro Request -----------------
+
+class RequestTimings:
+    """Summen eines Requests (auch aus Pool-Threads, daher mit Lock)."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.fhir_count = 0
+        self.fhir_seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            if kind == "fhir":
+                self.fhir_count += 1
+                self.fhir_seconds += seconds
+            elif kind == "sql":
+                self.sql_count += 1
+                self.sql_seconds += seconds
+            else:
+                self.render_seconds += seconds
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.started
+        return ", ".join([
+            f'fhir;dur={self.fhir_seconds * 1000:.1f};desc="FHIR ({self.fhir_count})"',
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="SQL ({self.sql_count})"',
+            f'render;dur={self.render_seconds * 1000:.1f};desc="Template"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def current() -> RequestTimings | None:
+    return _current.get()
+
+
+def _endpoint() -> str:
+    timings = _current.get()
+    return timings.endpoint if timings else BACKGROUND
+
+
+def bind(fn):
+    """fn so verpacken, dass es im Pool-Thread zum aktuellen Request zählt (pro submit neu aufrufen)."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+    return run
+
+
+# ----------------- Quellen -----------------
+
+def _on_fhir_request(method: str, resource_type: str, status: int | None, seconds: float) -> None:
+    fhir_duration.observe(seconds, _endpoint(), resource_type, method)
+    if status is None or status >= 400:
+        fhir_errors.inc(resource_type, str(status or "none"))
+    timings = _current.get()
+    if timings:
+        timings.add("fhir", seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    sql_duration.observe(seconds, _endpoint(), operation)
+    timings = _current.get()
+    if timings:
+        timings.add("sql", seconds)
+
+
+def _before_render(app, template, context, **extra):
+    g.setdefault("_render_started", []).append(time.perf_counter())
+
+
+def _after_render(app, template, context, **extra):
+    started = g.get("_render_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    render_duration.observe(seconds, template.name or "string")
+    timings = _current.get()
+    if timings:
+        timings.add("render", seconds)
+
+
+# ----------------- Flask -----------------
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for prefix, fn in _gauge_collectors.items():
+        try:
+            values = fn()
+        except Exception:
+            log.exception("Metrics collector %s failed", prefix)
+            continue
+        for key, value in values.items():
+            if isinstance(value, (bool, int, float)):
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app) -> None:
+    """Hooks registrieren und /metrics anlegen (nach ds.init, braucht die Engine)."""
+
+    @app.before_request
+    def _start_timings():
+        g._timings_token = _current.set(RequestTimings(request.endpoint or "unknown"))
+
+    @app.after_request
+    def _finish_timings(response):
+        timings = _current.get()
+        if timings:
+            response.headers["Server-Timing"] = timings.server_timing()
+            http_duration.observe(time.perf_counter() - timings.started,
+                                  timings.endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _reset_timings(exc):
+        token = g.pop("_timings_token", None)
+        if token is not None:
+            _current.reset(token)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    fhir.add_request_listener(_on_fhir_request)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+
+    app.add_url_rule("/metrics", "metrics", lambda: Response(
+        render_metrics(), mimetype="text/plain; version=0.0.4"))
@@ -0,0 +1,244 @@
+# name_sync.py
+"""
+Anzeigenamen von Patient/Practitioner lokal vorhalten (Tabelle fhir_display_names).
+
+- add_user schreibt den Namen direkt beim Anlegen des Patienten.
+- Die Buchungsseite liest fehlende Namen mit einer Abfrage aus der DB
+  (lookup_names) und fragt FHIR nur noch für unbekannte IDs.
+- sync_names() holt nur Änderungen seit dem letzten Lauf, und nur für die
+  lokal bekannten IDs: <Type>?_id=…&_lastUpdated=gt<cursor>, blockweise.
+  Kein typweites <Type>/_history - auf einem geteilten Server wären das
+  alle Änderungen aller Nutzer. Beim ersten Lauf werden alle bekannten IDs
+  einmal geladen. Der Cursor liegt in sync_state, übersteht also Neustarts.
+- Löschungen: eine Suche liefert keine DELETE-Einträge. Gespeicherte IDs, die
+  eine Suche ohne _lastUpdated (nur _elements=id) nicht mehr findet, gelten
+  als gelöscht.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+import fhir_cache
+import fhir_client as fhir
+import database_service as ds
+from database_layer.db_instance import db
+from database_layer.fhir_name_entity import FHIRDisplayName
+from database_layer.user_entity import User
+
+log = logging.getLogger(__name__)
+
+NAME_RESOURCE_TYPES = ("Patient", "Practitioner")
+NAME_SYNC_INTERVAL = 5 * 60  # Sekunden zwischen zwei Läufen
+NAME_SYNC_PAGE_SIZE = 200
+
+_worker = None
+_state = {"last_run": None, "updated": 0, "deleted": 0, "errors": 0}
+
+
+def _cursor_key(resource_type: str) -> str:
+    return f"name_sync:{resource_type}:last_updated"
+
+
+# ----------------- Lesen / Schreiben -----------------
+
+def lookup_names(keys) -> dict[tuple[str, str], str]:
+    """{(resource_type, fhir_id): display_name} für alle gefundenen Schlüssel - eine Abfrage."""
+    by_type = {}
+    for resource_type, fhir_id in keys:
+        by_type.setdefault(resource_type, set()).add(str(fhir_id))
+    if not by_type:
+        return {}
+    rows = (
+        db.session.query(FHIRDisplayName.resource_type, FHIRDisplayName.fhir_id, FHIRDisplayName.display_name)
+        .filter(or_(*(
+            and_(FHIRDisplayName.resource_type == rt, FHIRDisplayName.fhir_id.in_(ids))
+            for rt, ids in by_type.items()
+        )))
+        .all()
+    )
+    return {(rt, fid): name for rt, fid, name in rows}
+
+
+def store_names(resource_type: str, names: dict[str, str], meta: dict | None = None, session=None) -> None:
+    """
+    Legt Namen an oder aktualisiert sie (ohne Commit). meta: {fhir_id: resource.meta}.
+    Der Speicher-Cache wird mit aktualisiert.
+    """
+    if not names:
+        return
+    session = session or db.session
+    meta = meta or {}
+    existing = {
+        row.fhir_id: row
+        for row in session.query(FHIRDisplayName).filter(
+            FHIRDisplayName.resource_type == resource_type,
+            FHIRDisplayName.fhir_id.in_(list(names)),
+        )
+    }
+    for fhir_id, display in names.items():
+        m = meta.get(fhir_id) or {}
+        row = existing.get(fhir_id)
+        if row is None:
+            row = FHIRDisplayName(resource_type=resource_type, fhir_id=fhir_id)
+            session.add(row)
+        row.display_name = display
+        row.version_id = m.get("versionId", row.version_id)
+        row.last_updated = m.get("lastUpdated", row.last_updated)
+        fhir_cache.remember_display_name(resource_type, fhir_id, display)
+
+
+def save_fetched_names(fetched: dict[str, dict[str, str]]) -> None:
+    """
+    Während eines Requests geholte Namen ({resource_type: {fhir_id: name}}) ablegen.
+    Eigene Session: ein Commit auf db.session würde alle geladenen User verfallen lassen.
+    """
+    if not any(fetched.values()):
+        return
+    with Session(db.engine) as session:
+        for resource_type, names in fetched.items():
+            store_names(resource_type, names, session=session)
+        session.commit()
+
+
+def delete_names(resource_type: str, fhir_ids) -> int:
+    fhir_ids = [str(i) for i in fhir_ids]
+    if not fhir_ids:
+        return 0
+    for fhir_id in fhir_ids:
+        fhir_cache.invalidate_display_name(resource_type, fhir_id)
+    return (
+        FHIRDisplayName.query
+        .filter(FHIRDisplayName.resource_type == resource_type, FHIRDisplayName.fhir_id.in_(fhir_ids))
+        .delete(synchronize_session=False)
+    )
+
+
+def known_ids(resource_type: str) -> set[str]:
+    """FHIR-IDs, die lokal gebraucht werden (User mit diesem Ressourcentyp)."""
+    column = User.fhir_patient_id if resource_type == "Patient" else User.fhir_practitioner_id
+    return {str(fid) for (fid,) in db.session.query(column).filter(column.isnot(None)) if fid}
+
+
+# ----------------- Abgleich mit FHIR -----------------
+
+def _now_instant() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _collect(pages, resource_type: str, wanted: set[str], names: dict, meta: dict,
+             cursor: str | None) -> str | None:
+    """Sammelt Namen aus den Bundle-Seiten einer Suche; liefert den neuen Cursor."""
+    for i, (_, bundle) in enumerate(pages):
+        if i == 0:
+            # Serverzeit der ersten Seite: alles danach kommt beim nächsten Lauf
+            cursor = fhir._max_instant(cursor, bundle.get("meta", {}).get("lastUpdated"))
+        for e in bundle.get("entry", []):
+            res = e.get("resource") or {}
+            fhir_id = res.get("id")
+            if res.get("resourceType") != resource_type or fhir_id not in wanted:
+                continue
+            m = res.get("meta", {})
+            names[fhir_id] = fhir.display_name_from_resource(res)
+            meta[fhir_id] = m
+            cursor = fhir._max_instant(cursor, m.get("lastUpdated"))
+    return cursor
+
+
+def _search_pages(resource_type: str, ids: list[str], since: str | None, elements: str | None = None):
+    for i in range(0, len(ids), fhir.NAME_SEARCH_CHUNK):
+        params = {"_id": ",".join(ids[i:i + fhir.NAME_SEARCH_CHUNK]), "_count": str(NAME_SYNC_PAGE_SIZE)}
+        if since:
+            params["_lastUpdated"] = f"gt{since}"
+        if elements:
+            params["_elements"] = elements
+        yield from fhir.iter_bundle_pages(resource_type, params)
+
+
+def _existing_ids(resource_type: str, ids: list[str]) -> set[str]:
+    """Welche der IDs es auf dem Server noch gibt (nur IDs, ohne Namen)."""
+    return {
+        (e.get("resource") or {}).get("id")
+        for _, bundle in _search_pages(resource_type, ids, None, elements="id")
+        for e in bundle.get("entry", [])
+        if (e.get("resource") or {}).get("resourceType") == resource_type
+    }
+
+
+def sync_resource_type(resource_type: str, full: bool = False) -> dict:
+    """Gleicht die Namen eines Ressourcentyps ab; Rückgabe: Zähler dieses Laufs."""
+    wanted = known_ids(resource_type)
+    since = None if full else ds.get_sync_state(_cursor_key(resource_type))
+    names, meta = {}, {}
+    started = _now_instant()
+
+    # IDs ohne lokalen Namen (erster Lauf, neue User) einmal direkt laden
+    stored = {fid for (_, fid) in lookup_names((resource_type, fid) for fid in wanted)}
+    unknown = wanted if since is None else wanted - stored
+    cursor = None
+    if unknown:
+        cursor = _collect(_search_pages(resource_type, sorted(unknown), None), resource_type,
+                          wanted, names, meta, None)
+
+    if since is None:
+        # alle IDs wurden gesucht: gespeicherte, die fehlen, gibt es nicht mehr
+        deleted = stored - names.keys()
+    else:
+        cursor = _collect(_search_pages(resource_type, sorted(wanted & stored), since), resource_type,
+                          wanted, names, meta, fhir._max_instant(cursor, since))
+        # die _lastUpdated-Suche lässt unveränderte IDs weg: Existenz extra prüfen
+        deleted = stored - _existing_ids(resource_type, sorted(stored)) if stored else set()
+
+    store_names(resource_type, names, meta)
+    removed = delete_names(resource_type, deleted)
+    ds.set_sync_state(_cursor_key(resource_type), cursor or started)
+    db.session.commit()
+    return {"updated": len(names), "deleted": removed, "cursor": cursor or started}
+
+
+def sync_names(full: bool = False) -> dict:
+    """Ein Lauf über Patient und Practitioner (braucht App-Context)."""
+    out = {}
+    if not (fhir.USE_REAL and fhir.requests):
+        return out
+    for resource_type in NAME_RESOURCE_TYPES:
+        result = sync_resource_type(resource_type, full=full)
+        _state["updated"] += result["updated"]
+        _state["deleted"] += result["deleted"]
+        out[resource_type] = result
+    _state["last_run"] = datetime.now()
+    return out
+
+
+# ----------------- Worker -----------------
+
+def _run(app, interval: float) -> None:
+    while True:
+        with app.app_context():
+            try:
+                sync_names()
+            except Exception as e:
+                _state["errors"] += 1
+                log.warning("Name sync failed: %s", e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        time.sleep(interval)
+
+
+def start_worker(app, interval: float | None = None) -> threading.Thread:
+    """Startet den Namensabgleich als Daemon-Thread (einmal pro Prozess)."""
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        interval = interval or app.config.get("NAME_SYNC_INTERVAL", NAME_SYNC_INTERVAL)
+        _worker = threading.Thread(target=_run, args=(app, interval), name="fhir-name-sync", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def stats() -> dict:
+    return {**_state, "worker_alive": bool(_worker and _worker.is_alive())}
@@ -0,0 +1,312 @@
+# outbox.py
+"""
+Transactional Outbox für FHIR-Schreibzugriffe.
+
+create_appointment / delete_appointment_local_and_fhir schreiben nur lokal:
+Appointment und OutboxEntry landen in derselben SQLite-Transaktion. Ein
+Hintergrund-Thread schickt offene Einträge gebündelt (Batch-Bundle) an den
+FHIR-Server, wiederholt Fehlschläge mit Backoff und trägt danach
+fhir_appointment_id nach. Doppelte Appointments verhindert der
+Idempotenz-Schlüssel (Appointment.identifier + If-None-Exist).
+
+Reihenfolge pro Termin: ein Löschen wird erst abgeholt, wenn das Anlegen
+desselben Termins erledigt oder endgültig gescheitert ist. Wurde das Anlegen
+noch nie versucht, wird es beim Stornieren einfach verworfen.
+"""
+
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import aliased
+
+import fhir_client as fhir
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.outbox_entity import OutboxEntry, OutboxOperation, OutboxStatus
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_INTERVAL = 2.0  # Sekunden zwischen zwei Durchläufen (ohne notify)
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 2.0  # Sekunden, verdoppelt sich pro Versuch
+OUTBOX_BACKOFF_MAX = 10 * 60
+OUTBOX_LEASE = 60  # so lange ist ein abgeholter Eintrag für andere Worker gesperrt
+
+log = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_worker = None
+_state = {"last_run": None, "last_batch": 0, "sent": 0, "errors": 0}
+
+
+# ----------------- Einreihen (innerhalb der aufrufenden Transaktion) -----------------
+
+def enqueue_create(appt: Appointment, patient_fhir_id: str, provider_fhir_id: str, notes: str) -> OutboxEntry:
+    """Reiht das Anlegen des FHIR-Appointments ein; appt muss schon eine ID haben (flush)."""
+    entry = OutboxEntry(
+        operation=OutboxOperation.create_appointment,
+        appointment_id=appt.id,
+        idempotency_key=uuid.uuid4().hex,
+        payload=json.dumps({
+            "patient_fhir_id": patient_fhir_id,
+            "provider_fhir_id": provider_fhir_id,
+            "start": appt.start.isoformat(),
+            "end": appt.end.isoformat(),
+            "notes": notes,
+        }),
+    )
+    db.session.add(entry)
+    return entry
+
+
+def enqueue_delete(appt: Appointment) -> OutboxEntry | None:
+    """
+    Reiht das Löschen des FHIR-Appointments ein. Ist die FHIR-ID noch nicht
+    bekannt (Create noch offen), wird später über den Idempotenz-Schlüssel gelöscht.
+    """
+    create = OutboxEntry.query.filter_by(
+        appointment_id=appt.id, operation=OutboxOperation.create_appointment
+    ).first()
+    if not appt.fhir_appointment_id and create is None:
+        return None  # existiert auf FHIR-Seite nicht
+    if create is not None and _discard_unsent(create):
+        return None  # Anlegen nie verschickt: auf FHIR-Seite gibt es nichts zu löschen
+
+    entry = OutboxEntry(
+        operation=OutboxOperation.delete_appointment,
+        appointment_id=appt.id,
+        idempotency_key=create.idempotency_key if create else uuid.uuid4().hex,
+        payload=json.dumps({"fhir_appointment_id": appt.fhir_appointment_id}),
+    )
+    db.session.add(entry)
+    return entry
+
+
+def _discard_unsent(create: OutboxEntry) -> bool:
+    """
+    Verwirft ein Anlegen, das noch nie verschickt wurde. Bedingtes UPDATE: hat
+    der Worker den Eintrag gerade abgeholt (Lease), passt die Bedingung nicht
+    mehr und das Löschen wird normal eingereiht.
+    """
+    now = datetime.now()
+    res = db.session.execute(
+        update(OutboxEntry)
+        .where(OutboxEntry.id == create.id, OutboxEntry.status == OutboxStatus.pending,
+               OutboxEntry.attempts == 0, OutboxEntry.next_attempt_at <= now)
+        .values(status=OutboxStatus.done, processed_at=now, last_error="discarded: cancelled before sending")
+    )
+    return res.rowcount == 1
+
+
+def notify() -> None:
+    """Nach dem Commit aufrufen: weckt den Worker, statt auf das nächste Intervall zu warten."""
+    _wakeup.set()
+
+
+# ----------------- Verarbeitung -----------------
+
+def _create_outstanding():
+    """Bedingung: für das Appointment des Eintrags steht noch ein Anlegen aus (auch im Backoff)."""
+    create = aliased(OutboxEntry)
+    return (
+        select(create.id)
+        .where(create.appointment_id == OutboxEntry.appointment_id,
+               create.operation == OutboxOperation.create_appointment,
+               create.status == OutboxStatus.pending)
+        .exists()
+    )
+
+
+def _claim(limit: int) -> list[OutboxEntry]:
+    """
+    Holt fällige Einträge und sperrt sie per Lease (next_attempt_at in die Zukunft).
+    Löschen wartet, solange das Anlegen desselben Termins noch aussteht.
+    """
+    now = datetime.now()
+    candidates = (
+        OutboxEntry.query
+        .filter(OutboxEntry.status == OutboxStatus.pending, OutboxEntry.next_attempt_at <= now)
+        .filter(or_(OutboxEntry.operation != OutboxOperation.delete_appointment, ~_create_outstanding()))
+        .order_by(OutboxEntry.id)
+        .limit(limit)
+        .all()
+    )
+    claimed = []
+    for entry in candidates:
+        res = db.session.execute(
+            update(OutboxEntry)
+            .where(OutboxEntry.id == entry.id, OutboxEntry.status == OutboxStatus.pending,
+                   OutboxEntry.next_attempt_at == entry.next_attempt_at)
+            .values(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE))
+        )
+        if res.rowcount:
+            claimed.append(entry)
+    db.session.commit()
+    return claimed
+
+
+def _bundle_entry(entry: OutboxEntry) -> dict:
+    data = json.loads(entry.payload)
+    condition = fhir.appointment_identifier_query(entry.idempotency_key)
+    if entry.operation == OutboxOperation.create_appointment:
+        body = fhir.appointment_body(
+            data["patient_fhir_id"], data["provider_fhir_id"],
+            datetime.fromisoformat(data["start"]), datetime.fromisoformat(data["end"]),
+            data["notes"], entry.idempotency_key,
+        )
+        return {"resource": body,
+                "request": {"method": "POST", "url": "Appointment", "ifNoneExist": condition}}
+    target = data.get("fhir_appointment_id")
+    url = f"Appointment/{target}" if target else f"Appointment?{condition}"
+    return {"request": {"method": "DELETE", "url": url}}
+
+
+def _outstanding_creates(entries: list[OutboxEntry]) -> set[int]:
+    """appointment_ids der Löschungen in 'entries', deren Anlegen noch aussteht."""
+    ids = {e.appointment_id for e in entries if e.operation == OutboxOperation.delete_appointment}
+    if not ids:
+        return set()
+    rows = db.session.query(OutboxEntry.appointment_id).filter(
+        OutboxEntry.appointment_id.in_(ids),
+        OutboxEntry.operation == OutboxOperation.create_appointment,
+        OutboxEntry.status == OutboxStatus.pending,
+    )
+    return {appointment_id for (appointment_id,) in rows}
+
+
+def _send_single(entry: OutboxEntry, missing_ok: bool = True) -> str | None:
+    data = json.loads(entry.payload)
+    if entry.operation == OutboxOperation.create_appointment:
+        return fhir.create_fhir_appointment(
+            data["patient_fhir_id"], data["provider_fhir_id"],
+            datetime.fromisoformat(data["start"]), datetime.fromisoformat(data["end"]),
+            data["notes"], idempotency_key=entry.idempotency_key,
+        )
+    fhir.delete_fhir_appointment(data.get("fhir_appointment_id"), idempotency_key=entry.idempotency_key,
+                                 missing_ok=missing_ok)
+    return None
+
+
+def _send(entries: list[OutboxEntry]) -> list[tuple[bool, str | None]]:
+    """
+    Schickt die Einträge; Rückgabe pro Eintrag (ok, FHIR-ID oder Fehlertext).
+    404 beim Löschen gilt nur als erledigt, wenn kein Anlegen mehr aussteht -
+    sonst könnte es das Appointment danach noch anlegen.
+    """
+    outstanding = _outstanding_creates(entries)
+    if fhir.USE_REAL and fhir.requests and fhir.bundles_supported():
+        try:
+            responses = fhir.send_bundle([_bundle_entry(e) for e in entries], bundle_type="batch")
+            out = []
+            for entry, resp in zip(entries, responses):
+                status = resp.get("status", "")
+                ok = status.startswith("2") or (
+                    entry.operation == OutboxOperation.delete_appointment and status.startswith("404")
+                    and entry.appointment_id not in outstanding)
+                out.append((True, fhir.id_from_location(resp.get("location"))) if ok
+                           else (False, f"{status} {json.dumps(resp.get('outcome', ''))}"))
+            return out
+        except fhir.BundleNotSupported:
+            pass
+
+    out = []
+    for entry in entries:
+        try:
+            out.append((True, _send_single(entry, missing_ok=entry.appointment_id not in outstanding)))
+        except Exception as e:
+            out.append((False, str(e)))
+    return out
+
+
+def process_pending(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """Ein Durchlauf: bis zu 'limit' fällige Einträge senden. Rückgabe: Anzahl abgeholter Einträge."""
+    entries = _claim(limit)
+    _state["last_run"] = datetime.now()
+    _state["last_batch"] = len(entries)
+    if not entries:
+        return 0
+
+    try:
+        results = _send(entries)
+    except Exception as e:
+        # ganzer Batch fehlgeschlagen (z. B. Server nicht erreichbar)
+        results = [(False, str(e))] * len(entries)
+
+    now = datetime.now()
+    for entry, (ok, result) in zip(entries, results):
+        entry.attempts += 1
+        if ok:
+            entry.status = OutboxStatus.done
+            entry.processed_at = now
+            entry.last_error = None
+            _state["sent"] += 1
+            if entry.operation == OutboxOperation.create_appointment and result:
+                db.session.execute(
+                    update(Appointment)
+                    .where(Appointment.id == entry.appointment_id)
+                    .values(fhir_appointment_id=result)
+                )
+            continue
+
+        _state["errors"] += 1
+        entry.last_error = result
+        if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+            entry.status = OutboxStatus.failed
+            log.error("Outbox entry %s (%s) failed permanently: %s", entry.id, entry.operation.value, result)
+        else:
+            delay = min(OUTBOX_BACKOFF_BASE * 2 ** (entry.attempts - 1), OUTBOX_BACKOFF_MAX)
+            entry.next_attempt_at = now + timedelta(seconds=delay)
+    db.session.commit()
+    return len(entries)
+
+
+# ----------------- Worker -----------------
+
+def _run(app, interval: float) -> None:
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                while process_pending() >= OUTBOX_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                log.exception("Outbox worker run failed: %s", e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def start_worker(app, interval: float | None = None) -> threading.Thread:
+    """Startet den Outbox-Worker als Daemon-Thread (einmal pro Prozess)."""
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        interval = interval or app.config.get("OUTBOX_POLL_INTERVAL", OUTBOX_POLL_INTERVAL)
+        _worker = threading.Thread(target=_run, args=(app, interval), name="fhir-outbox", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def stats() -> dict:
+    """Queue-Tiefe und Verzögerung (braucht App-Context)."""
+    counts = dict(
+        db.session.query(OutboxEntry.status, func.count(OutboxEntry.id))
+        .group_by(OutboxEntry.status)
+        .all()
+    )
+    oldest = (
+        db.session.query(func.min(OutboxEntry.created_at))
+        .filter(OutboxEntry.status == OutboxStatus.pending)
+        .scalar()
+    )
+    return {
+        "pending": counts.get(OutboxStatus.pending, 0),
+        "failed": counts.get(OutboxStatus.failed, 0),
+        "done": counts.get(OutboxStatus.done, 0),
+        "lag_seconds": (datetime.now() - oldest).total_seconds() if oldest else 0.0,
+        "worker_alive": bool(_worker and _worker.is_alive()),
+        **_state,
+    }
@@ -0,0 +1,177 @@
+# page_cache.py
+"""
+Datenversionen, Fragment-Cache und bedingte Antworten für die Buchungsseite.
+
+- Versionen: pro Datenart ("users", "appointments", "names") ein Zeitstempel in
+  sync_state. Session-Events setzen ihn in derselben Transaktion neu, sobald
+  User, Termine oder Anzeigenamen geschrieben werden (auch Bulk-INSERT/UPDATE/
+  DELETE aus Import und Abgleich). Liegt in der DB, gilt also für alle Worker.
+- Fragmente: gerendertes HTML (z. B. GDA-/Patientenauswahl) unter einem
+  Schlüssel aus den Versionen - neue Version, neuer Schlüssel, kein Invalidieren.
+- ETag/Last-Modified: aus den Versionen (plus Slots, Datum, User); passt
+  If-None-Match, antwortet die Seite mit 304 ohne Rendering.
+"""
+
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from flask import g, request, session
+from markupsafe import Markup
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+import fhir_cache
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.fhir_name_entity import FHIRDisplayName
+from database_layer.sync_state_entity import SyncState
+from database_layer.user_entity import User
+
+log = logging.getLogger(__name__)
+
+VERSION_NAMES = ("users", "appointments", "names")
+# ETags aus alten Deployments nicht weiterverwenden (Template-Änderungen)
+APP_VERSION = os.environ.get("APP_VERSION", "1")
+FRAGMENT_CACHE_MAXSIZE = 256
+FRAGMENT_CACHE_TTL = 60 * 60  # Sekunden; Schlüssel enthalten die Version, TTL nur gegen Altlasten
+
+_WATCHED = {User: "users", Appointment: "appointments", FHIRDisplayName: "names"}
+
+_MISSING = object()
+
+fragments = fhir_cache.TTLCache(maxsize=FRAGMENT_CACHE_MAXSIZE, ttl=FRAGMENT_CACHE_TTL)
+_state = {"not_modified": 0, "bumps": 0}
+
+
+def _version_key(name: str) -> str:
+    return f"data_version:{name}"
+
+
+# ----------------- Versionen -----------------
+
+def versions() -> dict[str, str]:
+    """{name: version} aller Datenarten - eine Abfrage; fehlende Einträge als ""."""
+    keys = {_version_key(n): n for n in VERSION_NAMES}
+    rows = db.session.query(SyncState.key, SyncState.value).filter(SyncState.key.in_(list(keys)))
+    out = dict.fromkeys(VERSION_NAMES, "")
+    for key, value in rows:
+        out[keys[key]] = value or ""
+    return out
+
+
+def bump(connection, names) -> None:
+    """Setzt neue Versionen über die Connection der laufenden Transaktion."""
+    now = datetime.now()
+    for name in names:
+        key = _version_key(name)
+        table = SyncState.__table__
+        result = connection.execute(
+            update(table).where(table.c.key == key).values(value=now.isoformat(), updated_at=now))
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(key=key, value=now.isoformat(), updated_at=now))
+        _state["bumps"] += 1
+
+
+def _after_flush(session, flush_context) -> None:
+    changed = set()
+    for obj in (*session.new, *session.deleted):
+        changed.add(_WATCHED.get(type(obj)))
+    for obj in session.dirty:
+        if type(obj) in _WATCHED and session.is_modified(obj):
+            changed.add(_WATCHED[type(obj)])
+    changed.discard(None)
+    if changed:
+        bump(session.connection(), sorted(changed))
+
+
+def _on_orm_execute(state) -> None:
+    # Bulk-DML (insert(User), query.delete(), update(Appointment) …) läuft ohne Flush
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    name = _WATCHED.get(getattr(state.bind_mapper, "class_", None))
+    if name:
+        bump(state.session.connection(), [name])
+
+
+def init_app(app) -> None:
+    """Session-Events registrieren (einmal pro Prozess, gilt auch für Hintergrundjobs)."""
+    if not event.contains(Session, "after_flush", _after_flush):
+        event.listen(Session, "after_flush", _after_flush)
+        event.listen(Session, "do_orm_execute", _on_orm_execute)
+
+
+# ----------------- Fragmente -----------------
+
+def fragment(key: tuple, render) -> Markup:
+    """
+    Gerendertes HTML unter 'key' (muss die Datenversionen enthalten); sonst render().
+    Mit Ersatzdaten gerenderte Fragmente (FHIR gestört) werden nicht abgelegt.
+    """
+    html = fragments.get(key)
+    if html is None:
+        html = Markup(render())
+        if not g.get("fhir_degraded", False):
+            fragments.set(key, html)
+    return html
+
+
+def cached_value(key: tuple, compute):
+    """Wie fragment(), für kleine abgeleitete Werte (z. B. Schedule des ersten GDA)."""
+    value = fragments.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        fragments.set(key, value)
+    return value
+
+
+# ----------------- Bedingte Antworten -----------------
+
+def weak_etag(*parts) -> str:
+    return hashlib.sha1("|".join(map(str, (APP_VERSION, *parts))).encode()).hexdigest()
+
+
+def last_modified(*stamps) -> datetime | None:
+    """Neuester Zeitstempel (ISO-Strings oder datetimes, auch FHIR-Instants)."""
+    out = None
+    for stamp in stamps:
+        if not stamp:
+            continue
+        if isinstance(stamp, str):
+            stamp = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+        if stamp.tzinfo:
+            stamp = stamp.astimezone().replace(tzinfo=None)
+        out = max(out, stamp) if out else stamp
+    return out.astimezone() if out else None
+
+
+def is_not_modified(etag: str, modified: datetime | None) -> bool:
+    """
+    Entscheidet über 304: If-None-Match hat Vorrang, sonst If-Modified-Since.
+    Ausstehende Flash-Meldungen müssen angezeigt werden, daher nie 304.
+    """
+    if session.get("_flashes"):
+        return False
+    if request.if_none_match:
+        hit = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and modified:
+        hit = modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        hit = False
+    if hit:
+        _state["not_modified"] += 1
+    return hit
+
+
+def make_conditional(response, etag: str, modified: datetime | None):
+    """Validatoren setzen; der Browser fragt bei jedem Besuch nach (no-cache)."""
+    response.set_etag(etag, weak=True)
+    if modified:
+        response.last_modified = modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def stats() -> dict:
+    return {**fragments.stats(), **_state}
@@ -0,0 +1,482 @@
+# reconcile.py
+"""
+Abgleich lokaler Termine mit den FHIR-Appointments (in beide Richtungen).
+
+FHIR -> lokal (nur Änderungen):
+    Appointment?practitioner=<unsere GDAs>&_lastUpdated=ge<cursor>&_sort=_lastUpdated
+    Pro Seite ein Lookup der lokalen Zeilen über den Unique-Index auf
+    fhir_appointment_id (Dict als Hash-Index für die Seite), dann gebündelt:
+    - neu auf FHIR-Seite      -> INSERT (executemany), bzw. Verknüpfung mit
+                                 einem lokalen Termin, dessen Outbox-Create noch läuft;
+                                 vorher dieselbe Überschneidungsprüfung wie bei
+                                 Buchungen (conflicts) - Überschneidungen werden
+                                 nicht übernommen, nur gezählt und geloggt
+    - Zeit/Teilnehmer geändert -> UPDATE (executemany über Primärschlüssel),
+                                 danach dieselbe Überschneidungsprüfung; überschneidende
+                                 Verschiebungen werden zurückgenommen und gezählt
+    - ohne Ende                -> nicht übernommen (no_end), die Seiten brauchen start/end
+    - cancelled/entered-in-error -> DELETE
+    Nach jeder Seite wird der Cursor in sync_state mit committet: ein Abbruch
+    verliert höchstens eine Seite, der nächste Lauf verarbeitet nur Deltas.
+    Speicherbedarf: eine Seite, unabhängig von der Gesamtzahl der Termine.
+    Danach Slot-Cache und Verfügbarkeit wie bei lokalen Buchungen nachziehen.
+
+lokal -> FHIR:
+    Termine ohne fhir_appointment_id kommen in die Outbox - endgültig
+    fehlgeschlagene Outbox-Einträge werden zurückgesetzt, Termine ganz ohne
+    Eintrag neu eingereiht (seitenweise per Keyset, ebenfalls speicherschonend).
+
+Auf FHIR hart gelöschte Termine tauchen in keiner Suche auf; die findet nur
+der optionale Prüflauf verify_local() (seitenweise _id-Suche).
+
+Ein Lauf hält eine Sperre in sync_state (ds.acquire_lease): mehrere Worker-
+Prozesse gleichen nie gleichzeitig ab.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+import availability
+import conflicts
+import database_service as ds
+import fhir_cache
+import fhir_client as fhir
+import outbox
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.outbox_entity import OutboxEntry, OutboxOperation, OutboxStatus
+from database_layer.user_entity import User, UserRoles
+
+log = logging.getLogger(__name__)
+
+RECONCILE_PAGE_SIZE = 500
+RECONCILE_LOCAL_BATCH = 1000
+RECONCILE_PRACTITIONER_CHUNK = 100  # Practitioner-IDs pro Suche
+RECONCILE_INTERVAL = 15 * 60
+RECONCILE_LEASE_TTL = 30 * 60  # abgelaufene Sperre (abgestürzter Prozess) wird übernommen
+CANCELLED_STATUS = ("cancelled", "entered-in-error")
+
+_worker = None
+_lease_owner = f"{socket.gethostname()}:{os.getpid()}"
+_state = {"last_run": None, "created": 0, "updated": 0, "deleted": 0, "linked": 0,
+          "enqueued": 0, "errors": 0}
+
+
+class ReconcileStats(dict):
+    def __init__(self):
+        super().__init__(pages=0, seen=0, created=0, updated=0, deleted=0, linked=0,
+                         unmapped=0, no_end=0, conflicts=0, failed_pages=0, enqueued=0, requeued=0,
+                         missing_on_fhir=0)
+
+    def add(self, key: str, n: int = 1) -> None:
+        self[key] += n
+
+
+# ----------------- Hilfsfunktionen -----------------
+
+def _participant_ids(res: dict) -> tuple[str | None, str | None]:
+    patient = practitioner = None
+    for p in res.get("participant", []):
+        ref = p.get("actor", {}).get("reference", "")
+        if ref.startswith("Patient/"):
+            patient = ref.split("/", 1)[1]
+        elif ref.startswith("Practitioner/"):
+            practitioner = ref.split("/", 1)[1]
+    return patient, practitioner
+
+
+def _idempotency_key(res: dict) -> str | None:
+    for ident in res.get("identifier", []):
+        if ident.get("system") == fhir.IDENTIFIER_SYSTEM:
+            return ident.get("value")
+    return None
+
+
+def _practitioner_chunks() -> list[list[str]]:
+    ids = sorted(
+        fid for (fid,) in db.session.query(User.fhir_practitioner_id)
+        .filter(User.role == UserRoles.gda, User.fhir_practitioner_id.isnot(None)) if fid
+    )
+    return [ids[i:i + RECONCILE_PRACTITIONER_CHUNK] for i in range(0, len(ids), RECONCILE_PRACTITIONER_CHUNK)]
+
+
+def _cursor_key(practitioner_ids: list[str]) -> str:
+    # neue GDAs ergeben einen neuen Schlüssel und damit einmal einen vollen Lauf
+    digest = hashlib.sha1(",".join(practitioner_ids).encode()).hexdigest()[:16]
+    return f"reconcile:appointments:{digest}"
+
+
+def _user_ids(column, fhir_ids: set[str]) -> dict[str, int]:
+    if not fhir_ids:
+        return {}
+    return dict(db.session.query(column, User.id).filter(column.in_(list(fhir_ids))).all())
+
+
+def _overlaps(values: dict, accepted: list[dict]) -> bool:
+    """Wie conflicts.assert_no_conflict für noch nicht eingefügte Zeilen: DB und schon angenommene der Seite."""
+    start, end = values["start"], values["end"]
+    for column, key in ((Appointment.provider_id, "provider_id"), (Appointment.patient_id, "patient_id")):
+        if conflicts.find_overlap(column, values[key], start, end) is not None:
+            return True
+        if any(a[key] == values[key] and a["start"] < end and a["end"] > start for a in accepted):
+            return True
+    return False
+
+
+_MOVED_FIELDS = ("patient_id", "provider_id", "start", "end")
+
+
+def _moved_overlaps(change: dict, row) -> bool:
+    """Geänderte Zeile (schon per UPDATE in der DB) gegen alle anderen Termine der Beteiligten."""
+    values = {k: change.get(k, getattr(row, k)) for k in _MOVED_FIELDS}
+    start, end = values["start"], values["end"] or values["start"]
+    return any(
+        conflicts.find_overlap(column, values[key], start, end, exclude_id=row.id) is not None
+        for column, key in ((Appointment.provider_id, "provider_id"), (Appointment.patient_id, "patient_id"))
+    )
+
+
+def _apply_updates(updates: list[dict], rows: dict, stats: ReconcileStats) -> list[dict]:
+    """
+    Verschiebungen von FHIR anwenden und danach prüfen. Überschneidet sich eine,
+    wird sie zurückgenommen; das kann eine andere, schon geprüfte treffen (sie
+    lag auf dem alten Platz), also bis nichts mehr kollidiert. Rückgabe: übernommene.
+    """
+    if not updates:
+        return []
+    db.session.execute(update(Appointment), updates)
+    accepted = list(updates)
+    while rejected := [u for u in accepted if _moved_overlaps(u, rows[u["id"]])]:
+        db.session.execute(update(Appointment), [
+            {"id": u["id"], **{k: getattr(rows[u["id"]], k) for k in u if k != "id"}} for u in rejected
+        ])
+        for u in rejected:
+            stats.add("conflicts")
+            log.warning("Reconcile: FHIR appointment %s was moved onto another appointment, not applied",
+                        rows[u["id"]].fhir_appointment_id)
+        accepted = [u for u in accepted if u not in rejected]
+    return accepted
+
+
+def _update_slot_cache(changes: list[tuple[bool, int, datetime]]) -> None:
+    """Nach dem Commit: Slot-Cache wie bei lokalen Buchungen (True) und Stornos (False) nachziehen."""
+    if not changes:
+        return
+    schedules = dict(db.session.query(User.id, User.fhir_schedule_id)
+                     .filter(User.id.in_({provider_id for _, provider_id, _ in changes})))
+    for booked, provider_id, start in changes:
+        mark = fhir_cache.slots.mark_booked if booked else fhir_cache.slots.mark_free
+        mark(schedules.get(provider_id), start)
+
+
+# ----------------- FHIR -> lokal -----------------
+
+def _apply_page(resources: list[dict], stats: ReconcileStats, touched: set[int],
+                slot_changes: list[tuple[bool, int, datetime]]) -> None:
+    """
+    Diff einer Seite gegen die lokalen Zeilen und gebündelt anwenden (ohne Commit).
+    slot_changes sammelt (gebucht?, provider_id, start) für _update_slot_cache.
+    """
+    by_fhir_id = {res["id"]: res for res in resources if res.get("id")}
+    local = {
+        row.fhir_appointment_id: row
+        for row in db.session.query(
+            Appointment.id, Appointment.fhir_appointment_id, Appointment.patient_id,
+            Appointment.provider_id, Appointment.start, Appointment.end,
+        ).filter(Appointment.fhir_appointment_id.in_(list(by_fhir_id)))
+    }
+
+    refs = [_participant_ids(res) for res in by_fhir_id.values()]
+    patients = _user_ids(User.fhir_patient_id, {p for p, _ in refs if p})
+    providers = _user_ids(User.fhir_practitioner_id, {pr for _, pr in refs if pr})
+
+    # noch nicht verknüpfte Outbox-Creates: FHIR-Termin gehört schon zu einer lokalen Zeile
+    keys = {k: fid for fid, res in by_fhir_id.items() if fid not in local and (k := _idempotency_key(res))}
+    pending_creates = dict(
+        db.session.query(OutboxEntry.idempotency_key, OutboxEntry.appointment_id)
+        .filter(OutboxEntry.operation == OutboxOperation.create_appointment,
+                OutboxEntry.idempotency_key.in_(list(keys)))
+        .all()
+    ) if keys else {}
+
+    candidates, updates, deletes, links = [], [], [], []
+    for fhir_id, res in by_fhir_id.items():
+        row = local.get(fhir_id)
+        cancelled = res.get("status") in CANCELLED_STATUS
+        patient_ref, practitioner_ref = _participant_ids(res)
+        values = {
+            "patient_id": patients.get(patient_ref),
+            "provider_id": providers.get(practitioner_ref),
+            "start": fhir.local_datetime(res.get("start")),
+            "end": fhir.local_datetime(res.get("end")),
+        }
+
+        if row is not None:
+            if cancelled:
+                deletes.append(row.id)
+                touched.add(row.provider_id)
+                slot_changes.append((False, row.provider_id, row.start))
+                continue
+            changed = {k: v for k, v in values.items() if v is not None and getattr(row, k) != v}
+            if changed:
+                updates.append({"id": row.id, **changed})
+            continue
+
+        if cancelled:
+            continue
+        appt_id = pending_creates.get(_idempotency_key(res))
+        if appt_id is not None:
+            links.append({"id": appt_id, "fhir_appointment_id": fhir_id})
+            continue
+        if values["patient_id"] is None or values["provider_id"] is None or values["start"] is None:
+            stats.add("unmapped")
+            continue
+        if values["end"] is None:
+            stats.add("no_end")
+            log.warning("Reconcile: FHIR appointment %s has no end, not imported", fhir_id)
+            continue
+        candidates.append({"fhir_appointment_id": fhir_id, **values})
+
+    if updates or candidates:
+        rows = {row.id: row for row in local.values()}
+        conflicts.lock_participants(
+            *{v[k] for v in candidates for k in ("provider_id", "patient_id")},
+            *{u[k] for u in updates for k in ("provider_id", "patient_id") if k in u},
+            *{getattr(rows[u["id"]], k) for u in updates for k in ("provider_id", "patient_id")},
+        )
+
+    # Stornos/Verschiebungen zuerst: ein neuer Termin darf den frei gewordenen Platz einnehmen
+    if deletes:
+        db.session.execute(
+            delete(Appointment).where(Appointment.id.in_(deletes)).execution_options(synchronize_session=False))
+    updates = _apply_updates(updates, rows, stats) if updates else []
+    for change in updates:
+        row = rows[change["id"]]
+        touched.update({row.provider_id, change.get("provider_id")} - {None})
+        if "start" in change or "provider_id" in change:
+            slot_changes.append((False, row.provider_id, row.start))
+            slot_changes.append((True, change.get("provider_id", row.provider_id), change.get("start", row.start)))
+    if links:
+        db.session.execute(update(Appointment), links)
+
+    inserts = []
+    for values in candidates:
+        if _overlaps(values, inserts):
+            stats.add("conflicts")
+            log.warning("Reconcile: FHIR appointment %s overlaps a local appointment, not imported",
+                        values["fhir_appointment_id"])
+            continue
+        inserts.append(values)
+        touched.add(values["provider_id"])
+        slot_changes.append((True, values["provider_id"], values["start"]))
+    if inserts:
+        db.session.execute(insert(Appointment), inserts)
+    stats.add("created", len(inserts))
+    stats.add("updated", len(updates))
+    stats.add("linked", len(links))
+    stats.add("deleted", len(deletes))
+
+
+def pull_changes(full: bool = False, page_size: int = RECONCILE_PAGE_SIZE) -> ReconcileStats:
+    """FHIR -> lokal, nur Appointments seit dem letzten Cursor (braucht App-Context)."""
+    stats = ReconcileStats()
+    if not (fhir.USE_REAL and fhir.requests):
+        return stats
+
+    touched, slot_changes = set(), []
+    for practitioner_ids in _practitioner_chunks():
+        key = _cursor_key(practitioner_ids)
+        cursor = None if full else ds.get_sync_state(key)
+        params = [
+            ("practitioner", ",".join(practitioner_ids)),
+            ("_sort", "_lastUpdated"),
+            ("_count", str(page_size)),
+        ]
+        if cursor:
+            # ge statt gt: gleiche Zeitstempel an der Seitengrenze gehen nicht verloren,
+            # doppelt gesehene Termine ändern beim zweiten Mal nichts
+            params.append(("_lastUpdated", f"ge{cursor}"))
+
+        for _, bundle in fhir.iter_bundle_pages("Appointment", params):
+            resources = [e["resource"] for e in bundle.get("entry", [])
+                         if e.get("resource", {}).get("resourceType") == "Appointment"]
+            if not resources:
+                continue
+            before, page_changes = dict(stats), []
+            try:
+                _apply_page(resources, stats, touched, page_changes)
+                page_cursor = max((r.get("meta", {}).get("lastUpdated") or "" for r in resources), default="")
+                cursor = fhir._max_instant(cursor, page_cursor or None)
+                if cursor:
+                    ds.set_sync_state(key, cursor)
+                db.session.commit()
+            except IntegrityError as e:
+                # z. B. gleichzeitig verknüpfter Outbox-Create: Seite verwerfen, der
+                # Cursor bleibt davor, der nächste Lauf versucht sie erneut
+                db.session.rollback()
+                stats.update(before)
+                stats.add("failed_pages")
+                log.warning("Reconcile page rejected by the database, retrying next run: %s", e.orig)
+                break
+            db.session.expunge_all()  # Speicher pro Seite freigeben
+            slot_changes.extend(page_changes)
+            stats.add("pages")
+            stats.add("seen", len(resources))
+            if not ds.acquire_lease("reconcile", _lease_owner, RECONCILE_LEASE_TTL):
+                raise RuntimeError("reconcile lease lost to another process")
+
+    for provider_id in touched:
+        conflicts.invalidate(provider_id)
+        availability.invalidate_provider(provider_id)
+    _update_slot_cache(slot_changes)
+    return stats
+
+
+# ----------------- lokal -> FHIR -----------------
+
+def push_missing(batch: int = RECONCILE_LOCAL_BATCH) -> ReconcileStats:
+    """Termine ohne FHIR-ID (wieder) in die Outbox stellen (braucht App-Context)."""
+    stats = ReconcileStats()
+
+    # endgültig fehlgeschlagene Creates: gleicher Idempotenz-Schlüssel, neuer Anlauf
+    requeued = db.session.execute(
+        update(OutboxEntry)
+        .where(OutboxEntry.operation == OutboxOperation.create_appointment,
+               OutboxEntry.status == OutboxStatus.failed,
+               OutboxEntry.appointment_id.in_(
+                   db.session.query(Appointment.id).filter(Appointment.fhir_appointment_id.is_(None))))
+        .values(status=OutboxStatus.pending, attempts=0, next_attempt_at=datetime.now())
+    ).rowcount
+    stats.add("requeued", requeued)
+    db.session.commit()
+
+    has_entry = (
+        db.session.query(OutboxEntry.id)
+        .filter(OutboxEntry.appointment_id == Appointment.id,
+                OutboxEntry.operation == OutboxOperation.create_appointment)
+        .exists()
+    )
+    last_id = 0
+    while True:
+        rows = (
+            Appointment.query
+            .filter(Appointment.fhir_appointment_id.is_(None), Appointment.id > last_id, ~has_entry)
+            .order_by(Appointment.id)
+            .limit(batch)
+            .all()
+        )
+        if not rows:
+            break
+        users = {u.id: u for u in User.query.filter(
+            User.id.in_({r.patient_id for r in rows} | {r.provider_id for r in rows}))}
+        for appt in rows:
+            patient, provider = users.get(appt.patient_id), users.get(appt.provider_id)
+            if patient and provider and patient.fhir_patient_id and provider.fhir_practitioner_id:
+                outbox.enqueue_create(appt, patient.fhir_patient_id, provider.fhir_practitioner_id, "")
+                stats.add("enqueued")
+        last_id = rows[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+    if stats["enqueued"] or requeued:
+        outbox.notify()
+    return stats
+
+
+# ----------------- Prüflauf: auf FHIR gelöschte Termine -----------------
+
+def verify_local(batch: int = fhir.NAME_SEARCH_CHUNK, apply: bool = False) -> ReconcileStats:
+    """
+    Prüft alle lokalen FHIR-IDs seitenweise per _id-Suche. Fehlende Termine wurden
+    auf dem FHIR-Server gelöscht; mit apply=True werden sie auch lokal gelöscht.
+    """
+    stats = ReconcileStats()
+    if not (fhir.USE_REAL and fhir.requests):
+        return stats
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Appointment.id, Appointment.fhir_appointment_id, Appointment.provider_id,
+                             Appointment.start)
+            .filter(Appointment.fhir_appointment_id.isnot(None), Appointment.id > last_id)
+            .order_by(Appointment.id)
+            .limit(batch)
+            .all()
+        )
+        if not rows:
+            break
+        ids = [r.fhir_appointment_id for r in rows]
+        found = {res.get("id") for res in fhir.iter_bundle_resources(
+            "Appointment", {"_id": ",".join(ids), "_elements": "id", "_count": str(len(ids))})}
+        missing = [r for r in rows if r.fhir_appointment_id not in found]
+        stats.add("missing_on_fhir", len(missing))
+        if apply and missing:
+            db.session.execute(delete(Appointment).where(Appointment.id.in_([r.id for r in missing])))
+            db.session.commit()
+            for r in missing:
+                conflicts.forget(r.id, r.provider_id)
+                availability.invalidate_provider(r.provider_id)
+            _update_slot_cache([(False, r.provider_id, r.start) for r in missing])
+            stats.add("deleted", len(missing))
+        last_id = rows[-1].id
+    return stats
+
+
+def reconcile(full: bool = False) -> dict:
+    """Ein Durchlauf in beide Richtungen; Rückgabe: Zähler (leer, wenn ein anderer Prozess abgleicht)."""
+    if not ds.acquire_lease("reconcile", _lease_owner, RECONCILE_LEASE_TTL):
+        log.info("Reconcile skipped: another process holds the lease")
+        return {}
+    started = time.perf_counter()
+    result = ReconcileStats()
+    try:
+        for part in (pull_changes(full=full), push_missing()):
+            for k, v in part.items():
+                result[k] += v
+    finally:
+        db.session.rollback()
+        ds.release_lease("reconcile", _lease_owner)
+    for k in ("created", "updated", "deleted", "linked", "enqueued"):
+        _state[k] += result[k]
+    _state["last_run"] = datetime.now()
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    log.info("Reconcile: %s", json.dumps(result))
+    return result
+
+
+# ----------------- Worker -----------------
+
+def _run(app, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                reconcile()
+            except Exception as e:
+                _state["errors"] += 1
+                log.warning("Reconcile run failed: %s", e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def start_worker(app, interval: float | None = None) -> threading.Thread:
+    """Startet den Abgleich als Daemon-Thread (einmal pro Prozess)."""
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        interval = interval or app.config.get("RECONCILE_INTERVAL", RECONCILE_INTERVAL)
+        _worker = threading.Thread(target=_run, args=(app, interval), name="fhir-reconcile", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def stats() -> dict:
+    return {**_state, "worker_alive": bool(_worker and _worker.is_alive())}
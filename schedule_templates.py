@@ -0,0 +1,254 @@
+# schedule_templates.py
+"""
+Wiederkehrende Sprechzeiten (Wochenvorlage) -> freie Slots für viele GDAs.
+
+Eine Vorlage beschreibt pro Wochentag Blöcke mit eigener Slot-Länge, dazu
+Pausen und Feiertage:
+
+    {
+      "slot_minutes": 30,
+      "weekly": {"mon": [["08:00", "12:00"], ["13:00", "17:00", 20]],
+                 "fri": [["08:00", "13:00"]]},
+      "breaks": [["10:00", "10:15"]],
+      "holidays": ["2025-12-25", "2025-12-26"]
+    }
+
+Die Expansion rechnet komplett mit NumPy-datetime64-Arrays (Tage x Offsets
+pro Block, Masken für Pausen/Feiertage) und einmal pro Vorlage - nicht pro GDA.
+Pro GDA werden nur noch die lokal gebuchten Termine abgezogen (searchsorted
+über die sortierten Termin-Intervalle). Erst publish() baut daraus FHIR-Slots
+und legt sie bedingt im Bulk an (If-None-Exist wie beim Seeding) - mit httpx
+für alle GDAs gleichzeitig über fhir_async, sonst GDA für GDA.
+
+NumPy ist optional und wird nur hier gebraucht.
+
+    flask generate-slots vorlage.json --from 2025-01-01 --to 2026-01-01
+"""
+
+import json
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+import fhir_async
+import fhir_cache
+import fhir_client as fhir
+import availability
+import seeding
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+from database_layer.user_entity import User
+
+try:
+    import numpy as np  # optional
+except Exception:
+    np = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SLOT_MINUTES = 30
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("schedule_templates needs the optional 'numpy' package")
+
+
+def _minute_of_day(value: str) -> int:
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class ScheduleTemplate:
+    """Wochenvorlage: Blöcke (wochentag, von, bis, slot_minuten), Pausen, Feiertage."""
+
+    def __init__(self, weekly: dict, slot_minutes: int = DEFAULT_SLOT_MINUTES,
+                 breaks: list | None = None, holidays: list | None = None):
+        self.slot_minutes = int(slot_minutes)
+        self.blocks = []  # (wochentag 0=Mo, start_minute, end_minute, slot_minuten)
+        for day, ranges in weekly.items():
+            weekday = WEEKDAYS.index(day[:3].lower()) if isinstance(day, str) and not day.isdigit() else int(day)
+            for entry in ranges:
+                begin, end = _minute_of_day(entry[0]), _minute_of_day(entry[1])
+                length = int(entry[2]) if len(entry) > 2 else self.slot_minutes
+                if length <= 0 or end <= begin:
+                    raise ValueError(f"invalid block {entry!r} on {day}")
+                self.blocks.append((weekday, begin, end, length))
+        self.breaks = [(_minute_of_day(b), _minute_of_day(e)) for b, e in (breaks or [])]
+        self.holidays = [date.fromisoformat(str(d)) for d in (holidays or [])]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ScheduleTemplate":
+        return cls(data["weekly"], data.get("slot_minutes", DEFAULT_SLOT_MINUTES),
+                   data.get("breaks"), data.get("holidays"))
+
+    @classmethod
+    def load(cls, path: str) -> "ScheduleTemplate":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# ----------------- Expansion (vektorisiert) -----------------
+
+def expand(template: ScheduleTemplate, start, end):
+    """
+    Alle Slots der Vorlage, die ganz in [start, end) liegen, als (starts, ends),
+    datetime64[m], sortiert. start/end dürfen auch mitten am Tag liegen.
+    """
+    _require_numpy()
+    first, stop = np.datetime64(start, "m"), np.datetime64(end, "m")
+    # alle angeschnittenen Tage; was vor start/nach end liegt, fällt unten heraus
+    last_day = (stop - np.timedelta64(1, "m")).astype("datetime64[D]")
+    days = np.arange(first.astype("datetime64[D]"), last_day + 1, dtype="datetime64[D]")
+    if template.holidays:
+        days = days[~np.isin(days, np.array(template.holidays, dtype="datetime64[D]"))]
+    weekdays = (days.astype("int64") + 3) % 7  # 1970-01-01 war ein Donnerstag
+
+    starts = []
+    for weekday, begin, block_end, length in template.blocks:
+        block_days = days[weekdays == weekday]
+        offsets = np.arange(begin, block_end - length + 1, length, dtype="int64")
+        if not len(block_days) or not len(offsets):
+            continue
+        # Tage x Offsets per Broadcasting, dann flach
+        grid = block_days.astype("datetime64[m]")[:, None] + offsets.astype("timedelta64[m]")[None, :]
+        starts.append((grid.ravel(), np.full(grid.size, length, dtype="int64")))
+    if not starts:
+        empty = np.array([], dtype="datetime64[m]")
+        return empty, empty
+    slot_starts = np.concatenate([s for s, _ in starts])
+    slot_ends = slot_starts + np.concatenate([n for _, n in starts]).astype("timedelta64[m]")
+    inside = (slot_starts >= first) & (slot_ends <= stop)
+    slot_starts, slot_ends = slot_starts[inside], slot_ends[inside]
+
+    if template.breaks:
+        minute = (slot_starts - slot_starts.astype("datetime64[D]")).astype("int64")
+        length = (slot_ends - slot_starts).astype("int64")
+        keep = np.ones(slot_starts.size, dtype=bool)
+        for b, e in template.breaks:
+            keep &= ~((minute < e) & (minute + length > b))
+        slot_starts, slot_ends = slot_starts[keep], slot_ends[keep]
+
+    order = np.argsort(slot_starts, kind="stable")
+    return slot_starts[order], slot_ends[order]
+
+
+def subtract_intervals(starts, ends, busy_starts, busy_ends):
+    """Maske: True für Slots ohne Überschneidung mit [busy_starts, busy_ends) (nach Start sortiert)."""
+    if not busy_starts.size:
+        return np.ones(starts.size, dtype=bool)
+    # größtes Ende aller Termine, die bis Index i beginnen (auch bei Überlappungen korrekt)
+    max_ends = np.maximum.accumulate(busy_ends)
+    idx = np.searchsorted(busy_starts, ends, side="left") - 1
+    overlaps = (idx >= 0) & (max_ends[np.maximum(idx, 0)] > starts)
+    return ~overlaps
+
+
+def booked_intervals(provider_ids: list[int], start, end,
+                     slot_minutes: int = DEFAULT_SLOT_MINUTES) -> dict:
+    """
+    {provider_id: (starts, ends)} der lokalen Termine im Zeitraum - eine Abfrage.
+    Termine ohne Ende belegen slot_minutes ab Beginn: coalesce(end, start + Slot-Länge).
+    """
+    _require_numpy()
+    default_length = timedelta(minutes=slot_minutes)
+    rows = (
+        db.session.query(Appointment.provider_id, Appointment.start, Appointment.end)
+        .filter(Appointment.provider_id.in_(provider_ids), Appointment.start < end,
+                or_(Appointment.end > start,
+                    and_(Appointment.end.is_(None), Appointment.start > start - default_length)))
+        .order_by(Appointment.provider_id, Appointment.start)
+        .all()
+    )
+    out = {}
+    if not rows:
+        return out
+    ids = np.array([r[0] for r in rows])
+    starts = np.array([r[1] for r in rows], dtype="datetime64[m]")
+    ends = np.array([r[2] if r[2] is not None else r[1] + default_length for r in rows], dtype="datetime64[m]")
+    unique, first = np.unique(ids, return_index=True)
+    bounds = list(first[1:]) + [len(ids)]
+    for provider_id, a, b in zip(unique.tolist(), first, bounds):
+        out[provider_id] = (starts[a:b], ends[a:b])
+    return out
+
+
+def generate(template: ScheduleTemplate, provider_ids: list[int], start, end) -> dict:
+    """{provider_id: (starts, ends)} freier Slots: Vorlage einmal expandiert, Termine abgezogen."""
+    starts, ends = expand(template, start, end)
+    booked = booked_intervals(provider_ids, start, end, template.slot_minutes)
+    out = {}
+    for provider_id in provider_ids:
+        if provider_id in booked:
+            keep = subtract_intervals(starts, ends, *booked[provider_id])
+            out[provider_id] = (starts[keep], ends[keep])
+        else:
+            out[provider_id] = (starts, ends)
+    return out
+
+
+# ----------------- FHIR -----------------
+
+def slot_resources(schedule_id: str, starts, ends) -> list[dict]:
+    return [fhir.slot_body(schedule_id, s, e) for s, e in zip(starts.tolist(), ends.tolist())]
+
+
+def _create_slots(jobs: dict, conditions: dict) -> dict:
+    """{schedule_id: [slots]} anlegen; Rückgabe {schedule_id: ids oder Exception}."""
+    if fhir_async.available():
+        return fhir_async.create_resources_many("Slot", jobs, conditions)
+    results = {}
+    for schedule_id, bodies in jobs.items():
+        try:
+            results[schedule_id] = fhir.create_resources("Slot", bodies, if_none_exist=conditions[schedule_id])
+        except Exception as e:
+            results[schedule_id] = e
+    return results
+
+
+def publish(providers: list[User], generated: dict) -> dict:
+    """Legt die Slots pro Schedule bedingt im Bulk an; Rückgabe: Zähler."""
+    counts = {"providers": 0, "slots": 0, "skipped_without_schedule": 0, "failed": []}
+    jobs, conditions, owners = {}, {}, {}
+    for user in providers:
+        starts, ends = generated.get(user.id, (None, None))
+        if starts is None or not starts.size:
+            continue
+        if not user.fhir_schedule_id:
+            counts["skipped_without_schedule"] += 1
+            log.warning("No FHIR Schedule for %s, slots not published", user.email)
+            continue
+        bodies = slot_resources(user.fhir_schedule_id, starts, ends)
+        jobs[user.fhir_schedule_id] = bodies
+        conditions[user.fhir_schedule_id] = [seeding.slot_condition(b) for b in bodies]
+        owners[user.fhir_schedule_id] = user
+
+    for schedule_id, result in _create_slots(jobs, conditions).items():
+        user = owners[schedule_id]
+        fhir_cache.slots.invalidate(schedule_id)
+        availability.invalidate_provider(user.id)
+        if isinstance(result, Exception):
+            counts["failed"].append(user.email)
+            log.warning("Publishing slots for %s failed: %s", user.email, result)
+            continue
+        counts["providers"] += 1
+        counts["slots"] += len(jobs[schedule_id])
+    return counts
+
+
+def generate_slots(template: ScheduleTemplate, providers: list[User], start: datetime, end: datetime,
+                   dry_run: bool = False) -> dict:
+    """Expandiert, zieht Termine ab und veröffentlicht (braucht App-Context)."""
+    started = time.perf_counter()
+    generated = generate(template, [u.id for u in providers], start, end)
+    report = {
+        "generated": sum(s.size for s, _ in generated.values()),
+        "generate_seconds": round(time.perf_counter() - started, 3),
+    }
+    if not dry_run:
+        report.update(publish(providers, generated))
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
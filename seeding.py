@@ -0,0 +1,175 @@
+# seeding.py
+"""
+Initialbefüllung: Beispiel-GDAs und -Patienten lokal, Schedules und Slots in FHIR.
+
+- Pro GDA läuft die FHIR-Anlage (Schedule, dann dessen Slots) als eigene
+  Aufgabe, alle GDAs parallel (SEED_WORKERS).
+- Alles wird bedingt angelegt (If-None-Exist): Schedule über einen eigenen
+  Identifier (SEED_SCHEDULE_SYSTEM|<Practitioner-ID>), Slot über
+  "schedule=Schedule/<id>&start=<start>". Ein zweiter Lauf legt nichts doppelt
+  an, sondern ergänzt nur Fehlendes. Auf einem geteilten Server kann es zum
+  selben Practitioner fremde Schedules geben, daher nicht "actor=…" als
+  Bedingung. Meldet der Server trotzdem 412 (mehrere Treffer), wird gesucht
+  und stets derselbe (ältester) Schedule genommen.
+- Lokale User werden über die E-Mail abgeglichen (vorhandene nur ergänzt).
+- Fehler pro GDA landen im Bericht und im Log, statt still unterzugehen.
+
+    flask seed            # ergänzen
+    flask seed --reset    # Tabellen neu anlegen, dann befüllen
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+import fhir_client as fhir
+from database_layer.db_instance import db
+from database_layer.user_entity import User, UserRoles
+
+log = logging.getLogger(__name__)
+
+SEED_WORKERS = 4
+SEED_SLOT_DAYS = 7
+SEED_SLOT_TIMES = [(9, 0), (10, 0), (14, 0)]
+SEED_SCHEDULE_SYSTEM = "urn:webb:seed-schedule"
+
+# (E-Mail, Passwort, FHIR-Practitioner-ID)
+SEED_GDAS = [
+    ("alexander.owens@biomedical.org", "heartpass", "822316"),
+    ("sophia.ingram@biomedical.org", "eyepass", "822317"),
+    ("taylor.mckenzie@biomedical.org", "physiopass", "822318"),
+    ("elisa.bennett@biomedical.org", "brainpass", "822319"),
+]
+
+# wurden mit postman auf den FHIR servrer gesendet und dann die id die ich zurück bekomme
+SEED_PATIENTS = [
+    ("maria.schneider@example.com", "maria123", "822300"),
+    ("felix.mueller@example.com", "felix123", "822301"),
+    ("thomas.becker@example.com", "thomas123", "822302"),
+    ("lisa.wagner@example.com", "lisa123", "822303"),
+    ("max.bauer@example.com", "max123", "822304"),
+    ("anna.richter@example.com", "anna123", "822306"),
+    ("daniel.weber@example.com", "daniel123", "822307"),
+    ("johannes.meier@example.com", "johannes123", "822308"),
+]
+
+
+# ----------------- FHIR -----------------
+
+def schedule_body(practitioner_id: str) -> dict:
+    body = fhir.schedule_body(practitioner_id)
+    body["identifier"] = [{"system": SEED_SCHEDULE_SYSTEM, "value": practitioner_id}]
+    return body
+
+
+def schedule_search(practitioner_id: str) -> dict:
+    return {"identifier": f"{SEED_SCHEDULE_SYSTEM}|{practitioner_id}"}
+
+
+def schedule_condition(practitioner_id: str) -> str:
+    return urlencode(schedule_search(practitioner_id))
+
+
+def find_schedule(practitioner_id: str) -> str | None:
+    """Ältester passender Schedule (mehrere Treffer: jeder Lauf wählt denselben)."""
+    found = list(fhir.iter_bundle_resources("Schedule", schedule_search(practitioner_id)))
+    if not found:
+        return None
+    return min(found, key=lambda r: (r.get("meta", {}).get("lastUpdated") or "", r.get("id")))["id"]
+
+
+def ensure_schedule(practitioner_id: str) -> str | None:
+    """Schedule des GDA bedingt anlegen; bei 412 (mehrere Treffer) einen vorhandenen nehmen."""
+    try:
+        [schedule_id] = fhir.create_resources("Schedule", [schedule_body(practitioner_id)],
+                                              if_none_exist=[schedule_condition(practitioner_id)])
+    except Exception as e:
+        if getattr(getattr(e, "response", None), "status_code", None) != 412:
+            raise
+        log.warning("Several Schedules for Practitioner/%s, using the oldest", practitioner_id)
+        schedule_id = find_schedule(practitioner_id)
+    return schedule_id
+
+
+def slot_condition(slot: dict) -> str:
+    return urlencode({"schedule": slot["schedule"]["reference"], "start": slot["start"]})
+
+
+def provision_provider(practitioner_id: str, start_date: datetime | None = None) -> dict:
+    """Schedule + Slots eines GDA (bedingt); Rückgabe: schedule_id, Anzahl Slots, Dauer."""
+    started = time.perf_counter()
+    schedule_id = ensure_schedule(practitioner_id)
+    if not schedule_id:
+        raise RuntimeError(f"no Schedule id returned for Practitioner/{practitioner_id}")
+    slots = fhir.slot_bodies(schedule_id, start_date, SEED_SLOT_DAYS, SEED_SLOT_TIMES)
+    fhir.create_resources("Slot", slots, if_none_exist=[slot_condition(s) for s in slots])
+    return {"schedule_id": schedule_id, "slots": len(slots),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def provision_providers(practitioner_ids: list[str]) -> dict[str, dict]:
+    """Alle GDAs parallel; pro ID entweder das Ergebnis oder {"error": ...}."""
+    results = {}
+    with ThreadPoolExecutor(max_workers=SEED_WORKERS, thread_name_prefix="fhir-seed") as pool:
+        futures = {pid: pool.submit(provision_provider, pid) for pid in practitioner_ids}
+        for pid, future in futures.items():
+            try:
+                results[pid] = future.result()
+            except Exception as e:
+                log.warning("Failed to create FHIR Schedule/Slots for Practitioner/%s (%s)", pid, e)
+                results[pid] = {"error": str(e)}
+    return results
+
+
+# ----------------- Lokal -----------------
+
+def seed(provision: bool = True) -> dict:
+    """
+    Legt fehlende Beispiel-User an und versorgt GDAs ohne Schedule (braucht App-Context).
+    Rückgabe: Bericht mit Zählern, Fehlern und Dauer.
+    """
+    started = time.perf_counter()
+    log.info("Populating database with staff and patients...")
+    emails = [e for e, _, _ in SEED_GDAS + SEED_PATIENTS]
+    existing = {u.email: u for u in User.query.filter(User.email.in_(emails))}
+
+    gdas = []
+    for email, password, practitioner_id in SEED_GDAS:
+        user = existing.get(email)
+        if user is None:
+            user = User(email=email, role=UserRoles.gda, user_password=password,
+                        fhir_practitioner_id=practitioner_id)
+            db.session.add(user)
+        gdas.append(user)
+    for email, password, patient_id in SEED_PATIENTS:
+        if email not in existing:
+            db.session.add(User(email=email, role=UserRoles.patient, user_password=password,
+                                fhir_patient_id=patient_id))
+
+    pending = [u for u in gdas if not u.fhir_schedule_id] if provision else []
+    results = provision_providers([u.fhir_practitioner_id for u in pending]) if pending else {}
+    failed = []
+    for user in pending:
+        result = results[user.fhir_practitioner_id]
+        if "error" in result:
+            failed.append(user.email)
+        else:
+            user.fhir_schedule_id = result["schedule_id"]
+            log.info("Schedule %s and %s Slots for %s (%.2f s)",
+                     result["schedule_id"], result["slots"], user.email, result["seconds"])
+    db.session.commit()
+
+    report = {
+        "users_created": len(emails) - len(existing),
+        "providers_provisioned": len(pending) - len(failed),
+        "providers_failed": failed,
+        "slots": sum(r.get("slots", 0) for r in results.values()),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if failed:
+        log.error("Seeding incomplete: FHIR provisioning failed for %s of %s providers: %s",
+                  len(failed), len(pending), ", ".join(failed))
+    log.info("Seeding finished in %.2f s: %s", report["seconds"], report)
+    return report
@@ -0,0 +1,80 @@
+# tests/conftest.py
+"""
+Gemeinsame Fixtures: die App gegen eine temporäre SQLite-Datei, pro Test ein
+frischer Fake-FHIR-Server (fake_fhir_server) und leere Caches.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Module lesen die Umgebung beim Import - vor dem ersten "import app" setzen
+_TMP = tempfile.mkdtemp(prefix="webb-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["RUN_BACKGROUND_WORKERS"] = "0"
+
+from fake_fhir_server import FakeFHIRServer  # noqa: E402
+
+
+def clear_caches() -> None:
+    """Alle Prozess-Caches leeren (Namen, Slots, Kalender, Fragmente, Bitmaps)."""
+    import availability
+    import conflicts
+    import fhir_cache
+    import page_cache
+
+    fhir_cache.display_names.clear()
+    fhir_cache.slots._windows.clear()
+    fhir_cache.slots._booked.clear()
+    conflicts._calendars.clear()
+    page_cache.fragments.clear()
+    availability._days.clear()
+
+
+@pytest.fixture(scope="session")
+def webapp():
+    import app as webapp
+    webapp.app.config["TESTING"] = True
+    return webapp.app
+
+
+@pytest.fixture
+def fhir_server():
+    import fhir_client as fhir
+    server = FakeFHIRServer().start()
+    fhir.configure(base_url=server.base_url)
+    fhir.breaker.reset()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app_ctx(webapp, fhir_server):
+    """App-Context mit neu angelegten Tabellen und Seed-Daten (User, Schedules, Slots)."""
+    import database_service as ds
+    from database_layer.db_instance import db
+
+    with webapp.app_context():
+        db.drop_all()
+        ds.ensure_schema(force=True)
+        clear_caches()
+        ds.sqlite_populate()
+        fhir_server.reset_counters()
+        yield webapp
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture
+def users(app_ctx):
+    """Seed-User nach E-Mail."""
+    from database_layer.user_entity import User
+    return {u.email: u for u in User.query.all()}
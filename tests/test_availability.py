@@ -0,0 +1,45 @@
+# tests/test_availability.py
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import inspect, insert
+from sqlalchemy.orm import Session
+
+import availability
+import database_service as ds
+from database_layer.appointment_entity import Appointment
+from database_layer.db_instance import db
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+
+
+def _busy(provider, day):
+    return availability.day_bitmaps([provider], [day])[availability._key(provider.id, day)].busy
+
+
+def test_booking_from_another_worker_is_visible_without_waiting_for_ttl(users):
+    provider, day = users[GDA], date.today() + timedelta(days=40)
+    assert _busy(provider, day) == 0  # Tag liegt jetzt im Cache
+
+    # anderer Prozess: eigene Session, kein mark_busy in diesem Prozess
+    start = datetime.combine(day, datetime.min.time()).replace(hour=10)
+    with Session(db.engine) as other:
+        other.execute(insert(Appointment).values(patient_id=users[PATIENT].id, provider_id=provider.id,
+                                                 start=start, end=start + timedelta(minutes=30)))
+        other.commit()
+
+    loads = availability._state["loads"]
+    assert _busy(provider, day) == availability.interval_mask(600, 630, inner=False)
+    assert availability._state["loads"] == loads  # nur busy neu gelesen, kein FHIR-Laden
+
+
+def test_ensure_schema_adds_missing_schedule_column(app_ctx):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE users DROP COLUMN fhir_schedule_id")
+    assert "fhir_schedule_id" not in {c["name"] for c in inspect(db.engine).get_columns("users")}
+
+    db.session.remove()
+    ds.ensure_schema(force=True)
+
+    assert "fhir_schedule_id" in {c["name"] for c in inspect(db.engine).get_columns("users")}
+    assert ds.get_schema_version() == ds.SCHEMA_VERSION
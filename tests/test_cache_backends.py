@@ -0,0 +1,168 @@
+# tests/test_cache_backends.py
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import cache_backends
+import fhir_cache
+
+BACKENDS = ("memory", "sqlite", "redis")
+
+
+@pytest.fixture
+def make(tmp_path):
+    """Cache-Fabrik pro Backend; gleicher Namespace = zweiter Worker auf demselben Backend."""
+    local_redis = cache_backends.LocalRedis()
+
+    def factory(backend, namespace="test", ttl=60.0):
+        if backend == "memory":
+            return fhir_cache.TTLCache(maxsize=100, ttl=ttl)
+        if backend == "sqlite":
+            return cache_backends.SQLiteCache(str(tmp_path / "cache.sqlite"), namespace, 100, ttl)
+        return cache_backends.RedisCache(namespace, 100, ttl, client=local_redis)
+    return factory
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_get_set_and_per_key_ttl(make, backend):
+    cache = make(backend)
+    cache.set(("Patient", "1"), {"name": "Maria"})
+    cache.set(("Patient", "2"), "kurz", ttl=0.05)
+    assert cache.get(("Patient", "1")) == {"name": "Maria"}
+    time.sleep(0.1)
+    assert cache.get(("Patient", "2")) is None
+    assert cache.get(("Patient", "2"), allow_stale=True) == "kurz"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_keys_include_expired_entries(make, backend):
+    cache = make(backend)
+    cache.set(("a", "1"), 1, ttl=0.01)
+    cache.set(("b", "2"), 2)
+    time.sleep(0.05)
+    assert sorted(cache.keys()) == [("a", "1"), ("b", "2")]
+    assert cache.values() == [2]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_single_flight_loads_a_cold_key_once(make, backend):
+    cache = make(backend)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return "wert"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["wert"] * 8 and len(calls) == 1
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "redis"))
+def test_lease_is_shared_between_workers(make, backend):
+    worker_a, worker_b = make(backend), make(backend)
+    token = worker_a.acquire_lease("k", 5)
+    assert token and worker_b.acquire_lease("k", 5) is None
+    worker_b.release_lease("k", "fremdes-token")  # gehört B nicht: bleibt liegen
+    assert worker_b.acquire_lease("k", 5) is None
+    worker_a.release_lease("k", token)
+    assert worker_b.acquire_lease("k", 0.05)
+    time.sleep(0.1)
+    assert worker_a.acquire_lease("k", 5)  # abgelaufen
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "redis"))
+def test_waiting_worker_does_not_release_the_loaders_lease(make, backend, monkeypatch):
+    monkeypatch.setattr(cache_backends, "SINGLE_FLIGHT_LEASE", 0.1)
+    loader_worker, waiting_worker, third_worker = make(backend), make(backend), make(backend)
+    assert loader_worker.acquire_lease("k", 60)  # lädt noch
+
+    assert waiting_worker.get_or_load("k", lambda: "selbst") == "selbst"  # nach Ablauf des Wartens
+
+    assert third_worker.acquire_lease("k", 60) is None
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "redis"))
+def test_second_worker_waits_for_the_first_load(make, backend):
+    worker_a, worker_b = make(backend), make(backend)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return "wert"
+
+    first = threading.Thread(target=lambda: worker_a.get_or_load("k", loader))
+    first.start()
+    time.sleep(0.05)
+    assert worker_b.get_or_load("k", loader) == "wert"
+    first.join()
+    assert len(calls) == 1
+
+
+# ----------------- SlotCache auf geteilten Backends -----------------
+
+def _slot_caches(make, backend):
+    """Zwei SlotCaches (Worker) auf demselben Backend."""
+    def worker():
+        cache = fhir_cache.SlotCache(backend="memory")
+        cache._windows = make(backend, "slots", ttl=60)
+        cache._booked = make(backend, "slots_booked", ttl=60)
+        return cache
+    if backend == "memory":
+        shared = worker()
+        return shared, shared
+    return worker(), worker()
+
+
+def _window(schedule_id="s1"):
+    day = (date.today() + timedelta(days=1)).isoformat()
+    slots = {f"slot-{h}": {"id": f"slot-{h}", "date": day, "time": f"{h:02d}:00", "label": ""} for h in (9, 10)}
+    return fhir_cache.SlotWindow(schedule_id, None, None, slots), day
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_revalidation_put_keeps_other_workers_booking(make, backend):
+    worker_a, worker_b = _slot_caches(make, backend)
+    window, day = _window()
+    worker_a.put(window)
+
+    revalidating = worker_a.get("s1", None, None)  # Worker A lädt das Fenster …
+    worker_b.mark_booked("s1", datetime.fromisoformat(f"{day}T09:00"))  # … B bucht …
+    worker_a.put(revalidating)  # … A legt sein (älteres) Fenster ab
+
+    assert [o["time"] for o in worker_a.get("s1", None, None).options()] == ["10:00"]
+    worker_a.mark_free("s1", datetime.fromisoformat(f"{day}T09:00"))
+    assert [o["time"] for o in worker_b.get("s1", None, None).options()] == ["09:00", "10:00"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_invalidate_removes_expired_windows(make, backend):
+    cache, _ = _slot_caches(make, backend)
+    window, _ = _window()
+    cache._windows.set(window.key, window.to_dict(), ttl=0.01)
+    time.sleep(0.05)
+    assert cache.get("s1", None, None, allow_stale=True) is not None
+
+    cache.invalidate("s1")
+    assert cache.get("s1", None, None, allow_stale=True) is None
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "redis"))
+def test_mark_booked_never_waits_for_a_held_lease(make, backend):
+    worker_a, worker_b = _slot_caches(make, backend)
+    window, day = _window()
+    worker_a.put(window)
+    assert worker_b._booked.acquire_lease("s1", 60)
+
+    t0 = time.monotonic()
+    worker_a.mark_booked("s1", datetime.fromisoformat(f"{day}T09:00"))
+    assert time.monotonic() - t0 < 0.5
+    assert worker_a.get("s1", None, None, allow_stale=True) is None  # Fenster wird neu geladen
@@ -0,0 +1,37 @@
+# tests/test_circuit_breaker.py
+import fhir_client as fhir
+
+BASE = "http://fhir.test/fhir/"
+
+
+def _breaker():
+    return fhir.CircuitBreaker(failure_threshold=2, reset_timeout=60, slow_call=1.0)
+
+
+def test_slow_reads_open_the_breaker():
+    breaker = _breaker()
+    for _ in range(2):
+        breaker.record_call("GET", "Slot?schedule=1", 200, 1.5, BASE)
+    assert breaker.is_open
+
+
+def test_slow_bundles_do_not_count_as_failures():
+    breaker = _breaker()
+    for path in ("", BASE):
+        for _ in range(3):
+            breaker.record_call("POST", path, 200, 30.0, BASE)
+    assert not breaker.is_open and breaker.failures == 0
+
+
+def test_failed_bundles_still_count():
+    breaker = _breaker()
+    breaker.record_call("POST", "", 503, 0.1, BASE)
+    breaker.record_call("POST", "", None, 10.0, BASE)  # Timeout
+    assert breaker.is_open
+
+
+def test_client_errors_are_not_server_failures():
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_call("GET", "Patient/x", 404, 0.1, BASE)
+    assert not breaker.is_open
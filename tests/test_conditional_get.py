@@ -0,0 +1,66 @@
+# tests/test_conditional_get.py
+from datetime import datetime, timedelta
+
+import database_service as ds
+import name_sync
+import page_cache
+from database_layer.db_instance import db
+from database_layer.fhir_name_entity import FHIRDisplayName
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+
+
+def _client(webapp, email):
+    client = webapp.test_client()
+    with client.session_transaction() as s:
+        s["user_email"] = email
+    return client
+
+
+def test_first_etag_is_valid_after_names_were_fetched(users, webapp):
+    # Namen noch nicht lokal: die erste Antwort holt sie von FHIR und speichert sie
+    FHIRDisplayName.query.delete()
+    db.session.commit()
+    client = _client(webapp, PATIENT)
+
+    first = client.get(f"/{PATIENT}")
+    assert first.status_code == 200 and first.headers.get("ETag")
+    assert FHIRDisplayName.query.count() > 0
+
+    again = client.get(f"/{PATIENT}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_booking_changes_the_etag(users, webapp):
+    client = _client(webapp, PATIENT)
+    first = client.get(f"/{PATIENT}")
+
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=3)
+    ds.create_appointment(users[PATIENT].id, users[GDA].id, start, start + timedelta(minutes=30), "")
+
+    again = client.get(f"/{PATIENT}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 200 and again.headers["ETag"] != first.headers["ETag"]
+
+
+class _Later(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        # Last-Modified hat Sekundenauflösung: neue Version sicher in einer späteren Sekunde
+        return datetime.now(tz) + timedelta(seconds=5)
+
+
+def test_last_modified_follows_name_changes(users, webapp, monkeypatch):
+    client = _client(webapp, PATIENT)
+    first = client.get(f"/{PATIENT}")
+    modified = first.headers["Last-Modified"]
+    assert client.get(f"/{PATIENT}", headers={"If-Modified-Since": modified}).status_code == 304
+
+    monkeypatch.setattr(page_cache, "datetime", _Later)
+    patient = users[PATIENT]
+    name_sync.store_names("Patient", {patient.fhir_patient_id: "Maria Neumann"})
+    db.session.commit()
+
+    response = client.get(f"/{PATIENT}", headers={"If-Modified-Since": modified})
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] != modified
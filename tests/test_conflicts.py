@@ -0,0 +1,74 @@
+# tests/test_conflicts.py
+from datetime import datetime, timedelta
+
+import pytest
+
+import conflicts
+import database_service as ds
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+OTHER_PATIENT = "felix.mueller@example.com"
+
+DAY = (datetime.now() + timedelta(days=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def at(hour, minute=0):
+    return DAY.replace(hour=hour, minute=minute)
+
+
+def _insert(patient, provider, start, end):
+    # direkt in die DB (wie Altdaten oder der Abgleich), ohne Prüfung
+    db.session.add(Appointment(patient_id=patient.id, provider_id=provider.id, start=start, end=end))
+    db.session.commit()
+
+
+def _book(users, patient, start, end):
+    return ds.create_appointment(users[patient].id, users[GDA].id, start, end, "")
+
+
+def test_overlap_hidden_behind_nested_appointment(users):
+    gda = users[GDA]
+    _insert(users[OTHER_PATIENT], gda, at(9), at(12))
+    _insert(users[OTHER_PATIENT], gda, at(9, 30), at(10))
+    with pytest.raises(conflicts.AppointmentConflict):
+        _book(users, PATIENT, at(10, 30), at(11))
+    assert Appointment.query.count() == 2
+
+
+def test_adjacent_appointments_are_allowed(users):
+    _book(users, PATIENT, at(9), at(9, 30))
+    _book(users, OTHER_PATIENT, at(9, 30), at(10))
+    assert Appointment.query.count() == 2
+
+
+def test_patient_cannot_be_double_booked(users):
+    other_gda = users["sophia.ingram@biomedical.org"]
+    _insert(users[PATIENT], other_gda, at(14), at(15))
+    with pytest.raises(conflicts.AppointmentConflict, match="Patient"):
+        _book(users, PATIENT, at(14, 30), at(15, 30))
+
+
+def test_open_ended_appointment_blocks_its_start(users):
+    _insert(users[OTHER_PATIENT], users[GDA], at(8), None)
+    with pytest.raises(conflicts.AppointmentConflict):
+        _book(users, PATIENT, at(7, 45), at(8, 15))
+    _book(users, PATIENT, at(8), at(8, 30))
+
+
+def test_find_overlap_ignores_the_new_row(users):
+    appt = _book(users, PATIENT, at(11), at(12))
+    assert conflicts.find_overlap(Appointment.provider_id, users[GDA].id, at(11), at(12),
+                                  exclude_id=appt.id) is None
+
+
+def test_interval_index_uses_running_max_end():
+    index = conflicts.IntervalIndex(DAY, [(1, at(9), at(12)), (2, at(9, 30), at(10))])
+    assert index.conflict(at(10, 30), at(11)) == 1
+    assert index.conflict(at(12), at(13)) is None
+    index.remove(1)
+    assert index.conflict(at(10, 30), at(11)) is None
+    index.add(3, at(10), at(11))
+    assert index.conflict(at(10, 30), at(10, 45)) == 3
@@ -0,0 +1,75 @@
+# tests/test_display_names.py
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import g
+
+import app as web
+import fhir_cache
+import fhir_client as fhir
+import name_sync
+from database_layer.user_entity import UserRoles
+
+
+def _patient(users):
+    return next(u for u in users.values() if u.fhir_patient_id)
+
+
+def test_open_breaker_serves_expired_names(users, webapp, fhir_server, monkeypatch):
+    patient = _patient(users)
+    key = fhir_cache.display_name_key("Patient", patient.fhir_patient_id)
+    fhir_cache.display_names.set(key, "Maria Alt", ttl=-1)
+    monkeypatch.setattr(name_sync, "lookup_names", lambda keys: {})
+    for _ in range(fhir.breaker.failure_threshold):
+        fhir.breaker.record(False)
+
+    with webapp.test_request_context():
+        assert web.resolve_display_names([patient]) == {patient.id: "Maria Alt"}
+        assert g.fhir_degraded
+    assert fhir_server.calls["GET Patient"] == 0
+
+
+def test_failed_search_serves_expired_names(users, webapp, monkeypatch):
+    patient = _patient(users)
+    key = fhir_cache.display_name_key("Patient", patient.fhir_patient_id)
+    fhir_cache.display_names.set(key, "Maria Alt", ttl=-1)
+    monkeypatch.setattr(name_sync, "lookup_names", lambda keys: {})
+
+    def broken(resource_type, ids):
+        raise fhir.FHIRUnavailable("down")
+
+    monkeypatch.setattr(fhir, "search_display_names", broken)
+    with webapp.test_request_context():
+        assert web.resolve_display_names([patient]) == {patient.id: "Maria Alt"}
+        assert g.fhir_degraded
+
+
+
+def test_concurrent_cold_names_are_searched_once(webapp, monkeypatch):
+    fhir.breaker.reset()
+    monkeypatch.setattr(name_sync, "lookup_names", lambda keys: {})
+    monkeypatch.setattr(name_sync, "save_fetched_names", lambda fetched: None)
+    searches = []
+
+    def slow_search(resource_type, ids):
+        searches.append(list(ids))
+        time.sleep(0.3)
+        return {i: "Kalt Start" for i in ids}
+
+    monkeypatch.setattr(fhir, "search_display_names", slow_search)
+    patient = SimpleNamespace(id=1, role=UserRoles.patient, fhir_patient_id="p-kalt")
+    results = []
+
+    def request():
+        with webapp.test_request_context():
+            results.append(web.resolve_display_names([patient]))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert searches == [["p-kalt"]]
+    assert results == [{1: "Kalt Start"}] * 4
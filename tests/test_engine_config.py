@@ -0,0 +1,34 @@
+# tests/test_engine_config.py
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+import database_service as ds
+
+
+def _configured(uri, **options):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    if options:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+    ds.configure_engine(app)
+    return app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+
+
+@pytest.mark.parametrize("uri", ["sqlite://", "sqlite:///:memory:"])
+def test_in_memory_sqlite_gets_no_queue_pool_options(uri):
+    options = _configured(uri)
+    assert not set(ds.QUEUE_POOL_OPTIONS) & set(options)
+    engine = create_engine(uri, **options)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_file_sqlite_and_server_urls_get_queue_pool_options(tmp_path):
+    assert _configured(f"sqlite:///{tmp_path / 'x.db'}")["pool_size"] == ds.QUEUE_POOL_OPTIONS["pool_size"]
+    assert "pool_size" in _configured("postgresql+psycopg://u:p@db/webb")
+
+
+def test_explicit_poolclass_wins():
+    assert "pool_size" not in _configured("postgresql+psycopg://u:p@db/webb", poolclass=NullPool)
@@ -0,0 +1,45 @@
+# tests/test_export.py
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import appointment_export
+from database_layer.appointment_entity import Appointment
+from database_layer.db_instance import db
+
+GDA = "alexander.owens@biomedical.org"
+OTHER_GDA = "sophia.ingram@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+
+
+def _client(webapp, email, role="gda"):
+    client = webapp.test_client()
+    with client.session_transaction() as s:
+        s["user_email"], s["user_role"] = email, role
+    return client
+
+
+def test_gda_exports_only_own_appointments(users, webapp):
+    start = datetime(2031, 3, 1, 9, 0)
+    for i, gda in enumerate((GDA, OTHER_GDA)):
+        db.session.add(Appointment(patient_id=users[PATIENT].id, provider_id=users[gda].id,
+                                   start=start + timedelta(hours=i), end=start + timedelta(hours=i, minutes=30)))
+    db.session.commit()
+
+    response = _client(webapp, GDA).get("/export/appointments?format=ndjson&from=2031-03-01")
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.status_code == 200
+    assert [r["provider_email"] for r in rows] == [GDA]
+
+
+def test_patients_cannot_export(users, webapp):
+    assert _client(webapp, PATIENT, role="patient").get("/export/appointments").status_code == 403
+
+
+def test_export_order_comes_from_an_index(app_ctx):
+    sql = str(appointment_export.export_query().compile(db.engine, compile_kwargs={"literal_binds": True}))
+    plan = " ".join(str(r[-1]) for r in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert appointment_export.EXPORT_INDEX.name in plan
+    assert "TEMP B-TREE" not in plan
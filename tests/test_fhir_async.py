@@ -0,0 +1,131 @@
+# tests/test_fhir_async.py
+from datetime import datetime
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import fhir_async  # noqa: E402
+import fhir_client as fhir  # noqa: E402
+
+
+def _client(handler, breaker=None):
+    client = fhir_async.AsyncFHIRClient(base_url="http://fhir.test/fhir", max_retries=3, backoff_factor=0,
+                                        circuit_breaker=breaker or fhir.CircuitBreaker())
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def _run(client, method):
+    async def main():
+        async with client:
+            return await client.request(method, "Patient", json={})
+    return fhir_async.run(main())
+
+
+@pytest.mark.parametrize("error", [httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError])
+def test_post_is_not_retried_after_it_may_have_arrived(error):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        raise error("boom", request=request)
+
+    with pytest.raises(error):
+        _run(_client(handler), "POST")
+    assert calls == ["POST"]
+
+
+def test_post_is_retried_when_connect_fails():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) < 3:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(201, json={"id": "1"})
+
+    assert _run(_client(handler), "POST").status_code == 201
+    assert len(calls) == 3
+
+
+def test_get_is_retried_on_read_timeout():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) < 2:
+            raise httpx.ReadTimeout("slow", request=request)
+        return httpx.Response(200, json={})
+
+    assert _run(_client(handler), "GET").status_code == 200
+    assert len(calls) == 2
+
+
+def test_open_breaker_rejects_without_request():
+    calls = []
+    breaker = fhir.CircuitBreaker(failure_threshold=1)
+    breaker.record(False)
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(200, json={})
+
+    with pytest.raises(fhir.FHIRUnavailable):
+        _run(_client(handler, breaker), "GET")
+    assert calls == []
+
+
+def test_retry_after_is_capped(monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(fhir_async.asyncio, "sleep", fake_sleep)
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) < 2:
+            return httpx.Response(503, headers={"Retry-After": "3600"})
+        return httpx.Response(200, json={})
+
+    client = _client(handler)
+    client.backoff_max = 5
+    assert _run(client, "GET").status_code == 200
+    assert slept == [5]
+
+
+def test_operations_go_through_the_retrying_client(monkeypatch):
+    monkeypatch.setattr(fhir, "USE_REAL", True)
+    calls = []
+
+    def handler(request):
+        calls.append((request.method, request.url.path, request.url.params.get("_id")))
+        if request.method == "POST" and len(calls) == 1:
+            return httpx.Response(503)
+        if request.method == "POST":
+            return httpx.Response(201, json={"resourceType": "Appointment", "id": "a1"})
+        if request.method == "DELETE":
+            return httpx.Response(404)
+        return httpx.Response(200, json={"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Patient", "id": "p1", "name": [{"given": ["Maria"], "family": "Muster"}]}},
+        ]})
+
+    async def main():
+        async with _client(handler) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                # 503 auf POST: nicht wiederholt
+                await client.create_appointment("p1", "pr1", datetime(2030, 1, 1, 9), datetime(2030, 1, 1, 10), "")
+            appointment_id = await client.create_appointment("p1", "pr1", datetime(2030, 1, 1, 9),
+                                                             datetime(2030, 1, 1, 10), "")
+            await client.delete_appointment(appointment_id)
+            names = await client.read_display_names([("Patient", "p1")])
+        return appointment_id, names
+
+    appointment_id, names = fhir_async.run(main())
+    assert appointment_id == "a1"
+    assert names == {("Patient", "p1"): "Maria Muster"}
+    assert [c[0] for c in calls] == ["POST", "POST", "DELETE", "GET"]
+    assert calls[-1] == ("GET", "/fhir/Patient", "p1")
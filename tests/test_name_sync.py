@@ -0,0 +1,61 @@
+# tests/test_name_sync.py
+import fhir_client as fhir
+import name_sync
+
+PATIENT = "maria.schneider@example.com"
+
+
+def _spy_pages(monkeypatch):
+    seen = []
+    original = fhir.iter_bundle_pages
+
+    def spy(path, params=None, *args, **kwargs):
+        seen.append((path, dict(params or {})))
+        return original(path, params, *args, **kwargs)
+
+    monkeypatch.setattr(fhir, "iter_bundle_pages", spy)
+    return seen
+
+
+def _rename(server, fhir_id, family):
+    res = server.store.read("Patient", fhir_id)
+    res["name"] = [{"given": ["Maria"], "family": family}]
+    server.store.update("Patient", fhir_id, res)
+
+
+def test_sync_only_asks_for_known_ids(users, fhir_server, monkeypatch):
+    name_sync.sync_resource_type("Patient")
+    fhir_server.store.create({"resourceType": "Patient", "name": [{"family": "Fremd"}]})
+    patient_id = users[PATIENT].fhir_patient_id
+    _rename(fhir_server, patient_id, "Neumann")
+
+    seen = _spy_pages(monkeypatch)
+    result = name_sync.sync_resource_type("Patient")
+
+    known = name_sync.known_ids("Patient")
+    assert seen and all(path == "Patient" for path, _ in seen)
+    for _, params in seen:
+        # Namen nur seit dem Cursor, sonst nur die Existenzprüfung (ohne Namen)
+        assert params.get("_elements") == "id" or params["_lastUpdated"].startswith("gt")
+        assert set(params["_id"].split(",")) <= known
+    assert result["updated"] == 1
+    assert "Neumann" in name_sync.lookup_names([("Patient", patient_id)])[("Patient", patient_id)]
+
+
+def test_deleted_resources_are_removed(users, fhir_server):
+    name_sync.sync_resource_type("Patient")
+    patient_id = users[PATIENT].fhir_patient_id
+    key = ("Patient", patient_id)
+    assert key in name_sync.lookup_names([key])
+
+    fhir_server.store.delete("Patient", patient_id)
+    result = name_sync.sync_resource_type("Patient")
+
+    assert result["deleted"] == 1
+    assert name_sync.lookup_names([key]) == {}
+
+
+def test_max_instant_compares_points_in_time():
+    assert fhir._max_instant("2030-01-01T10:30:00+02:00", "2030-01-01T09:00:00Z") == "2030-01-01T09:00:00Z"
+    assert fhir._max_instant("2030-01-01T10:30:00.5Z", None) == "2030-01-01T10:30:00.5Z"
+    assert fhir._max_instant(None, None) is None
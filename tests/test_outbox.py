@@ -0,0 +1,89 @@
+# tests/test_outbox.py
+from datetime import datetime, timedelta
+
+import database_service as ds
+import fhir_client as fhir
+import outbox
+from database_layer.db_instance import db
+from database_layer.outbox_entity import OutboxEntry, OutboxOperation, OutboxStatus
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+
+
+def _book(users, hours=48):
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=hours)
+    return ds.create_appointment(users[PATIENT].id, users[GDA].id, start, start + timedelta(minutes=30), "")
+
+
+def _make_due():
+    db.session.query(OutboxEntry).filter(OutboxEntry.status == OutboxStatus.pending).update(
+        {OutboxEntry.next_attempt_at: datetime.now() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def _drain():
+    for _ in range(10):
+        _make_due()
+        if not outbox.process_pending():
+            return
+    raise AssertionError("outbox not drained")
+
+
+def _fhir_appointments(server):
+    return server.store.search("Appointment", [])
+
+
+def test_create_is_sent_and_links_fhir_id(users, fhir_server):
+    appt = _book(users)
+    _drain()
+    db.session.refresh(appt)
+    assert appt.fhir_appointment_id
+    assert [a["id"] for a in _fhir_appointments(fhir_server)] == [appt.fhir_appointment_id]
+
+
+def test_cancel_before_send_discards_create(users, fhir_server):
+    appt = _book(users)
+    ds.delete_appointment_local_and_fhir(appt)
+    _drain()
+    assert _fhir_appointments(fhir_server) == []
+    assert fhir_server.calls["POST Bundle"] == 0
+    assert OutboxEntry.query.filter_by(status=OutboxStatus.pending).count() == 0
+
+
+def test_cancel_during_backoff_waits_for_create(users, fhir_server):
+    appt = _book(users)
+    fhir_server.error_rate = 1.0  # Anlegen scheitert mit 503 -> Backoff
+    _make_due()
+    outbox.process_pending()
+    fhir_server.error_rate = 0.0
+    fhir.breaker.reset()
+    create = OutboxEntry.query.filter_by(operation=OutboxOperation.create_appointment).one()
+    assert create.status == OutboxStatus.pending and create.attempts == 1
+
+    ds.delete_appointment_local_and_fhir(appt)
+    delete = OutboxEntry.query.filter_by(operation=OutboxOperation.delete_appointment).one()
+
+    # das Löschen wird nicht abgeholt, solange das Anlegen aussteht
+    db.session.query(OutboxEntry).filter_by(id=delete.id).update(
+        {OutboxEntry.next_attempt_at: datetime.now() - timedelta(seconds=1)})
+    db.session.commit()
+    assert delete.id not in [e.id for e in outbox._claim(10)]
+
+    _drain()
+    assert _fhir_appointments(fhir_server) == []
+    db.session.refresh(create)
+    db.session.refresh(delete)
+    assert create.status == OutboxStatus.done and delete.status == OutboxStatus.done
+
+
+def test_delete_404_is_retried_while_create_outstanding(users, fhir_server):
+    appt = _book(users)
+    create = OutboxEntry.query.filter_by(operation=OutboxOperation.create_appointment).one()
+    create.attempts = 1  # schon einmal versucht: darf nicht verworfen werden
+    db.session.commit()
+    ds.delete_appointment_local_and_fhir(appt)
+    delete = OutboxEntry.query.filter_by(operation=OutboxOperation.delete_appointment).one()
+
+    results = outbox._send([delete])
+    assert results[0][0] is False  # 404, aber das Anlegen steht noch aus
@@ -0,0 +1,72 @@
+# tests/test_pagination.py
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import database_service as ds
+from database_layer.db_instance import db
+from database_layer.appointment_entity import Appointment
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+NOW = datetime(2030, 1, 15, 12, 0)
+
+
+def _fill(users, count=45):
+    patient, gda = users[PATIENT], users[GDA]
+    rows = []
+    for i in range(count):
+        # je zwei Termine mit gleichem Beginn: die ID entscheidet die Reihenfolge
+        start = NOW + timedelta(hours=(i // 2) - 10)
+        rows.append(Appointment(patient_id=patient.id, provider_id=gda.id, start=start,
+                                end=start + timedelta(minutes=30)))
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def _all_pages(user, window, limit=7):
+    seen, cursor, pages = [], None, 0
+    while True:
+        rows, next_cursor = ds.fetch_appointments_page(user, window, ds.decode_cursor(cursor), limit, now=NOW)
+        seen.extend(rows)
+        pages += 1
+        if next_cursor is None:
+            return seen, pages
+        cursor = next_cursor
+
+
+def test_upcoming_pages_are_complete_and_ordered(users):
+    rows = _fill(users)
+    seen, pages = _all_pages(users[PATIENT], "upcoming")
+    expected = sorted((r for r in rows if r.start >= NOW), key=lambda r: (r.start, r.id))
+    assert [a.id for a in seen] == [a.id for a in expected]
+    assert pages == -(-len(expected) // 7)
+
+
+def test_past_pages_are_descending(users):
+    rows = _fill(users)
+    seen, _ = _all_pages(users[PATIENT], "past")
+    expected = sorted((r for r in rows if r.start < NOW), key=lambda r: (r.start, r.id), reverse=True)
+    assert [a.id for a in seen] == [a.id for a in expected]
+
+
+def test_provider_sees_same_appointments(users):
+    _fill(users)
+    patient_side, _ = _all_pages(users[PATIENT], "upcoming")
+    provider_side, _ = _all_pages(users[GDA], "upcoming")
+    assert [a.id for a in patient_side] == [a.id for a in provider_side]
+
+
+def test_cursor_round_trip_and_garbage():
+    appt = Appointment(id=42, start=datetime(2030, 1, 2, 9, 30))
+    assert ds.decode_cursor(ds.encode_cursor(appt)) == (datetime(2030, 1, 2, 9, 30), 42)
+    assert ds.decode_cursor("nonsense") is None
+    assert ds.decode_cursor("") is None
+
+
+def test_only_covering_indexes_exist(app_ctx):
+    names = {r[0] for r in db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'appointments'"))}
+    assert "ix_appointments_patient_start_end" in names
+    assert not names & set(ds.OBSOLETE_INDEXES)
@@ -0,0 +1,137 @@
+# tests/test_reconcile.py
+from datetime import datetime, timedelta
+
+import database_service as ds
+import fhir_cache
+import fhir_client as fhir
+import reconcile
+from database_layer.appointment_entity import Appointment
+from database_layer.db_instance import db
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+OTHER_PATIENT = "felix.mueller@example.com"
+
+
+def _start(hours=0):
+    day = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=40)
+    return day + timedelta(hours=hours)
+
+
+def _remote(server, users, patient, start, minutes=30):
+    body = fhir.appointment_body(users[patient].fhir_patient_id, users[GDA].fhir_practitioner_id,
+                                 start, start + timedelta(minutes=minutes), "")
+    _, res = server.store.create(body)
+    return res
+
+
+def test_overlapping_fhir_appointment_is_not_imported(users, fhir_server):
+    ds.create_appointment(users[PATIENT].id, users[GDA].id, _start(), _start() + timedelta(minutes=30), "")
+    clash = _remote(fhir_server, users, OTHER_PATIENT, _start() + timedelta(minutes=15))
+    free = _remote(fhir_server, users, OTHER_PATIENT, _start(2))
+
+    stats = reconcile.pull_changes(full=True)
+
+    assert stats["conflicts"] == 1 and stats["created"] == 1
+    imported = {a.fhir_appointment_id for a in Appointment.query.filter(Appointment.fhir_appointment_id.isnot(None))}
+    assert free["id"] in imported and clash["id"] not in imported
+
+
+def test_overlaps_within_one_page_are_detected(users, fhir_server):
+    _remote(fhir_server, users, PATIENT, _start())
+    _remote(fhir_server, users, OTHER_PATIENT, _start() + timedelta(minutes=10))
+
+    stats = reconcile.pull_changes(full=True)
+
+    assert stats["created"] == 1 and stats["conflicts"] == 1
+
+
+def test_cancelled_on_fhir_frees_the_slot(users, fhir_server, monkeypatch):
+    res = _remote(fhir_server, users, PATIENT, _start())
+    schedule_id = users[GDA].fhir_schedule_id
+    reconcile.pull_changes(full=True)
+    freed = []
+    monkeypatch.setattr(fhir_cache.slots, "mark_free", lambda schedule_id, start: freed.append((schedule_id, start)))
+
+    res["status"] = "cancelled"
+    fhir_server.store.update("Appointment", res["id"], res)
+    stats = reconcile.pull_changes()
+
+    assert stats["deleted"] == 1
+    assert schedule_id and freed == [(schedule_id, _start())]
+
+
+def test_lease_is_exclusive_until_released_or_expired(app_ctx):
+    assert ds.acquire_lease("job", "a", ttl=60)
+    assert ds.acquire_lease("job", "a", ttl=60)  # verlängern
+    assert not ds.acquire_lease("job", "b", ttl=60)
+    ds.release_lease("job", "a")
+    assert ds.acquire_lease("job", "b", ttl=60)
+    assert ds.acquire_lease("job", "a", ttl=0)  # abgelaufen
+
+
+def test_reconcile_skips_while_another_process_holds_the_lease(users, fhir_server):
+    _remote(fhir_server, users, PATIENT, _start())
+    assert ds.acquire_lease("reconcile", "other-host:1", reconcile.RECONCILE_LEASE_TTL)
+
+    assert reconcile.reconcile() == {}
+    assert Appointment.query.filter(Appointment.fhir_appointment_id.isnot(None)).count() == 0
+
+    ds.release_lease("reconcile", "other-host:1")
+    assert reconcile.reconcile()["created"] == 1
+    db.session.remove()
+
+
+def test_open_ended_fhir_appointment_is_skipped(users, fhir_server):
+    res = _remote(fhir_server, users, PATIENT, _start())
+    del res["end"]
+    fhir_server.store.update("Appointment", res["id"], res)
+
+    stats = reconcile.pull_changes(full=True)
+
+    assert stats["no_end"] == 1 and stats["created"] == 0
+
+
+def test_booking_page_renders_appointments_without_end(users, webapp):
+    db.session.add(Appointment(patient_id=users[PATIENT].id, provider_id=users[GDA].id, start=_start(), end=None))
+    db.session.commit()
+    client = webapp.test_client()
+    with client.session_transaction() as s:
+        s["user_email"] = PATIENT
+
+    response = client.get(f"/{PATIENT}")
+
+    assert response.status_code == 200
+    assert _start().strftime("%H:%M").encode() in response.data
+
+
+def test_remote_move_onto_another_appointment_is_not_applied(users, fhir_server):
+    _remote(fhir_server, users, PATIENT, _start())
+    moved = _remote(fhir_server, users, OTHER_PATIENT, _start(2))
+    reconcile.pull_changes(full=True)
+
+    moved["start"] = (_start() + timedelta(minutes=10)).isoformat()
+    moved["end"] = (_start() + timedelta(minutes=40)).isoformat()
+    fhir_server.store.update("Appointment", moved["id"], moved)
+    stats = reconcile.pull_changes()
+
+    assert stats["conflicts"] == 1 and stats["updated"] == 0
+    local = Appointment.query.filter_by(fhir_appointment_id=moved["id"]).one()
+    assert local.start == _start(2)
+
+
+def test_remote_moves_into_a_freed_slot_are_applied(users, fhir_server):
+    first = _remote(fhir_server, users, PATIENT, _start())
+    second = _remote(fhir_server, users, OTHER_PATIENT, _start(2))
+    reconcile.pull_changes(full=True)
+
+    # beide auf einer Seite: der erste zieht weg, der zweite auf seinen alten Platz
+    for res, start in ((first, _start(4)), (second, _start())):
+        res["start"] = start.isoformat()
+        res["end"] = (start + timedelta(minutes=30)).isoformat()
+        fhir_server.store.update("Appointment", res["id"], res)
+    stats = reconcile.pull_changes()
+
+    assert stats["conflicts"] == 0 and stats["updated"] == 2
+    starts = {a.fhir_appointment_id: a.start for a in Appointment.query.filter(Appointment.fhir_appointment_id.isnot(None))}
+    assert starts == {first["id"]: _start(4), second["id"]: _start()}
@@ -0,0 +1,66 @@
+# tests/test_schedule_templates.py
+from datetime import datetime
+
+import pytest
+
+import schedule_templates as st
+from database_layer.appointment_entity import Appointment
+from database_layer.db_instance import db
+
+np = pytest.importorskip("numpy")
+
+GDA = "alexander.owens@biomedical.org"
+PATIENT = "maria.schneider@example.com"
+MONDAY = datetime(2031, 3, 3)  # Montag
+
+
+def _template(**kwargs):
+    return st.ScheduleTemplate({"mon": [["08:00", "10:00"]], "tue": [["09:00", "10:00", 20]]}, 30, **kwargs)
+
+
+def _times(values):
+    return [v.strftime("%a %H:%M") for v in values.tolist()]
+
+
+def test_expand_weekly_blocks_with_own_slot_length():
+    starts, ends = st.expand(_template(), MONDAY, datetime(2031, 3, 5))
+    assert _times(starts) == ["Mon 08:00", "Mon 08:30", "Mon 09:00", "Mon 09:30",
+                              "Tue 09:00", "Tue 09:20", "Tue 09:40"]
+    assert (ends - starts).astype("int64").tolist() == [30] * 4 + [20] * 3
+
+
+def test_expand_drops_breaks_and_holidays():
+    template = _template(breaks=[["08:45", "09:00"]], holidays=["2031-03-04"])
+    starts, _ = st.expand(template, MONDAY, datetime(2031, 3, 5))
+    assert _times(starts) == ["Mon 08:00", "Mon 09:00", "Mon 09:30"]
+
+
+def test_expand_respects_start_and_end_within_a_day():
+    starts, ends = st.expand(_template(), datetime(2031, 3, 3, 8, 45), datetime(2031, 3, 4, 9, 30))
+    assert _times(starts) == ["Mon 09:00", "Mon 09:30", "Tue 09:00"]
+    assert ends.max() <= np.datetime64("2031-03-04T09:30")
+
+
+def test_generate_subtracts_bookings_including_open_ended(users):
+    gda = users[GDA]
+    db.session.add_all([
+        Appointment(patient_id=users[PATIENT].id, provider_id=gda.id,
+                    start=datetime(2031, 3, 3, 8, 10), end=datetime(2031, 3, 3, 8, 40)),
+        # ohne Ende: belegt eine Slot-Länge ab Beginn
+        Appointment(patient_id=users[PATIENT].id, provider_id=gda.id, start=datetime(2031, 3, 3, 9, 30), end=None),
+    ])
+    db.session.commit()
+
+    generated = st.generate(_template(), [gda.id], MONDAY, datetime(2031, 3, 4))
+    starts, _ = generated[gda.id]
+    assert _times(starts) == ["Mon 09:00"]
+
+
+def test_booked_intervals_give_open_ended_appointments_a_slot_length(users):
+    gda = users[GDA]
+    db.session.add(Appointment(patient_id=users[PATIENT].id, provider_id=gda.id,
+                               start=datetime(2031, 3, 2, 23, 50), end=None))
+    db.session.commit()
+
+    _, ends = st.booked_intervals([gda.id], MONDAY, datetime(2031, 3, 4), slot_minutes=30)[gda.id]
+    assert ends.tolist() == [datetime(2031, 3, 3, 0, 20)]
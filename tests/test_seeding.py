@@ -0,0 +1,26 @@
+# tests/test_seeding.py
+import fhir_client as fhir
+import seeding
+
+PRACTITIONER = "990001"
+
+
+def _schedules(server):
+    return server.store.search("Schedule", [("actor", f"Practitioner/{PRACTITIONER}")])
+
+
+def test_foreign_schedules_for_the_same_practitioner_are_ignored(app_ctx, fhir_server):
+    for _ in range(2):  # fremde Schedules (z. B. andere Nutzer des öffentlichen Servers)
+        fhir_server.store.create(fhir.schedule_body(PRACTITIONER))
+
+    first = seeding.ensure_schedule(PRACTITIONER)
+    assert first and seeding.ensure_schedule(PRACTITIONER) == first
+    assert len(_schedules(fhir_server)) == 3
+
+
+def test_duplicate_seed_schedules_fall_back_to_the_oldest(app_ctx, fhir_server):
+    _, oldest = fhir_server.store.create(seeding.schedule_body(PRACTITIONER))
+    fhir_server.store.create(seeding.schedule_body(PRACTITIONER))
+
+    assert seeding.ensure_schedule(PRACTITIONER) == oldest["id"]
+    assert len(_schedules(fhir_server)) == 2
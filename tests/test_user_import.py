@@ -0,0 +1,37 @@
+# tests/test_user_import.py
+import csv
+
+import database_service as ds
+import user_import
+from database_layer.user_entity import User
+
+
+def _write_csv(path, count):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=user_import.IMPORT_FIELDS)
+        writer.writeheader()
+        for i in range(1, count + 1):
+            writer.writerow({"first_name": "Import", "last_name": f"Nr{i}",
+                             "email": f"import{i}@example.com", "password": "pw"})
+    return str(path)
+
+
+def test_failed_rows_are_retried_on_resume(app_ctx, tmp_path, monkeypatch):
+    path = _write_csv(tmp_path / "patients.csv", 6)
+    original = user_import.create_fhir_patients
+
+    def flaky(records):
+        ids = original(records)
+        return [None if r["email"] == "import3@example.com" else fhir_id for r, fhir_id in zip(records, ids)]
+
+    monkeypatch.setattr(user_import, "create_fhir_patients", flaky)
+    first = user_import.import_users(path, chunk_size=2)
+    assert first["created"] == 5 and first["failed"] == 1 and first["retry_from_line"] == 3
+    assert ds.get_sync_state(user_import.checkpoint_key(path)) == "2"
+
+    monkeypatch.setattr(user_import, "create_fhir_patients", original)
+    second = user_import.import_users(path, chunk_size=2)
+    assert second["resumed_from_line"] == 2
+    assert second["created"] == 1 and second["existing"] == 3 and second["failed"] == 0
+    assert ds.get_sync_state(user_import.checkpoint_key(path)) == "6"
+    assert User.query.filter(User.email.like("import%@example.com")).count() == 6
@@ -0,0 +1,217 @@
+# user_import.py
+"""
+Massenimport von Patienten aus CSV oder NDJSON.
+
+Pro Block (IMPORT_CHUNK_SIZE Zeilen):
+1. bereits vorhandene E-Mails überspringen (eine Abfrage)
+2. FHIR-Patienten mit einem Batch-Bundle anlegen, bedingt über
+   ifNoneExist "email=…" - ein wiederholter Block legt nichts doppelt an
+3. User-Zeilen mit einem INSERT (executemany) einfügen, Namen in die
+   Namenstabelle, Checkpoint (letzte Zeilennummer) - alles in einem Commit
+
+Während ein Block in die DB geschrieben wird, läuft schon das Bundle des
+nächsten. Nach einem Abbruch setzt derselbe Aufruf hinter dem Checkpoint fort.
+Scheitert das Anlegen einzelner Patienten auf FHIR, bleibt der Checkpoint vor
+der ersten dieser Zeilen stehen: der nächste Aufruf versucht sie erneut, die
+schon importierten Zeilen dahinter zählen dann als vorhanden.
+
+CSV-Spalten / NDJSON-Felder: first_name, last_name, email, password
+
+    flask import-users patients.csv --chunk-size 500
+"""
+
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import quote
+
+from sqlalchemy import insert
+
+import fhir_client as fhir
+import database_service as ds
+import name_sync
+from database_layer.db_instance import db
+from database_layer.user_entity import User, UserRoles
+
+log = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_FIELDS = ("first_name", "last_name", "email", "password")
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.created = 0
+        self.existing = 0
+        self.failed = 0
+        self.resumed_from = 0
+        self.first_failed = None  # erste Zeile, deren FHIR-Patient nicht angelegt wurde
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "read": self.read,
+            "created": self.created,
+            "existing": self.existing,
+            "failed": self.failed,
+            "resumed_from_line": self.resumed_from,
+            "retry_from_line": self.first_failed,
+            "seconds": round(self.elapsed, 2),
+            "rows_per_second": round(self.read / self.elapsed, 1) if self.elapsed else 0.0,
+        }
+
+
+# ----------------- Lesen -----------------
+
+def detect_format(path: str) -> str:
+    return "ndjson" if path.lower().endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def iter_records(path: str, fmt: str | None = None):
+    """Liest die Datei zeilenweise; liefert (zeilennummer, record)."""
+    fmt = fmt or detect_format(path)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(f), start=1):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, json.loads(line)
+
+
+def _clean(record: dict) -> dict | None:
+    rec = {k: (record.get(k) or "").strip() for k in IMPORT_FIELDS}
+    if not rec["email"] or not rec["password"]:
+        return None
+    rec["email"] = rec["email"].lower()
+    return rec
+
+
+def _chunks(iterable, size: int):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def checkpoint_key(path: str) -> str:
+    # Größe gehört dazu: eine neue Datei unter gleichem Namen beginnt von vorn
+    return f"user_import:{os.path.abspath(path)}:{os.path.getsize(path)}"
+
+
+# ----------------- FHIR -----------------
+
+def _email_condition(email: str) -> str:
+    return f"email={quote(email)}"
+
+
+def create_fhir_patients(records: list[dict]) -> list[str | None]:
+    """Legt die Patienten mit einem Batch-Bundle an; None für fehlgeschlagene Einträge."""
+    if not records:
+        return []
+    bodies = [fhir.patient_body(r["first_name"], r["last_name"], r["email"]) for r in records]
+    conditions = [_email_condition(r["email"]) for r in records]
+    if not (fhir.USE_REAL and fhir.requests):
+        return fhir.create_resources("Patient", bodies)
+
+    if fhir.bundles_supported():
+        try:
+            responses = fhir.send_bundle(fhir.post_entries(bodies, conditions), bundle_type="batch")
+            ids = []
+            for rec, resp in zip(records, responses):
+                status = resp.get("status", "")
+                if status.startswith("2"):
+                    ids.append(fhir.id_from_location(resp.get("location")))
+                else:
+                    log.warning("FHIR Patient for %s failed: %s %s", rec["email"], status, resp.get("outcome", ""))
+                    ids.append(None)
+            return ids
+        except fhir.BundleNotSupported:
+            pass
+    # Einzel-POSTs (parallel im Bulk-Pool), weiterhin bedingt
+    return fhir.create_resources("Patient", bodies, if_none_exist=conditions)
+
+
+# ----------------- Import -----------------
+
+def _new_records(chunk: list[tuple[int, dict]], stats: ImportStats) -> list[dict]:
+    """Bereinigt, entfernt Dubletten im Block und lokal schon vorhandene E-Mails."""
+    records = {}
+    for line_no, raw in chunk:
+        rec = _clean(raw)
+        if rec is None:
+            stats.failed += 1
+            log.warning("Line %s skipped: email and password are required", line_no)
+            continue
+        rec["line"] = line_no
+        records.setdefault(rec["email"], rec)
+    if not records:
+        return []
+    existing = {
+        email for (email,) in
+        db.session.query(User.email).filter(User.email.in_(list(records)))
+    }
+    stats.existing += len(existing)
+    return [rec for email, rec in records.items() if email not in existing]
+
+
+def _store_chunk(records: list[dict], fhir_ids: list[str | None], last_line: int,
+                 key: str, stats: ImportStats) -> None:
+    rows, names = [], {}
+    for rec, fhir_id in zip(records, fhir_ids):
+        if not fhir_id:
+            stats.failed += 1
+            stats.first_failed = min(rec["line"], stats.first_failed or rec["line"])
+            continue
+        rows.append({"email": rec["email"], "role": UserRoles.patient,
+                     "password": rec["password"], "fhir_patient_id": fhir_id})
+        names[fhir_id] = f"{rec['first_name']} {rec['last_name']}".strip()
+    if rows:
+        db.session.execute(insert(User), rows)  # ein INSERT, executemany
+        name_sync.store_names("Patient", names)
+    # nicht über eine fehlgeschlagene Zeile hinaus, sonst würde sie nie wiederholt
+    checkpoint = last_line if stats.first_failed is None else stats.first_failed - 1
+    ds.set_sync_state(key, str(checkpoint))
+    db.session.commit()
+    stats.created += len(rows)
+
+
+def import_users(path: str, fmt: str | None = None, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 restart: bool = False) -> dict:
+    """Importiert die Datei (braucht App-Context); Rückgabe: Zähler + Durchsatz."""
+    stats = ImportStats()
+    key = checkpoint_key(path)
+    if restart:
+        ds.set_sync_state(key, None)
+        db.session.commit()
+    done = int(ds.get_sync_state(key) or 0)
+    stats.resumed_from = done
+
+    records = ((n, r) for n, r in iter_records(path, fmt) if n > done)
+    pending = None  # (records, last_line, future) des vorigen Blocks
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-import") as pool:
+        for chunk in _chunks(records, chunk_size):
+            stats.read += len(chunk)
+            new = _new_records(chunk, stats)
+            if pending:
+                # der vorige Block ist noch nicht in der DB: gleiche E-Mails dort nicht doppelt
+                in_flight = {r["email"] for r in pending[0]}
+                stats.existing += sum(r["email"] in in_flight for r in new)
+                new = [r for r in new if r["email"] not in in_flight]
+            future = pool.submit(create_fhir_patients, new)
+            if pending:
+                _store_chunk(pending[0], pending[2].result(), pending[1], key, stats)
+                log.info("Imported %s rows (%.0f rows/s)", stats.read, stats.read / stats.elapsed)
+            pending = (new, chunk[-1][0], future)
+        if pending:
+            _store_chunk(pending[0], pending[2].result(), pending[1], key, stats)
+    return stats.as_dict()